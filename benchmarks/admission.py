@@ -0,0 +1,99 @@
+"""Tail latency of a burst of questions with and without LLM admission control
+
+A burst of chat sessions asks questions at once through query_total_chain
+against local stand-ins for Chroma, Arranger and an Ollama server whose
+generations share one CPU (the latency per token grows with the number of
+generations running). Admission control is off (every generation runs at
+once) and then on (settings.LLM_MAX_IN_FLIGHT generations at once, the
+rest queued up to LLM_MAX_QUEUE and LLM_QUEUE_TIMEOUT), and the latency
+percentiles of the answered questions and the number of rejected
+questions are reported.
+
+Usage: python -m benchmarks.admission [--sessions 40] [--max-in-flight 2] [--max-queue 32]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+async def burst(query_graphql, chain, questions: list[str]) -> tuple[list[float], int]:
+    """Latencies of the answered questions and number of rejected questions"""
+    from overture_chatbot.admission import LLMOverloadedError
+
+    async def session(question: str) -> float | None:
+        start = time.perf_counter()
+        try:
+            await chain.ainvoke({'query': question})
+        except LLMOverloadedError:
+            return None
+        return time.perf_counter() - start
+
+    results = await asyncio.gather(*[session(question) for question in questions])
+    latencies = [latency for latency in results if latency is not None]
+
+    return latencies, len(results) - len(latencies)
+
+
+async def compare(query_graphql, questions: list[str], max_in_flight: int):
+    """Print the latencies of the burst with admission control off and on"""
+    chain = query_graphql.get_query_total_chain()
+    await chain.ainvoke({'query': 'warm up'})
+
+    for name, limit in (('off', len(questions) * 3), ('on', max_in_flight)):
+        query_graphql.llm_admission.max_in_flight = limit
+        latencies, rejected = await burst(query_graphql, chain, questions)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0,) * 3
+        print(
+            f'admission {name:>3}: p50 {p50*1e3:7.1f} ms, p95 {p95*1e3:7.1f} ms, '
+            f'p99 {p99*1e3:7.1f} ms, {rejected} rejected'
+        )
+    stats = query_graphql.llm_admission.stats()
+    print(
+        f"queue wait: max {stats['max_wait_seconds']*1e3:.1f} ms, "
+        f"{stats['timed_out']} timed out"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=40)
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    parser.add_argument('--max-in-flight', type=int, default=2)
+    parser.add_argument('--max-queue', type=int, default=32)
+    parser.add_argument('--queue-timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency, shared_cpu=True).start(process=True) as ollama, \
+            stub_arranger().start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'LLM_MAX_IN_FLIGHT': str(args.max_in_flight),
+            'LLM_MAX_QUEUE': str(args.max_queue),
+            'LLM_QUEUE_TIMEOUT': str(args.queue_timeout),
+            # every question does the full work
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0',
+            'SINGLE_FLIGHT': 'false'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        questions = [f'Find the number of males ({i})' for i in range(args.sessions)]
+        asyncio.run(compare(query_graphql, questions, args.max_in_flight))
+
+
+if __name__ == '__main__':
+    main()
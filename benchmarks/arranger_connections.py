@@ -0,0 +1,53 @@
+"""Benchmark connections opened per Arranger query
+
+Compares the pooled client in overture_chatbot.arranger against a
+bare requests.post per query (the previous behaviour) using a local stub
+GraphQL server.
+
+Usage: python -m benchmarks.arranger_connections [--queries 1000] [--threads 8]
+"""
+
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from overture_chatbot import arranger
+from benchmarks.stubs import stub_arranger
+
+QUERY = '{file{hits(filters:{op: "and", content: []}){total}}}'
+
+
+def run(send, url: str, queries: int, threads: int) -> float:
+    """Send queries with a thread pool and return elapsed seconds"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: send(url), range(queries)))
+    return time.perf_counter() - start
+
+
+def send_unpooled(url: str):
+    requests.post(url=url, json={'query': QUERY}, timeout=30).json()
+
+
+def send_pooled(url: str):
+    arranger.post_graphql(QUERY, url=url)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    for name, send in [('unpooled', send_unpooled), ('pooled', send_pooled)]:
+        with stub_arranger() as server:
+            elapsed = run(send, server.url, args.queries, args.threads)
+            print(
+                f'{name:>9}: {server.connections} connections for '
+                f'{server.requests} queries ({elapsed:.2f}s)'
+            )
+        arranger.close_sessions()
+
+
+if __name__ == '__main__':
+    main()
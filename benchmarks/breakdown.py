@@ -0,0 +1,68 @@
+"""Time, LLM generations and Arranger requests of a breakdown question
+
+Answers 'How many samples per host gender' against local stand-ins for
+Chroma, Arranger and Ollama, once as one total question per value of the
+field through query_total_chain (the only way before query_breakdown_chain)
+and once through query_chain, which routes it to query_breakdown_chain
+and a single Arranger aggregation query. Caches are off so that every
+question generates its SQON and queries Arranger.
+
+Usage: python -m benchmarks.breakdown [--arranger-latency 0.05] [--token-latency 0.005]
+"""
+
+import argparse
+import os
+import time
+from benchmarks.stubs import STUB_BUCKETS, STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0',
+            'SINGLE_FLIGHT': 'false'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        total_chain = query_graphql.get_query_total_chain()
+        chain = query_graphql.query_chain()
+        total_chain.invoke('warm up')
+
+        runs = {
+            'one total per value': lambda: [
+                total_chain.invoke(f'Find the number of samples with host gender {value}')
+                for value in STUB_BUCKETS
+            ],
+            'breakdown': lambda: chain.invoke('How many samples per host gender')
+        }
+        for name, run in runs.items():
+            generations, requests = ollama.requests, arranger.requests
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+            print(
+                f'{name:>19}: {seconds*1e3:7.1f} ms, {ollama.requests - generations} LLM generations, '
+                f'{arranger.requests - requests} Arranger requests'
+            )
+
+
+if __name__ == '__main__':
+    main()
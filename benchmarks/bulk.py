@@ -0,0 +1,75 @@
+"""Time and Arranger requests of a file of questions, one by one and in bulk
+
+Answers a set of canned questions against local stand-ins for Chroma,
+Arranger and Ollama, with query_total_chain().batch (one Arranger query per
+question) and with overture_chatbot.bulk (one aliased Arranger request per
+batch of questions), and reports the wall time, questions per second and
+the number of Arranger requests of each. Caches are off so that every
+question generates its SQON.
+
+Usage: python -m benchmarks.bulk [--questions 200] [--batch-size 50] [--arranger-latency 0.05]
+"""
+
+import argparse
+import os
+import time
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--token-latency', type=float, default=0.0)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'LLM_MAX_IN_FLIGHT': str(args.max_concurrency),
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0',
+            'SINGLE_FLIGHT': 'false'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import bulk, query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        questions = [
+            {'id': i, 'question': f'Find the number of males ({i})'} for i in range(args.questions)
+        ]
+        query_graphql.get_query_total_chain().invoke('warm up')
+
+        runs = {
+            'one by one': lambda: query_graphql.get_query_total_chain().batch(
+                [item['question'] for item in questions],
+                config={'max_concurrency': args.max_concurrency}
+            ),
+            'bulk': lambda: list(bulk.answer_questions(
+                questions, args.batch_size, args.max_concurrency
+            ))
+        }
+        for name, run in runs.items():
+            requests = arranger.requests
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+            print(
+                f'{name:>10}: {seconds:6.2f} s, {len(questions) / seconds:6.1f} questions/s, '
+                f'{arranger.requests - requests} Arranger requests'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark the embedding backends on the query path
+
+Each backend of overture_chatbot.embedding runs in its own process and
+embeds the keywords of the questions of benchmarks.keyword_extraction one
+question at a time (as get_sqon_keyword does), reporting the p50/p95
+latency, the time to load the model and the peak resident memory. The
+top-3 documents retrieved from a synthetic catalog (see
+benchmarks.init_embedding) are compared with those of the PyTorch model.
+
+ONNX exports are created on first use, which requires PyTorch.
+
+Usage: python -m benchmarks.embedding_backends [--backends torch onnx onnx-int8] [--repeat 20]
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+import numpy as np
+from benchmarks.init_embedding import synthetic_catalog
+from benchmarks.keyword_extraction import QUESTIONS
+
+
+def run(backend: str, args: argparse.Namespace, results):
+    from initialize_db import main as init_main
+    from overture_chatbot.embedding import load_embeddings
+
+    start = time.perf_counter()
+    embeddings = load_embeddings(backend)
+    load_seconds = time.perf_counter() - start
+
+    keywords = [expected for _, expected in QUESTIONS if expected]
+    embeddings.embed_documents(keywords[0])
+    latencies = []
+    for _ in range(args.repeat):
+        for keyword_lst in keywords:
+            start = time.perf_counter()
+            embeddings.embed_documents(keyword_lst)
+            latencies.append((time.perf_counter() - start) * 1e3)
+
+    fieldinfos, buckets = synthetic_catalog(args.fields, args.enums)
+    documents = init_main.create_documents(fieldinfos, buckets)
+    texts = [document.page_content for document in documents.values()]
+    queries = [keyword for keyword_lst in keywords for keyword in keyword_lst]
+    results.put((
+        backend, load_seconds, latencies,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        np.asarray(embeddings.embed_documents(texts)), np.asarray(embeddings.embed_documents(queries))
+    ))
+
+
+def top_k(documents: np.ndarray, queries: np.ndarray, k: int = 3) -> np.ndarray:
+    """Rows of the k nearest documents (squared L2 distance) of every query"""
+    distances = (documents ** 2).sum(axis=1)[np.newaxis, :] - 2 * queries @ documents.T
+    return np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--fields', type=int, default=50)
+    parser.add_argument('--enums', type=int, default=200)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    reference = None
+    for backend in args.backends:
+        process = context.Process(target=run, args=(backend, args, results))
+        process.start()
+        backend, load_seconds, latencies, peak_rss, documents, queries = results.get()
+        process.join()
+
+        nearest = top_k(documents, queries)
+        if reference is None:
+            reference = nearest
+        overlap = np.mean([
+            len(set(reference_rows) & set(rows)) / len(rows)
+            for reference_rows, rows in zip(reference, nearest)
+        ])
+        print(
+            f'{backend:>9}: p50 {np.percentile(latencies, 50):6.1f} ms, '
+            f'p95 {np.percentile(latencies, 95):6.1f} ms, load {load_seconds:5.1f}s, '
+            f'peak RSS {peak_rss:6.0f} MB, top-3 overlap with {args.backends[0]} {overlap:.3f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
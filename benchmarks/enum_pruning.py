@@ -0,0 +1,165 @@
+"""Prompt size, prefill time and accuracy of SQON generation with enum pruning
+
+Generates the SQON of a fixed set of questions with create_sqon_schema
+over a vector database whose sample collector field has thousands of
+values (the stub fields, padded with synthetic collectors), once with
+every enumeration in the prompt (SQON_MAX_ENUMS=0) and once with pruned
+enumerations (--max-enums), and reports the prompt tokens and prefill time
+of the SQON prompt, the share of expected values kept in the prompt and
+the share of SQONs holding every expected value.
+
+The LLM is a stub unless --ollama-url points to a real Ollama server: the
+stub counts a token per 4 characters of the prompt, does not report a
+prefill time and always answers the same SQON, so only a real server
+measures prefill and accuracy. Keywords are extracted locally
+(KEYWORD_EXTRACTOR=local) so that they depend on the question.
+
+Usage: python -m benchmarks.enum_pruning [--ollama-url URL] [--enums 2000] [--max-enums 50]
+"""
+
+import argparse
+import json
+import os
+import random
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_ollama
+
+# (question, values the SQON filters on)
+QUESTIONS = [
+    ('Find the number of males', ['Male']),
+    ('Find the number of males in Nova Scotia', ['Male', 'Nova Scotia Health Authority']),
+    ('How many samples were collected from women', ['Female']),
+    ('Count the samples collected by Nova Scotia Health Authority', ['Nova Scotia Health Authority']),
+    (
+        'Find the number of samples in Labrador not collected from men',
+        ['Newfoundland and Labrador - Eastern Health', 'Male']
+    ),
+    ('How many samples have no gender provided', ['Not Provided'])
+]
+
+PLACES = 'Alberta Manitoba Ontario Quebec Yukon Nunavut Regina Halifax Toronto Ottawa'.split()
+ORGANIZATIONS = 'Laboratory Hospital Clinic Institute Centre Network Unit'.split()
+
+
+class SQONPromptCounter(BaseCallbackHandler):
+    """Collect the prompt tokens and prefill time of the SQON prompt"""
+
+    def __init__(self):
+        self.sqon_runs = set()
+        self.tokens = 0
+        self.prefill = 0.0
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        if any('structured output bot' in prompt for prompt in prompts):
+            self.sqon_runs.add(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self.sqon_runs:
+            generation_info = response.generations[0][0].generation_info or {}
+            self.tokens += generation_info.get('prompt_eval_count', 0)
+            self.prefill += generation_info.get('prompt_eval_duration', 0) / 1e9
+
+
+class SQONCapture(BaseCallbackHandler):
+    """Capture the JSON schema given to the SQON prompt"""
+
+    def __init__(self):
+        self.schema = ''
+
+    def on_chain_start(self, serialized, inputs, **kwargs):
+        if isinstance(inputs, dict) and 'schema' in inputs:
+            self.schema = inputs['schema']
+
+
+def collector_schema(enums: int) -> str:
+    """Value object of the sample collector field padded with synthetic collectors"""
+    rng = random.Random(0)
+    schema = json.loads(STUB_DOCUMENTS[1][1])
+    collectors = schema['properties']['value']['items']['enum']
+    while len(collectors) < enums:
+        collector = f'{rng.choice(PLACES)} {rng.choice(ORGANIZATIONS)} {len(collectors)}'
+        collectors.append(collector)
+    return json.dumps(schema)
+
+
+def values(sqon: object) -> set:
+    """Values of the field operations of a SQON"""
+    if isinstance(sqon, dict):
+        content = sqon.get('content')
+        if isinstance(content, dict):
+            value = content.get('value')
+            return set(value) if isinstance(value, list) else {value}
+        return values(content)
+    if isinstance(sqon, list):
+        return set().union(*[values(item) for item in sqon]) if sqon else set()
+    return set()
+
+
+def run(query_graphql, max_enums: int) -> dict:
+    """Generate the SQON of every question and summarize the results"""
+    from overture_chatbot.sqon import SQONValidationError, parse_sqon
+
+    query_graphql.settings.SQON_MAX_ENUMS = max_enums
+    chain = query_graphql.create_sqon_schema()
+    tokens, prefill, kept, correct = [], [], [], 0
+    for question, expected in QUESTIONS:
+        counter = SQONPromptCounter()
+        capture = SQONCapture()
+        try:
+            sqon = chain.invoke({'query': question}, config={'callbacks': [counter, capture]})
+            correct += set(expected) <= values(parse_sqon(sqon))
+        except (SQONValidationError, ValueError):
+            pass
+        kept.append(
+            sum(json.dumps(value, ensure_ascii=False) in capture.schema for value in expected) / len(expected)
+        )
+        tokens.append(counter.tokens)
+        prefill.append(counter.prefill)
+
+    return {
+        'tokens': np.mean(tokens),
+        'prefill': np.mean(prefill),
+        'kept': np.mean(kept),
+        'accuracy': correct / len(QUESTIONS)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ollama-url')
+    parser.add_argument('--enums', type=int, default=2000)
+    parser.add_argument('--max-enums', type=int, default=50)
+    args = parser.parse_args()
+
+    with stub_ollama().start(process=True) as ollama, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': args.ollama_url or ollama.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'KEYWORD_EXTRACTOR': 'local',
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        documents = list(STUB_DOCUMENTS)
+        documents[1] = (documents[1][0], collector_schema(args.enums))
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in documents
+        ])
+
+        for name, max_enums in (('all enums', 0), (f'top {args.max_enums}', args.max_enums)):
+            result = run(query_graphql, max_enums)
+            print(
+                f"{name:>9}: {result['tokens']:7.0f} prompt tokens, "
+                f"prefill {result['prefill']*1e3:7.1f} ms, "
+                f"expected values kept {result['kept']:.0%}, accuracy {result['accuracy']:.0%}"
+            )
+
+
+if __name__ == '__main__':
+    main()
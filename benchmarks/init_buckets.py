@@ -0,0 +1,65 @@
+"""Benchmark fetching the buckets of all fields during initialization
+
+Compares the previous serial walk of initialize_db.main (one aggregation
+query per field plus a second, identical one in get_enums) with the
+batched, concurrent get_all_buckets against a stub Arranger server.
+
+Usage: python -m benchmarks.init_buckets [--fields 200] [--latency 0.05]
+"""
+
+import argparse
+import os
+import time
+from benchmarks.stubs import stub_arranger
+
+
+def serial_buckets(init_main, fieldinfos: list[dict]) -> dict[str, list[str]]:
+    """Previous behaviour of initialize_db.main.main"""
+    buckets = {}
+    for fieldinfo in fieldinfos:
+        fieldname = fieldinfo['fieldname']
+        json_query = "query{file{aggregations(include_missing:true){"+fieldname+"{buckets{key}}}}}"
+        json_response = init_main.call_graphql_api(json_query)
+        if 'errors' not in json_response and fieldinfo['fieldtype'] == 'Aggregations':
+            # get_enums sent the same query again
+            json_response = init_main.call_graphql_api(json_query)
+            nested_enums = json_response['data']['file']['aggregations'][fieldname]['buckets']
+            buckets[fieldname] = [single_enum['key'] for single_enum in nested_enums]
+        elif 'errors' not in json_response:
+            buckets[fieldname] = []
+    return buckets
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fields', type=int, default=200)
+    parser.add_argument('--numerical', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--field-latency', type=float, default=0.001)
+    args = parser.parse_args()
+
+    fields = {f'analysis__field_{i}': 'Aggregations' for i in range(args.fields - args.numerical)}
+    fields.update({f'analysis__numerical_{i}': 'NumericalAggregations' for i in range(args.numerical)})
+
+    results = {}
+    with stub_arranger(args.latency, fields, args.field_latency).start(process=True) as server:
+        os.environ['ARRANGER_URL'] = server.url
+        # settings are read on import
+        from initialize_db import main as init_main
+
+        for name in ('serial', 'batched'):
+            requests = server.requests
+            start = time.perf_counter()
+            fieldinfos = init_main.get_fieldinfos()
+            if name == 'serial':
+                results[name] = serial_buckets(init_main, fieldinfos)
+            else:
+                results[name] = init_main.get_all_buckets(fieldinfos)
+            elapsed = time.perf_counter() - start
+            print(f'{name:>8}: {server.requests - requests:5d} queries, {elapsed:6.2f}s')
+
+    print(f'same buckets: {results["serial"].keys() == results["batched"].keys()}')
+
+
+if __name__ == '__main__':
+    main()
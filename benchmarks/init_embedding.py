@@ -0,0 +1,97 @@
+"""Benchmark embedding the documents of the vector database
+
+Compares the previous ingestion of initialize_db.main (one document per
+enumeration list, all embedded by a single add_documents call) with the
+chunked, batched and multi-process ingest_documents on a synthetic catalog
+(by default about 10 times the fields and enumerations of the Overture
+portal) written to a local Chroma server. Each mode runs in its own process
+so that its peak resident memory is reported separately.
+
+Usage: python -m benchmarks.init_embedding [--fields 500] [--enums 2000] [--processes 4]
+"""
+
+import argparse
+import multiprocessing
+import random
+import time
+from benchmarks.stubs import local_chroma
+
+WORDS = (
+    'lineage sample host province country collection sequencing instrument '
+    'nasal swab Ontario Quebec Alberta female male unknown BA.2 XBB.1.5'
+).split()
+
+
+def synthetic_catalog(fields: int, enums: int) -> tuple[list[dict], dict[str, list[str]]]:
+    """Field information and buckets with a few fields holding most enumerations"""
+    rng = random.Random(0)
+    fieldinfos = [
+        {'fieldname': f'analysis__field_{i}', 'fieldtype': 'Aggregations'} for i in range(fields)
+    ]
+    buckets = {}
+    for i, fieldinfo in enumerate(fieldinfos):
+        # lineage and location-like fields have thousands of values, most have a handful
+        count = enums if i % 50 == 0 else rng.randint(2, 20)
+        buckets[fieldinfo['fieldname']] = [
+            f'{rng.choice(WORDS)} {rng.choice(WORDS)} {j}' for j in range(count)
+        ]
+    return fieldinfos, buckets
+
+
+def run(mode: str, args: argparse.Namespace, host: str, port: int, results):
+    import chromadb
+    from initialize_db import main as init_main
+    from overture_chatbot import settings
+    from overture_chatbot.embedding import load_embeddings
+
+    fieldinfos, buckets = synthetic_catalog(args.fields, args.enums)
+    # the previous documents held the whole enumeration list
+    chunk_chars = float('inf') if mode == 'previous' else settings.INIT_ENUM_CHUNK_CHARS
+    documents = init_main.create_documents(fieldinfos, buckets, chunk_chars=chunk_chars)
+
+    embeddings = load_embeddings()
+    collection = chromadb.HttpClient(host=host, port=port).create_collection(f'benchmark_{mode}')
+    start = time.perf_counter()
+    if mode == 'previous':
+        collection.upsert(
+            ids=list(documents),
+            embeddings=embeddings.embed_documents(
+                [document.page_content for document in documents.values()]
+            ),
+            documents=[document.page_content for document in documents.values()],
+            metadatas=[document.metadata for document in documents.values()]
+        )
+    else:
+        init_main.ingest_documents(
+            collection, embeddings, documents,
+            batch_size=args.batch_size, processes=args.processes, backend=settings.EMBEDDING_BACKEND
+        )
+    elapsed = time.perf_counter() - start
+
+    results.put((mode, len(documents), elapsed, init_main.peak_rss_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fields', type=int, default=500)
+    parser.add_argument('--enums', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    with local_chroma() as (host, port):
+        for mode in ('previous', 'pipeline'):
+            process = context.Process(target=run, args=(mode, args, host, port, results))
+            process.start()
+            mode, documents, elapsed, peak_rss = results.get()
+            process.join()
+            print(
+                f'{mode:>8}: {documents:6d} documents, {elapsed:7.1f}s, '
+                f'{documents / elapsed:7.1f} docs/s, peak RSS {peak_rss:6.0f} MB'
+            )
+
+
+if __name__ == '__main__':
+    main()
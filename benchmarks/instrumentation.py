@@ -0,0 +1,79 @@
+"""Overhead of the per-stage instrumentation
+
+Streams the answers of astream_query_total_summary against local
+stand-ins for Ollama, Chroma and Arranger (without latency, so that the
+overhead is not hidden by the services) with settings.INSTRUMENTATION off
+and on, and reports the p50 time per question of each and the breakdown
+of the last traced question.
+
+Usage: python -m benchmarks.instrumentation [--questions 50]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+async def measure(query_graphql, questions: list[str]) -> tuple[list[float], str]:
+    """Seconds per question and the last breakdown of the stages"""
+    seconds = []
+    timings = ''
+    for question in questions:
+        start = time.perf_counter()
+        async for step, output in query_graphql.astream_query_total_summary(question):
+            if step == query_graphql.TIMINGS_STEP:
+                timings = output
+        seconds.append(time.perf_counter() - start)
+
+    return seconds, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=50)
+    args = parser.parse_args()
+
+    with stub_ollama().start(process=True) as ollama, \
+            stub_arranger().start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0',
+            'SHOW_TIMINGS': 'true'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql, settings
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        questions = [f'Find the number of males ({i})' for i in range(args.questions)]
+        asyncio.run(compare(query_graphql, settings, questions))
+
+
+async def compare(query_graphql, settings, questions: list[str]):
+    """Print the time per question with the instrumentation off and on"""
+    # load the models and compile the chain before measuring
+    await measure(query_graphql, questions[:2])
+
+    p50 = {}
+    for enabled in (False, True):
+        settings.INSTRUMENTATION = enabled
+        seconds, timings = await measure(query_graphql, questions)
+        p50[enabled] = np.percentile(seconds, 50) * 1e3
+        print(f"instrumentation {'on ' if enabled else 'off'}: p50 {p50[enabled]:7.1f} ms")
+    print(f'overhead: {p50[True] - p50[False]:+.1f} ms per question\n')
+    print(timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Accuracy and latency of local keyword matching against the LLM
+
+Extracts the keywords of a fixed set of questions with the LLM chain and
+with the local keyword index (KEYWORD_EXTRACTOR=local) over the stub vector
+database, and reports the share of expected keywords found, the share of
+questions that fall back to the LLM and the latency of the keyword stage.
+
+The LLM is a stub answering 'males' unless --ollama-url points to a real
+Ollama server, in which case its accuracy is measured as well.
+
+Usage: python -m benchmarks.keyword_extraction [--ollama-url URL] [--token-latency 0.05]
+"""
+
+import argparse
+import os
+import time
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_ollama
+
+# (question, expected keywords)
+QUESTIONS = [
+    ('Find the number of males', ['males']),
+    ('Find the number of males in Nova Scotia', ['males', 'Nova Scotia']),
+    ('How many samples were collected from women', ['women']),
+    ('Get the number of samples who are not men', ['men']),
+    ('Find the number of samples in Labrador not collected from men', ['Labrador', 'men']),
+    ('How many female hosts are there in Newfoundland', ['female', 'Newfoundland']),
+    ('Count the samples collected by Nova Scotia Health Authority', ['Nova Scotia Health Authority']),
+    ('Get all samples published after 1640926800000', ['published']),
+    ('How many samples in Labrdor', ['Labrador']),
+    ('How many samples have no gender provided', ['gender']),
+    # nothing to match: falls back to the LLM
+    ('How many records are there in total', [])
+]
+
+
+def found(expected: list[str], keyword_str: str) -> int:
+    """Number of expected keywords contained in the extracted keywords"""
+    keyword_str = keyword_str.lower()
+    return sum(keyword.lower() in keyword_str for keyword in expected)
+
+
+def run(query_graphql, extractor: str) -> dict:
+    """Extract the keywords of every question and summarize the results"""
+    query_graphql.settings.KEYWORD_EXTRACTOR = extractor
+    chain = query_graphql.get_keyword_chain()
+    # the local index is built on first use
+    chain.invoke({'query': QUESTIONS[0][0]})
+
+    latencies, hits, fallbacks = [], 0, 0
+    for question, expected in QUESTIONS:
+        start = time.perf_counter()
+        keyword_str = chain.invoke({'query': question})
+        latencies.append(time.perf_counter() - start)
+        hits += found(expected, keyword_str)
+        if extractor == 'local':
+            fallbacks += not query_graphql.get_keyword_index().match(question)
+        print(f'  {extractor:>5} | {question} -> {keyword_str.strip()}')
+
+    return {
+        'recall': hits / sum(len(expected) for _, expected in QUESTIONS),
+        'fallback': fallbacks / len(QUESTIONS),
+        'p50': np.percentile(latencies, 50),
+        'max': max(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ollama-url')
+    parser.add_argument('--token-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': args.ollama_url or ollama.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port)
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+
+        results = {extractor: run(query_graphql, extractor) for extractor in ('llm', 'local')}
+        for extractor, result in results.items():
+            # the stub LLM gives the same answer to every question
+            recall = (
+                'n/a' if extractor == 'llm' and not args.ollama_url
+                else f"{result['recall']:.0%}"
+            )
+            print(
+                f"{extractor:>5}: recall {recall}, "
+                f"LLM fallback {result['fallback']:.0%}, "
+                f"p50 {result['p50']*1e3:7.1f} ms, max {result['max']*1e3:7.1f} ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark keyword retrieval in get_sqon_keyword
+
+Compares one retriever call per keyword (the previous behaviour) with the
+batched embedding and single multi-vector query of get_sqon_keyword, and
+reports the time spent embedding and searching, against an in-memory
+Chroma server.
+
+Usage: python -m benchmarks.keyword_retrieval [--repeat 50]
+"""
+
+import argparse
+import os
+import time
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma
+
+KEYWORDS = 'males, Nova Scotia, Labrador, published, females'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({'CHROMA_HOST': chroma_host, 'CHROMA_PORT': str(chroma_port)})
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        retriever = query_graphql.get_vector_store().as_retriever(search_kwargs={"k": 3})
+        keyword_lst = query_graphql.split_keywords(KEYWORDS)
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for kwrd in keyword_lst:
+                retriever.invoke(kwrd)
+        serial = (time.perf_counter() - start) / args.repeat
+
+        embed = search = 0.0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            keyword_embeddings = query_graphql.get_embeddings().embed_documents(keyword_lst)
+            embedded = time.perf_counter()
+            query_graphql.get_vector_store()._collection.query(
+                query_embeddings=keyword_embeddings, n_results=3, include=['metadatas']
+            )
+            embed += embedded - start
+            search += time.perf_counter() - embedded
+        embed, search = embed / args.repeat, search / args.repeat
+
+        print(f'{len(keyword_lst)} keywords')
+        print(f' serial: {serial*1e3:7.2f} ms')
+        print(
+            f'batched: {(embed + search)*1e3:7.2f} ms '
+            f'(embed {embed*1e3:.2f} ms, search {search*1e3:.2f} ms)'
+        )
+        sqons = [query_graphql.get_sqon_keyword(KEYWORDS) for _ in range(3)]
+        print(f'deterministic order: {all(order == sqons[0] for order in sqons)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Load test of the async chain against the thread-pool path
+
+Drives query_total_chain with many concurrent chat sessions against local
+stand-ins for Ollama, Chroma and Arranger, once with chain.invoke offloaded
+to a thread pool (as cl.make_async did) and once with chain.ainvoke on the
+event loop, and reports sustained QPS and latency percentiles.
+
+Usage: python -m benchmarks.load_async [--sessions 200] [--token-latency 0.01]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import anyio.to_thread
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+async def run_sessions(invoke, questions: list[str]) -> tuple[float, list[float]]:
+    """Run all questions concurrently and return elapsed seconds and latencies"""
+    async def session(question: str) -> float:
+        start = time.perf_counter()
+        await invoke({'query': question})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*[session(question) for question in questions])
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, elapsed: float, latencies: list[float]):
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(
+        f'{name:>11}: {len(latencies)/elapsed:7.1f} QPS, '
+        f'p50 {p50*1e3:7.1f} ms, p99 {p99*1e3:7.1f} ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=200)
+    parser.add_argument('--token-latency', type=float, default=0.01)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    # stubs run in their own processes, like the services they stand in for
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            # every question does the full work
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        chain = query_graphql.get_query_total_chain()
+        questions = [f'Find the number of males ({i})' for i in range(args.sessions)]
+
+        async def thread_pool(query):
+            # cl.make_async runs the function with anyio's default thread limiter
+            return await anyio.to_thread.run_sync(chain.invoke, query)
+
+        report('thread pool', *asyncio.run(run_sessions(thread_pool, questions)))
+        report('async', *asyncio.run(run_sessions(chain.ainvoke, questions)))
+
+
+if __name__ == '__main__':
+    main()
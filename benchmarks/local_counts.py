@@ -0,0 +1,79 @@
+"""Latency and Arranger requests of single-field totals, from Arranger and from local counts
+
+Refreshes the local counts from a stub Arranger server (as initialize_db
+does), then answers SQON filters with query_graphql with the local counts
+off (every filter queries Arranger) and on: a value of a field, a union of
+values of a field and filters on two fields (always left to Arranger).
+The result cache is off so that every filter is answered again. Finally,
+the local counts are checked against the stub with check_counts.
+
+Usage: python -m benchmarks.local_counts [--queries 50] [--arranger-latency 0.05]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from benchmarks.stubs import stub_arranger
+
+SQON_FILTERS = {
+    'one value': (
+        '{op: "and", content: [{op: "in", content: '
+        '{fieldName: "analysis.host.host_gender", value: ["Male"]}}]}'
+    ),
+    'union of values': (
+        '{op: "or", content: [{op: "in", content: {fieldName: "analysis.host.host_gender", '
+        'value: ["Male"]}}, {op: "in", content: {fieldName: "analysis.host.host_gender", '
+        'value: ["Female"]}}]}'
+    ),
+    'two fields': (
+        '{op: "and", content: [{op: "in", content: {fieldName: "analysis.host.host_gender", '
+        'value: ["Male"]}}, {op: "in", content: {fieldName: '
+        '"analysis.sample_collection.sample_collected_by", value: ["Not Provided"]}}]}'
+    )
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            tempfile.TemporaryDirectory() as directory:
+        os.environ.update({
+            'ARRANGER_URL': arranger.url,
+            'LOCAL_COUNTS_PATH': os.path.join(directory, 'counts.sqlite'),
+            'RESULT_CACHE_MAX_ENTRIES': '0',
+            'SINGLE_FLIGHT': 'false'
+        })
+        # settings are read on import
+        from initialize_db import main as init_main
+        from overture_chatbot import counts, query_graphql
+
+        start = time.perf_counter()
+        init_main.refresh_counts()
+        print(f'refresh: {time.perf_counter() - start:6.2f} s, {arranger.requests} Arranger requests')
+
+        for enabled in (False, True):
+            query_graphql.local_counts.enabled = enabled
+            for name, sqon_filters in SQON_FILTERS.items():
+                requests = arranger.requests
+                start = time.perf_counter()
+                for _ in range(args.queries):
+                    response = query_graphql.query_graphql(sqon_filters)
+                seconds = (time.perf_counter() - start) / args.queries
+                print(
+                    f"{'local counts' if enabled else 'Arranger':>12} {name:>15}: "
+                    f"{seconds*1e6:9.1f} us per total ({json.loads(response)['file']['hits']['total']}), "
+                    f"{arranger.requests - requests} Arranger requests"
+                )
+
+        report = counts.check_counts(query_graphql.local_counts)
+        print(f"check: {report['checked']} totals compared, {len(report['mismatches'])} mismatches")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Prompt evaluation per request with the prompt prefixes of Ollama cold and warm
+
+Asks a sequence of different questions through query_total_summary_chain
+against local stand-ins for Chroma, Arranger and an Ollama server whose
+parallel slots cache the evaluated prompt (see stubs.PromptCache), and
+reports the prompt tokens evaluated and the prompt evaluation time of each
+LLM request (keywords, SQON and answer):
+- cold: OLLAMA_KEEP_ALIVE=0 unloads the model after every request, so no
+  prompt prefix is reused;
+- warm: the model stays loaded (OLLAMA_KEEP_ALIVE=1h) and the static
+  instructions and examples of each prompt are evaluated once, by the
+  first question (reported separately).
+
+The stub evaluates a token per 4 characters of the prompt in
+--prefill-latency seconds; pass --ollama-url to measure a real Ollama server
+(its OLLAMA_NUM_PARALLEL replaces --slots).
+
+Usage: python -m benchmarks.prompt_cache [--ollama-url URL] [--questions 8] [--slots 3]
+"""
+
+import argparse
+import os
+from collections import defaultdict
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+PLACES = ['Nova Scotia', 'Labrador', 'Alberta', 'Ontario', 'Quebec', 'Manitoba', 'Yukon', 'Halifax']
+
+
+class PromptEvalCounter(BaseCallbackHandler):
+    """Collect the prompt tokens evaluated and the evaluation time of each LLM request"""
+
+    def __init__(self):
+        self.steps = {}
+        # step -> list of (prompt tokens evaluated, seconds)
+        self.requests = defaultdict(list)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        if 'linguist' in prompts[0]:
+            self.steps[run_id] = 'keywords'
+        elif 'structured output bot' in prompts[0]:
+            self.steps[run_id] = 'sqon'
+        else:
+            self.steps[run_id] = 'answer'
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        generation_info = response.generations[0][0].generation_info or {}
+        self.requests[self.steps.pop(run_id)].append((
+            generation_info.get('prompt_eval_count', 0),
+            generation_info.get('prompt_eval_duration', 0) / 1e9
+        ))
+
+
+def run(query_graphql, keep_alive: str, questions: list[str]) -> list[PromptEvalCounter]:
+    """Answer the questions in turn; return the prompt evaluation of each question"""
+    query_graphql.settings.OLLAMA_KEEP_ALIVE = keep_alive
+    # the chain binds the LLM, created with the options of the settings
+    query_graphql.get_llm.cache_clear()
+    chain = query_graphql.query_total_summary_chain()
+    counters = []
+    for question in questions:
+        counter = PromptEvalCounter()
+        chain.invoke({'query': question}, config={'callbacks': [counter]})
+        counters.append(counter)
+
+    return counters
+
+
+def report(name: str, counters: list[PromptEvalCounter]):
+    for step in ('keywords', 'sqon', 'answer'):
+        requests = [request for counter in counters for request in counter.requests[step]]
+        if not requests:
+            continue
+        tokens, seconds = np.mean(requests, axis=0)
+        print(f'{name:>14} {step:>8}: {tokens:6.0f} prompt tokens evaluated, {seconds*1e3:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ollama-url')
+    parser.add_argument('--questions', type=int, default=8)
+    parser.add_argument('--slots', type=int, default=3)
+    parser.add_argument('--prefill-latency', type=float, default=0.002)
+    args = parser.parse_args()
+
+    with stub_ollama(prefill_latency=args.prefill_latency, slots=args.slots).start(process=True) \
+            as ollama, \
+            stub_arranger().start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': args.ollama_url or ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            # every question is generated
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        questions = [
+            f'Find the number of males in {PLACES[i % len(PLACES)]} ({i})'
+            for i in range(args.questions)
+        ]
+
+        report('cold', run(query_graphql, '0', questions))
+        counters = run(query_graphql, '1h', questions)
+        report('warm, first', counters[:1])
+        report('warm, others', counters[1:])
+
+
+if __name__ == '__main__':
+    main()
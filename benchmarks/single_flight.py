@@ -0,0 +1,89 @@
+"""Coalescing of identical questions asked at the same time
+
+Many chat sessions ask the same question at once (e.g. after a link is
+shared) against local stand-ins for Ollama, Chroma and Arranger, with the
+single flight of query_graphql (settings.SINGLE_FLIGHT) on and off. Reports
+the LLM generations and Arranger queries made, the calls coalesced and the
+latency of the sessions.
+
+Usage: python -m benchmarks.single_flight [--sessions 50] [--token-latency 0.01]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+async def ask(chain, questions: list[str]) -> list[float]:
+    """Ask all questions concurrently and return their latencies"""
+    async def session(question: str) -> float:
+        start = time.perf_counter()
+        await chain.ainvoke({'query': question})
+        return time.perf_counter() - start
+
+    return await asyncio.gather(*[session(question) for question in questions])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--token-latency', type=float, default=0.01)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            # only the single flight shares work between the sessions
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        # the same question, typed slightly differently
+        questions = [
+            'Find the number of males' if i % 2 else 'find the number of males?'
+            for i in range(args.sessions)
+        ]
+        asyncio.run(compare(query_graphql, ollama, arranger, questions))
+
+
+async def compare(query_graphql, ollama, arranger, questions: list[str]):
+    """Print the work done for the questions with the single flight off and on"""
+    chain = query_graphql.get_query_total_chain()
+    await chain.ainvoke({'query': 'warm up'})
+
+    for enabled in (False, True):
+        for flight in (query_graphql.question_flight, query_graphql.sqon_flight):
+            flight.enabled = enabled
+        generations, queries = ollama.requests, arranger.requests
+        latencies = await ask(chain, questions)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(
+            f"single flight {'on ' if enabled else 'off'}: "
+            f'{ollama.requests - generations} LLM generations, '
+            f'{arranger.requests - queries} Arranger queries, '
+            f'p50 {p50*1e3:7.1f} ms, p99 {p99*1e3:7.1f} ms'
+        )
+    print(
+        f'coalesced: {query_graphql.question_flight.coalesced} questions, '
+        f'{query_graphql.sqon_flight.coalesced} SQONs'
+    )
+
+
+if __name__ == '__main__':
+    main()
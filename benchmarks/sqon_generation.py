@@ -0,0 +1,92 @@
+"""Retry rate and generated tokens of SQON generation per output format
+
+Generates the SQON of a fixed set of questions with create_sqon_schema for
+each SQON_OUTPUT_FORMAT ('text' is the unconstrained prompt, 'json' and
+'schema' constrain Ollama's decoding) and reports the share of SQONs
+rejected by the local validator (questions the user would have to retry)
+and the tokens generated per question.
+
+The LLM is a stub unless --ollama-url points to a real Ollama server
+('schema' requires Ollama 0.5 or later); the stub always produces a valid
+SQON, so only a real server measures the retry rate.
+
+Usage: python -m benchmarks.sqon_generation [--ollama-url URL] [--formats text json schema]
+"""
+
+import argparse
+import os
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+from benchmarks.keyword_extraction import QUESTIONS
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_ollama
+
+
+class SQONTokenCounter(BaseCallbackHandler):
+    """Collect the tokens generated by the SQON prompt"""
+
+    def __init__(self):
+        self.sqon_runs = set()
+        self.tokens = 0
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        if any('structured output bot' in prompt for prompt in prompts):
+            self.sqon_runs.add(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self.sqon_runs:
+            generation_info = response.generations[0][0].generation_info or {}
+            self.tokens += generation_info.get('eval_count', 0)
+
+
+def run(query_graphql, output_format: str) -> dict:
+    """Generate the SQON of every question and summarize the results"""
+    from overture_chatbot.sqon import SQONValidationError
+
+    query_graphql.settings.SQON_OUTPUT_FORMAT = output_format
+    chain = query_graphql.create_sqon_schema()
+    rejected, tokens = 0, []
+    for question, _ in QUESTIONS:
+        counter = SQONTokenCounter()
+        try:
+            sqon = chain.invoke({'query': question}, config={'callbacks': [counter]})
+        except SQONValidationError as e:
+            rejected += 1
+            sqon = f'rejected: {e}'
+        tokens.append(counter.tokens)
+        print(f'  {output_format:>6} | {question} -> {sqon.strip()}')
+
+    return {'retry': rejected / len(QUESTIONS), 'tokens': np.mean(tokens)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ollama-url')
+    parser.add_argument('--formats', nargs='+', default=['text', 'json', 'schema'])
+    args = parser.parse_args()
+
+    with stub_ollama().start(process=True) as ollama, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': args.ollama_url or ollama.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port)
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+
+        results = {output_format: run(query_graphql, output_format) for output_format in args.formats}
+        for output_format, result in results.items():
+            print(
+                f"{output_format:>6}: retry rate {result['retry']:.0%}, "
+                f"{result['tokens']:.1f} tokens generated per question"
+            )
+
+
+if __name__ == '__main__':
+    main()
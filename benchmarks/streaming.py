@@ -0,0 +1,77 @@
+"""Time to first byte of the streamed summary chain
+
+Runs query_total_summary_chain against local stand-ins for Ollama, Chroma
+and Arranger, once with chain.ainvoke (the answer is shown when the whole
+chain completes) and once with astream_query_total_summary, and reports
+when the first step, the first answer token and the complete answer reach
+the user.
+
+Usage: python -m benchmarks.streaming [--questions 10] [--token-latency 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+
+async def measure(query_graphql, questions: list[str]) -> dict[str, list[float]]:
+    """Seconds until each milestone of every question"""
+    timings = {'ainvoke': [], 'first step': [], 'first token': [], 'streamed': []}
+    chain = query_graphql.get_query_total_summary_chain()
+    for question in questions:
+        start = time.perf_counter()
+        await chain.ainvoke({'query': question})
+        timings['ainvoke'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        first_step = first_token = None
+        async for step, _ in query_graphql.astream_query_total_summary(question):
+            now = time.perf_counter() - start
+            if step == query_graphql.ANSWER_STEP:
+                first_token = first_token or now
+            else:
+                first_step = first_step or now
+        timings['first step'].append(first_step)
+        timings['first token'].append(first_token)
+        timings['streamed'].append(time.perf_counter() - start)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--token-latency', type=float, default=0.05)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port),
+            'SEMANTIC_CACHE_MAX_ENTRIES': '0',
+            'RESULT_CACHE_MAX_ENTRIES': '0'
+        })
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        questions = [f'Find the number of males ({i})' for i in range(args.questions)]
+
+        for name, seconds in asyncio.run(measure(query_graphql, questions)).items():
+            print(f'{name:>11}: p50 {np.percentile(seconds, 50)*1e3:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
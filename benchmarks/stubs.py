@@ -0,0 +1,417 @@
+"""Local stand-in servers for benchmarks
+
+Stub servers run in a background thread on localhost so that benchmarks
+do not depend on the live Overture services.
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# SQON returned by the stub LLM (with the leading space Mistral produces)
+STUB_SQON = (
+    " {'op': 'and', 'content': [{'op': 'in', 'content': "
+    "{'fieldName': 'analysis.host.host_gender', 'value': ['Male']}}]}"
+)
+
+# fields of the stub Arranger server and the buckets of its 'Aggregations' fields
+STUB_FIELDS = {
+    'analysis__host__host_gender': 'Aggregations',
+    'analysis__sample_collection__sample_collected_by': 'Aggregations',
+    'analysis__first_published_at': 'NumericalAggregations'
+}
+STUB_BUCKETS = ['Female', 'Male', 'Not Provided']
+# number of hits of each bucket, adding up to the total number of hits of the server
+STUB_DOC_COUNTS = [50, 40, 10]
+
+# (page content, SQON value object schema) of the stub vector database
+STUB_DOCUMENTS = [
+    (
+        'analysis host host gender',
+        '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+        '"analysis.host.host_gender", "type": "string", "description": '
+        '"analysis host host gender"}, "value": {"type": "array", "items": {"enum": '
+        '["Female", "Male", "Not Provided"], "type": "string"}, "minItems": 1}}}'
+    ),
+    (
+        'analysis sample collection sample collected by',
+        '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+        '"analysis.sample_collection.sample_collected_by", "type": "string", "description": '
+        '"analysis sample collection sample collected by"}, "value": {"type": "array", '
+        '"items": {"enum": ["Nova Scotia Health Authority", '
+        '"Newfoundland and Labrador - Eastern Health"], "type": "string"}, "minItems": 1}}}'
+    ),
+    (
+        'analysis first published at',
+        '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+        '"analysis.first_published_at", "type": "string", "description": '
+        '"analysis first published at"}, "value": {"type": "integer"}}}'
+    )
+]
+
+
+class StubServer(ThreadingHTTPServer):
+    """Threaded HTTP/1.1 server that counts the connections and requests it accepts
+
+    The server runs in a background thread, or in a forked process so that
+    it does not compete with the benchmarked code for the GIL.
+    """
+
+    daemon_threads = True
+    # many clients connect at once in load tests
+    request_queue_size = 1024
+
+    def __init__(self, handler_class, latency: float = 0.0):
+        super().__init__(('127.0.0.1', 0), handler_class)
+        self.latency = latency
+        # shared with the forked process
+        self._connections = multiprocessing.Value('l', 0)
+        self._requests = multiprocessing.Value('l', 0)
+        self._active = multiprocessing.Value('l', 0)
+        self.shared_cpu = False
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def connections(self) -> int:
+        return self._connections.value
+
+    @property
+    def requests(self) -> int:
+        return self._requests.value
+
+    def process_request(self, request, client_address):
+        with self._connections.get_lock():
+            self._connections.value += 1
+        super().process_request(request, client_address)
+
+    @property
+    def active(self) -> int:
+        return self._active.value
+
+    def count_request(self):
+        with self._requests.get_lock():
+            self._requests.value += 1
+
+    @contextmanager
+    def generating(self):
+        """Count a request as active while it is answered"""
+        with self._active.get_lock():
+            self._active.value += 1
+        try:
+            yield
+        finally:
+            with self._active.get_lock():
+                self._active.value -= 1
+
+    def start(self, process: bool = False) -> 'StubServer':
+        if process:
+            context = multiprocessing.get_context('fork')
+            self._runner = context.Process(target=self.serve_forever, daemon=True)
+        else:
+            self._runner = threading.Thread(target=self.serve_forever, daemon=True)
+        self._runner.start()
+        return self
+
+    def stop(self):
+        if isinstance(self._runner, threading.Thread):
+            self.shutdown()
+        else:
+            self._runner.terminate()
+            self._runner.join()
+        self.server_close()
+
+    def __enter__(self) -> 'StubServer':
+        if self._runner is None:
+            self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Keep-alive request handler that answers POSTs with JSON"""
+
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately; avoid delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ArrangerHandler(JSONHandler):
+    """Stub Arranger GraphQL endpoint
+
+    Queries are answered after the configured latency of the server (plus
+    the latency per field of aggregation queries):
+    - the '__type' query of fileAggregations lists the fields of the server;
+    - aggregation queries return the buckets (and their number of hits) of 
+      'Aggregations' fields and
+      fail, as Arranger does, when they ask buckets of any other field;
+    - queries of several aliased totals (q0: file{...} q1: ...) get a 
+      total number of hits for every alias;
+    - any other query gets a total number of hits: the number of hits of 
+      the buckets its filters name, or the total number of hits.
+    """
+
+    total = 100
+
+    def do_POST(self):
+        query = self.read_json().get('query', '')
+        self.server.count_request()
+        time.sleep(self.server.latency)
+        fields = self.server.fields
+
+        if '__type' in query:
+            self.send_json({'data': {'__type': {'fields': [
+                {'name': name, 'type': {'name': fieldtype}} for name, fieldtype in fields.items()
+            ]}}})
+        elif 'aggregations' in query:
+            names = re.findall(r'(\w+)\{buckets\{key(?: doc_count)?\}\}', query)
+            time.sleep(self.server.field_latency * len(names))
+            invalid = [name for name in names if fields.get(name) != 'Aggregations']
+            if invalid:
+                self.send_json({'errors': [
+                    {'message': f'Cannot query field "buckets" on "{name}"'} for name in invalid
+                ], 'data': None})
+            else:
+                self.send_json({'data': {'file': {'aggregations': {
+                    name: {'buckets': [
+                        {'key': key, 'doc_count': doc_count}
+                        for key, doc_count in zip(STUB_BUCKETS, STUB_DOC_COUNTS)
+                    ]} for name in names
+                }}}})
+        elif aliases := re.findall(r'(\w+):\s*file\{hits(\(filters:.*?\))?\{total\}\}', query):
+            self.send_json({'data': {
+                alias: {'hits': {'total': self.hits_total(filters)}} for alias, filters in aliases
+            }})
+        else:
+            self.send_json({'data': {'file': {'hits': {'total': self.hits_total(query)}}}})
+
+    def hits_total(self, filters: str) -> int:
+        counts = [
+            doc_count for key, doc_count in zip(STUB_BUCKETS, STUB_DOC_COUNTS) if f'"{key}"' in filters
+        ]
+        return sum(counts) if counts else self.total
+
+
+def stub_arranger(
+    latency: float = 0.0, fields: dict[str, str] | None = None, field_latency: float = 0.0
+) -> StubServer:
+    """Create (but do not start) a stub Arranger GraphQL server
+
+    Parameters
+    ----------
+    latency : float
+        Seconds to answer a query.
+    fields : dict, optional
+        Field name -> 'Aggregations' or 'NumericalAggregations', by default STUB_FIELDS.
+    field_latency : float
+        Additional seconds per field of an aggregation query.
+    """
+    server = StubServer(ArrangerHandler, latency=latency)
+    server.fields = STUB_FIELDS if fields is None else fields
+    server.field_latency = field_latency
+    return server
+
+
+def stub_llm_response(prompt: str, output_format: object = '') -> str:
+    """Deterministic answer of the stub LLM to the prompts of query_graphql
+
+    With an output format ('json' or a JSON schema) the SQON is valid JSON,
+    as produced by Ollama's constrained decoding.
+    """
+    if 'structured output bot' in prompt and output_format:
+        return json.dumps(json.loads(STUB_SQON.replace("'", '"')))
+    if 'structured output bot' in prompt:
+        return STUB_SQON
+    if 'linguist' in prompt:
+        return 'males'
+
+    return 'Query Result: 100\nThere are 100 males.'
+
+
+class PromptCache:
+    """Evaluated prompts of the parallel slots of a stub Ollama server
+
+    As in the llama.cpp server run by Ollama, a request takes the idle slot
+    whose cached prompt shares the longest prefix with its prompt, if that 
+    prefix is more than half the prompt (the least recently used idle slot
+    otherwise), and only the rest of its prompt is evaluated. The cache is dropped when the model is unloaded (keep_alive 0).
+    """
+
+    def __init__(self, slots: int):
+        self._lock = threading.Lock()
+        self.prompts = [''] * slots
+        self.used = [0] * slots
+        self.busy = [False] * slots
+        self.requests = 0
+
+    def acquire(self, prompt: str) -> tuple[int | None, int]:
+        """Take a slot for the prompt; return it and the number of cached characters"""
+        with self._lock:
+            idle = [slot for slot, busy in enumerate(self.busy) if not busy]
+            if not idle:
+                return None, 0
+            cached = {slot: len(os.path.commonprefix([self.prompts[slot], prompt])) for slot in idle}
+            slot = max(idle, key=lambda slot: cached[slot])
+            if cached[slot] * 2 <= len(prompt):
+                slot = min(idle, key=lambda slot: self.used[slot])
+            self.busy[slot] = True
+            self.prompts[slot] = prompt
+            return slot, cached[slot]
+
+    def release(self, slot: int | None, unload: bool):
+        with self._lock:
+            self.requests += 1
+            if slot is not None:
+                self.busy[slot] = False
+                self.used[slot] = self.requests
+            if unload:
+                self.prompts = [''] * len(self.prompts)
+
+
+class OllamaHandler(JSONHandler):
+    """Stub Ollama /api/generate endpoint
+
+    Answers are streamed one token (word) at a time as newline-delimited
+    JSON, waiting the latency of the server before each token. With a 
+    shared CPU, the latency is multiplied by the number of generations 
+    running at once, as when they compete for the cores of one server.
+    Prompts count a token per 4 characters; with a prompt cache, only the
+    tokens after the cached prefix are evaluated, in the prefill latency 
+    of the server per token.
+    """
+
+    def do_POST(self):
+        body = self.read_json()
+        self.server.count_request()
+        prompt = body.get('prompt', '')
+        response = stub_llm_response(prompt, body.get('format'))
+        tokens = re.findall(r'\s*\S+', response) or ['']
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        start = time.perf_counter_ns()
+        prompt_cache = self.server.prompt_cache
+        slot, cached = prompt_cache.acquire(prompt) if prompt_cache else (None, 0)
+        # at least one token is evaluated, even for a cached prompt
+        prompt_tokens = max(1, -(-(len(prompt) - cached) // 4)) if prompt_cache else len(prompt) // 4
+        with self.server.generating():
+            time.sleep(self.server.prefill_latency * prompt_tokens)
+            prompt_duration = time.perf_counter_ns() - start
+            for token in tokens:
+                time.sleep(self.server.latency * (self.server.active if self.server.shared_cpu else 1))
+                self.write_chunk({'model': body.get('model'), 'response': token, 'done': False})
+        if prompt_cache:
+            prompt_cache.release(slot, unload=str(body.get('keep_alive')) in ('0', '0s'))
+        self.write_chunk({
+            'model': body.get('model'),
+            'response': '',
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': prompt_tokens,
+            'prompt_eval_duration': prompt_duration,
+            'eval_count': len(tokens),
+            'eval_duration': time.perf_counter_ns() - start - prompt_duration
+        })
+        self.wfile.write(b'0\r\n\r\n')
+
+    def write_chunk(self, payload: dict):
+        line = json.dumps(payload).encode() + b'\n'
+        self.wfile.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+        self.wfile.flush()
+
+
+def stub_ollama(
+    latency: float = 0.0, shared_cpu: bool = False, prefill_latency: float = 0.0, slots: int = 0
+) -> StubServer:
+    """Create (but do not start) a stub Ollama server
+
+    Parameters
+    ----------
+    latency : float
+        Seconds to generate each token.
+    shared_cpu : bool
+        Multiply the latency by the number of generations running at once, 
+        by default False.
+    prefill_latency : float
+        Seconds to evaluate each token of the prompt, by default 0.
+    slots : int
+        Parallel slots caching the evaluated prompt (see PromptCache), by 
+        default 0 (no prompt cache).
+    """
+    server = StubServer(OllamaHandler, latency=latency)
+    server.shared_cpu = shared_cpu
+    server.prefill_latency = prefill_latency
+    server.prompt_cache = PromptCache(slots) if slots else None
+    return server
+
+
+@contextmanager
+def local_chroma(timeout: float = 60.0):
+    """Run an in-memory Chroma server on localhost
+
+    The real Chroma server (chromadb.app) is started without persistence in
+    a subprocess so that both the sync and async Chroma clients can be used.
+
+    Yields
+    ------
+    tuple of (str, int)
+        Host and port of the server.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    env = dict(os.environ, IS_PERSISTENT='FALSE', ANONYMIZED_TELEMETRY='False', ALLOW_RESET='TRUE')
+    process = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'chromadb.app:app',
+            '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'
+        ],
+        env=env
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                requests.get(f'http://127.0.0.1:{port}/api/v1/heartbeat', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError('Chroma server did not start')
+                time.sleep(0.2)
+        yield '127.0.0.1', port
+    finally:
+        process.terminate()
+        process.wait()
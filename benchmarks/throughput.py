@@ -0,0 +1,205 @@
+"""Throughput and latency of the chains under concurrent load
+
+Drives query_total_chain and query_total_summary_chain with a corpus of
+questions against local stand-ins for Ollama (deterministic answers with
+a configurable latency per token), Chroma (in-memory server) and Arranger
+(configurable latency), at one or more levels of concurrency. Reports the
+QPS, the p50/p95/p99 latency and the p50 time spent in each stage (from
+overture_chatbot.instrumentation) of every run.
+
+Results are written as JSON (--output) and compared with a previous run
+(--baseline): runs whose QPS dropped or whose p95 latency grew by more
+than --tolerance are reported as regressions, and the exit code is 1.
+
+Usage: python -m benchmarks.throughput [--concurrency 1 8 32] [--questions 64]
+           [--corpus questions.txt] [--output results.json] [--baseline results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+from collections import defaultdict
+import numpy as np
+from benchmarks.keyword_extraction import QUESTIONS
+from benchmarks.stubs import STUB_DOCUMENTS, local_chroma, stub_arranger, stub_ollama
+
+CHAINS = ('total', 'summary')
+
+
+def load_corpus(path: str | None, count: int) -> list[str]:
+    """Questions of a corpus (one per line), repeated or truncated to count questions"""
+    if path:
+        with open(path, encoding='utf-8') as file:
+            questions = [line.strip() for line in file if line.strip()]
+    else:
+        questions = [question for question, _ in QUESTIONS]
+
+    return [questions[i % len(questions)] for i in range(count)]
+
+
+async def run_load(query_graphql, chain, questions: list[str], concurrency: int) -> dict:
+    """Answer the questions with at most concurrency questions in flight"""
+    from overture_chatbot import instrumentation
+
+    stages = (
+        query_graphql.KEYWORDS_STEP, query_graphql.SQON_STEP,
+        query_graphql.TOTAL_STEP, query_graphql.ANSWER_STEP
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stage_seconds = defaultdict(list)
+    errors = 0
+
+    async def session(question: str):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            with instrumentation.trace_query(question, stages, enabled=True) as query_trace:
+                try:
+                    await chain.ainvoke({'query': question}, {'callbacks': [query_trace.callback]})
+                except Exception:
+                    errors += 1
+                    return
+            latencies.append(time.perf_counter() - start)
+            for stage, seconds in query_trace.seconds.items():
+                stage_seconds[stage].append(seconds)
+            stage_seconds['retrieval'].append(query_trace.retrieval_seconds)
+            stage_seconds['arranger'].append(query_trace.arranger_seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[session(question) for question in questions])
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1e3 if latencies else (0.0,) * 3
+
+    return {
+        'questions': len(questions),
+        'errors': errors,
+        'seconds': elapsed,
+        'qps': len(latencies) / elapsed,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'stages_p50_ms': {
+            stage: float(np.percentile(seconds, 50) * 1e3) for stage, seconds in stage_seconds.items()
+        }
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Runs of results slower than in the baseline by more than tolerance (a fraction)"""
+    regressions = []
+    for name, runs in results['runs'].items():
+        for concurrency, run in runs.items():
+            previous = baseline.get('runs', {}).get(name, {}).get(concurrency)
+            if previous is None:
+                continue
+            if run['qps'] < previous['qps'] * (1 - tolerance):
+                regressions.append(
+                    f"{name} x{concurrency}: QPS {previous['qps']:.1f} -> {run['qps']:.1f}"
+                )
+            if run['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(
+                    f"{name} x{concurrency}: p95 {previous['p95_ms']:.1f} -> {run['p95_ms']:.1f} ms"
+                )
+
+    return regressions
+
+
+def report(name: str, concurrency: int, run: dict):
+    stages = ', '.join(f'{stage} {ms:.1f}' for stage, ms in run['stages_p50_ms'].items())
+    print(
+        f"{name:>7} x{concurrency:<3}: {run['qps']:7.1f} QPS, p50 {run['p50_ms']:7.1f} ms, "
+        f"p95 {run['p95_ms']:7.1f} ms, p99 {run['p99_ms']:7.1f} ms, errors {run['errors']}"
+    )
+    print(f"{'':>12} stages p50 (ms): {stages}")
+
+
+async def run_all(query_graphql, args: argparse.Namespace, questions: list[str]) -> dict:
+    chains = {
+        'total': query_graphql.get_query_total_chain(),
+        'summary': query_graphql.get_query_total_summary_chain()
+    }
+    # load the models and connect to the services before measuring
+    for name in args.chains:
+        await chains[name].ainvoke({'query': questions[0]})
+
+    runs = {}
+    for name in args.chains:
+        runs[name] = {}
+        for concurrency in args.concurrency:
+            run = await run_load(query_graphql, chains[name], questions, concurrency)
+            # JSON object keys are strings
+            runs[name][str(concurrency)] = run
+            report(name, concurrency, run)
+
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chains', nargs='+', choices=CHAINS, default=list(CHAINS))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--questions', type=int, default=64)
+    parser.add_argument('--corpus', help='text file with one question per line')
+    parser.add_argument('--token-latency', type=float, default=0.01)
+    parser.add_argument('--arranger-latency', type=float, default=0.05)
+    parser.add_argument('--caches', action='store_true', help='keep the result and semantic caches')
+    parser.add_argument('--output', help='JSON file the results are written to')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    questions = load_corpus(args.corpus, args.questions)
+    # stubs run in their own processes, like the services they stand in for
+    with stub_ollama(args.token_latency).start(process=True) as ollama, \
+            stub_arranger(args.arranger_latency).start(process=True) as arranger, \
+            local_chroma() as (chroma_host, chroma_port):
+        os.environ.update({
+            'OLLAMA_URL': ollama.url,
+            'ARRANGER_URL': arranger.url,
+            'CHROMA_HOST': chroma_host,
+            'CHROMA_PORT': str(chroma_port)
+        })
+        if not args.caches:
+            # every question does the full work
+            os.environ.update({'SEMANTIC_CACHE_MAX_ENTRIES': '0', 'RESULT_CACHE_MAX_ENTRIES': '0'})
+        # settings are read on import
+        from langchain_core.documents import Document
+        from overture_chatbot import query_graphql
+
+        query_graphql.get_vector_store().add_documents([
+            Document(page_content=content, metadata={'schema': schema})
+            for content, schema in STUB_DOCUMENTS
+        ])
+        runs = asyncio.run(run_all(query_graphql, args, questions))
+
+    results = {
+        'config': {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'baseline', 'tolerance')
+        },
+        'platform': {
+            'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()
+        },
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regression beyond {args.tolerance:.0%} of {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark retrieval latency of the vector database backends
+
+Fills each backend of overture_chatbot.vector_index with the same random
+embeddings and times the multi-vector query of get_sqon_keyword (one query
+of several keyword embeddings, three results each): the Chroma server
+('http', run locally so the network hop is a loopback round-trip), the
+local Chroma ('persistent') and the in-process NumPy index ('numpy').
+Recall is the fraction of the exact three nearest documents returned (the
+Chroma backends use an approximate HNSW index).
+
+Usage: python -m benchmarks.vector_backends [--documents 500] [--queries 500]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from benchmarks.stubs import local_chroma
+
+
+def random_embeddings(rng: np.random.Generator, count: int, dimensions: int) -> list[list[float]]:
+    """Normalized random embeddings, like those of the sentence-transformers model"""
+    embeddings = rng.normal(size=(count, dimensions)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=500)
+    parser.add_argument('--dimensions', type=int, default=768)
+    parser.add_argument('--keywords', type=int, default=3)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = random_embeddings(rng, args.documents, args.dimensions)
+    ids = [f'field_{i}:description' for i in range(args.documents)]
+    metadatas = [{'schema': f'{{"field": {i}}}'} for i in range(args.documents)]
+    queries = [random_embeddings(rng, args.keywords, args.dimensions) for _ in range(args.queries)]
+    matrix = np.asarray(embeddings)
+    exact = [
+        [set(np.argsort(((matrix - keyword) ** 2).sum(axis=1))[:3]) for keyword in np.asarray(query)]
+        for query in queries
+    ]
+
+    with local_chroma() as (chroma_host, chroma_port), tempfile.TemporaryDirectory() as path:
+        os.environ.update({
+            'CHROMA_HOST': chroma_host, 'CHROMA_PORT': str(chroma_port), 'VECTOR_PATH': path
+        })
+        # settings are read on import
+        from overture_chatbot import vector_index
+
+        for backend in vector_index.BACKENDS:
+            collection = vector_index.get_collection('overture', backend=backend, create=True)
+            for start in range(0, args.documents, 1000):
+                collection.upsert(
+                    ids=ids[start:start+1000],
+                    embeddings=embeddings[start:start+1000],
+                    metadatas=metadatas[start:start+1000]
+                )
+            vector_index.persist_collection(collection)
+            # queries use the collection as the chatbot loads it
+            collection = vector_index.get_collection('overture', backend=backend)
+
+            latencies = []
+            found = 0
+            for query_embeddings, nearest in zip(queries, exact):
+                start = time.perf_counter()
+                result = collection.query(
+                    query_embeddings=query_embeddings, n_results=3, include=['metadatas']
+                )
+                latencies.append((time.perf_counter() - start) * 1e3)
+                found += sum(
+                    len(nearest_ids & {ids.index(doc_id) for doc_id in result_ids})
+                    for nearest_ids, result_ids in zip(nearest, result['ids'])
+                )
+
+            latencies.sort()
+            print(
+                f'{backend:>10}: p50 {statistics.median(latencies):7.3f} ms, '
+                f'p95 {latencies[int(len(latencies) * 0.95)]:7.3f} ms, '
+                f'recall {found / (3 * args.keywords * args.queries):.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -2,76 +2,464 @@
 
 This script is intended to be run once initially to initialize the vector database, 
 save the vector database locally, and download the associated embeddings (from HuggingFace).
+Run it with --sync (once per run, e.g. from a cron job) to pick up new, changed and 
+removed fields without rebuilding the vector database, and with --counts to only refresh the local 
+counts of the values of the fields (see overture_chatbot.counts), or keep refreshing them 
+with --counts --schedule.
 """
 
-from typing import Literal
+import argparse
+import hashlib
 import json
-import requests
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Literal
+from datetime import datetime, timezone
 from ollama import Client
-import chromadb
-from chromadb.config import Settings
 from langchain_core.documents import Document
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+from overture_chatbot import counts, settings, vector_index
+from overture_chatbot.embedding import load_embeddings, retrieval_overlap
+from overture_chatbot.arranger import post_graphql
 
-def main():
+logger = logging.getLogger(__name__)
 
-    # download LLM
-    client = Client(host='http://ollama-llm:11434')
-    client.pull('mistral')
+def main(sync: bool = False):
+    """Initialize the vector database
 
-    chroma_client = chromadb.HttpClient(
-        host='chroma-db', port=8000, settings=Settings(allow_reset=True, anonymized_telemetry=False)
+    Parameters
+    ----------
+    sync : bool
+        Synchronize an existing collection with the fields of Arranger (see 
+        sync_documents) instead of only building it when there is none, by 
+        default False. The local counts are refreshed either way, or only 
+        written when they are missing and the collection already exists.
+    """
+    if not sync:
+        # download LLM
+        # the model the chatbot is served with (see overture_chatbot.query_graphql.get_llm)
+        client = Client(host=settings.OLLAMA_URL)
+        client.pull(settings.OLLAMA_MODEL)
+
+        # don't need to initialize the vector database if data is present
+        if vector_index.collection_exists('overture'):
+            if not os.path.exists(settings.LOCAL_COUNTS_PATH):
+                refresh_counts()
+            return
+
+    # store information to put into vector database
+    fieldinfos = get_fieldinfos()
+    buckets = get_all_buckets(fieldinfos)
+    refresh_counts(buckets)
+    documents = create_documents(fieldinfos, buckets)
+
+    embeddings = load_embeddings()
+    if settings.EMBEDDING_BACKEND != 'torch':
+        check_embeddings(embeddings, documents, buckets)
+
+    # collection of the backend of settings.VECTOR_BACKEND
+    # (its 'version' metadata is set by sync_documents when documents change)
+    collection = vector_index.get_collection('overture', create=True)
+
+    # add data to database
+    sync_documents(collection, embeddings, documents, backend=settings.EMBEDDING_BACKEND)
+    vector_index.persist_collection(collection)
+
+def refresh_counts(
+    buckets: dict[str, dict[str, int]] | None = None, path: str = settings.LOCAL_COUNTS_PATH
+) -> dict:
+    """Store the number of records of every value of the fields for the chatbot
+
+    Parameters
+    ----------
+    buckets : dict, optional
+        Buckets of the fields from get_all_buckets, by default queried.
+    path : str
+        File of the local counts, by default settings.LOCAL_COUNTS_PATH.
+
+    Returns
+    -------
+    dict
+        Number of 'fields', 'complete_fields' and 'values' written (see 
+        overture_chatbot.counts.write_counts).
+    """
+    if buckets is None:
+        buckets = get_all_buckets(get_fieldinfos())
+    total = call_graphql_api('query{file{hits{total}}}')['data']['file']['hits']['total']
+
+    report = counts.write_counts(buckets, total, path)
+    logger.info(
+        "Refreshed local counts of %d values of %d fields (%d complete), %d records",
+        report['values'], report['fields'], report['complete_fields'], total
     )
 
-    # don't need to initialize Chroma DB if data is present
-    if chroma_client.count_collections() < 1:
-        # store information to put into vector database
-        documents =[]
+    return report
 
-        fieldinfos = get_fieldinfos()
+def schedule_counts(
+    interval: float = settings.LOCAL_COUNTS_REFRESH, path: str = settings.LOCAL_COUNTS_PATH
+):
+    """Refresh the local counts every interval seconds (0 does not refresh them)
 
-        for fieldinfo in fieldinfos:
-            fieldname = fieldinfo['fieldname']
-            fieldtype = fieldinfo['fieldtype']
+    Counts less than interval seconds old (e.g. just written by main at 
+    startup) are only refreshed once they reach that age. Refreshes that 
+    fail (e.g. Arranger is down) are logged and retried at the next 
+    interval; the chatbot stops using counts older than 
+    settings.LOCAL_COUNTS_MAX_AGE in the meantime.
+    """
+    while interval > 0:
+        age = time.time() - os.path.getmtime(path) if os.path.exists(path) else interval
+        if age < interval:
+            time.sleep(interval - age)
+        try:
+            refresh_counts(path=path)
+        except Exception:
+            logger.exception("Failed to refresh the local counts")
+            time.sleep(interval)
+
+def create_documents(
+    fieldinfos: list[dict], buckets: dict[str, dict[str, int]],
+    chunk_chars: int = settings.INIT_ENUM_CHUNK_CHARS
+) -> dict[str, Document]:
+    """Create the documents of the vector database
+
+    Every field has a document with its description and, for fields with 
+    enumerations, documents with the list of enumerations. Long lists are 
+    split into several documents of at most chunk_chars characters (see 
+    chunk_enums) so that every document fits in the input of the embedding 
+    model. All documents of a field hold its SQON value object in their metadata.
 
-            json_query = (
-                "query{file{aggregations(include_missing:true){"
-                +fieldname
-                +"{buckets{key}}}}}"
+    Parameters
+    ----------
+    fieldinfos : list of dict
+        Field information from get_fieldinfos.
+    buckets : dict
+        Buckets of the fields from get_all_buckets (only their keys are 
+        used); other fields are left out.
+    chunk_chars : int
+        Maximum characters of an enumeration document, by default 
+        settings.INIT_ENUM_CHUNK_CHARS.
+
+    Returns
+    -------
+    dict
+        Documents keyed on a stable ID derived from the field name and the 
+        kind of document (e.g. 'host_gender:description', 'host_gender:enums:0'). 
+        The 'fingerprint' metadata is a hash of the content 
+        and value object of the document.
+    """
+    documents = {}
+    for fieldinfo in fieldinfos:
+        fieldname = fieldinfo['fieldname']
+        fieldtype = fieldinfo['fieldtype']
+
+        # fields whose aggregation query fails are left out
+        if fieldname in buckets:
+            value_object_schema, description, enums_list = create_value_object_schema(
+                fieldname=fieldname, fieldtype=fieldtype, enums_list=list(buckets[fieldname])
             )
-            json_response = call_graphql_api(json_query)
 
-            if 'errors' not in json_response:
-                value_object_schema, description, enums_list = create_value_object_schema(
-                    fieldname=fieldname,fieldtype=fieldtype
+            contents = {'description': description}
+            for index, chunk in enumerate(chunk_enums(enums_list, chunk_chars)):
+                contents[f'enums:{index}'] = repr(chunk)
+            for kind, page_content in contents.items():
+                fingerprint = hashlib.sha256(
+                    json.dumps([page_content, value_object_schema]).encode()
+                ).hexdigest()
+                documents[f"{fieldname}:{kind}"] = Document(
+                    page_content=page_content,
+                    metadata={"schema": value_object_schema, "fingerprint": fingerprint}
                 )
 
-                schema = {"schema": value_object_schema}
-                documents.append(Document(page_content=description, metadata=schema))
-                if enums_list:
-                    documents.append(Document(page_content=repr(enums_list), metadata=schema))
+    return documents
 
-        embeddings = HuggingFaceEmbeddings(
-            model_name='multi-qa-mpnet-base-cos-v1',
-            cache_folder='resources/huggingface'
+def check_embeddings(
+    embeddings: Embeddings, documents: dict[str, Document], buckets: dict[str, dict[str, int]],
+    sample_size: int = 200, min_overlap: float = settings.EMBEDDING_MIN_OVERLAP
+) -> float:
+    """Check that an embedding model retrieves the same documents as the PyTorch model
+
+    A sample of the documents is retrieved for a sample of the enumerations 
+    (i.e. typical keywords) with both models (see embedding.retrieval_overlap).
+
+    Parameters
+    ----------
+    embeddings : langchain_core.embeddings.Embeddings
+        Embedding model of the vector database (e.g. an ONNX export).
+    documents : dict
+        Documents from create_documents.
+    buckets : dict
+        Buckets of the fields from get_all_buckets.
+    sample_size : int
+        Maximum number of documents and of enumerations, by default 200.
+    min_overlap : float
+        Minimum top-3 overlap, by default settings.EMBEDDING_MIN_OVERLAP.
+
+    Returns
+    -------
+    float
+        Top-3 overlap with the PyTorch model.
+
+    Raises
+    ------
+    ValueError
+        If the overlap is below min_overlap.
+    """
+    texts = [document.page_content for document in documents.values()][:sample_size]
+    queries = [enum for enums_list in buckets.values() for enum in list(enums_list)[:3]][:sample_size]
+    overlap = retrieval_overlap(load_embeddings('torch'), embeddings, texts, queries, k=3)
+    logger.info("Top-3 retrieval overlap with the PyTorch model: %.3f", overlap)
+    if overlap < min_overlap:
+        raise ValueError(
+            f"Embedding backend {settings.EMBEDDING_BACKEND!r} retrieves different documents than "
+            f"the PyTorch model (top-3 overlap {overlap:.3f} < {min_overlap})"
         )
 
-        # create connection to vector database
-        vector_store = Chroma(
-            collection_name='overture',
-            embedding_function=embeddings,
-            client=chroma_client
+    return overlap
+
+def chunk_enums(enums_list: list[str], chunk_chars: int = settings.INIT_ENUM_CHUNK_CHARS) -> list[list[str]]:
+    """Split a list of enumerations into lists of bounded length
+
+    Parameters
+    ----------
+    enums_list : list of str
+        Enumerations of a field.
+    chunk_chars : int
+        Maximum length of the representation (repr) of a list, by default 
+        settings.INIT_ENUM_CHUNK_CHARS. An enumeration longer than that is 
+        kept whole in a list of its own.
+
+    Returns
+    -------
+    list of list of str
+        Consecutive enumerations, in the original order.
+    """
+    chunks = []
+    chunk = []
+    # length of repr(chunk), i.e. brackets and ', ' separators included
+    length = 2
+    for enum in enums_list:
+        enum_length = len(repr(enum)) + (2 if chunk else 0)
+        if chunk and length + enum_length > chunk_chars:
+            chunks.append(chunk)
+            chunk = []
+            length = 2
+            enum_length = len(repr(enum))
+        chunk.append(enum)
+        length += enum_length
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
+
+def sync_documents(
+    collection, embeddings: Embeddings, documents: dict[str, Document],
+    batch_size: int = settings.INIT_EMBED_BATCH_SIZE, processes: int = settings.INIT_EMBED_PROCESSES,
+    backend: str | None = None
+) -> dict:
+    """Synchronize the vector database with the documents
+
+    Only documents that are new or whose fingerprint changed are embedded 
+    and upserted (see ingest_documents); documents that are no longer present are deleted. When 
+    anything changed, the 'version' metadata of the collection is updated so 
+    that the chatbot drops caches built on the previous documents.
+
+    Parameters
+    ----------
+    collection : chromadb Collection or vector_index.NumpyCollection
+        Collection of the vector database to synchronize.
+    embeddings : langchain_core.embeddings.Embeddings
+        Embedding model of the vector database.
+    documents : dict
+        Documents from create_documents, keyed on their ID.
+    batch_size : int
+        Documents per embedding batch, by default settings.INIT_EMBED_BATCH_SIZE.
+    processes : int
+        Processes embedding the batches, by default settings.INIT_EMBED_PROCESSES.
+    backend : str, optional
+        Backend embeddings was loaded with (see ingest_documents), by default 
+        None, i.e. the batches are embedded with embeddings in this process.
+
+    Returns
+    -------
+    dict
+        Number of documents 'added', 'updated', 'deleted' and 'unchanged', 
+        'embedding_seconds' spent embedding and upserting, the 
+        'embedding_seconds_saved' by skipping unchanged documents (estimated 
+        from the changed documents, 0 when none changed), and the 
+        'documents_per_second' and 'peak_rss_mb' of the ingestion.
+    """
+    stored = collection.get(include=['metadatas'])
+    stored_fingerprints = {
+        stored_id: (metadata or {}).get('fingerprint')
+        for stored_id, metadata in zip(stored['ids'], stored['metadatas'])
+    }
+
+    added = [doc_id for doc_id in documents if doc_id not in stored_fingerprints]
+    updated = [
+        doc_id for doc_id in documents
+        if doc_id in stored_fingerprints
+        and stored_fingerprints[doc_id] != documents[doc_id].metadata['fingerprint']
+    ]
+    deleted = [doc_id for doc_id in stored_fingerprints if doc_id not in documents]
+    changed = added + updated
+    unchanged = len(documents) - len(changed)
+
+    start = time.perf_counter()
+    ingestion = {'documents_per_second': 0.0, 'peak_rss_mb': peak_rss_mb()}
+    if changed:
+        ingestion = ingest_documents(
+            collection, embeddings, {doc_id: documents[doc_id] for doc_id in changed},
+            batch_size=batch_size, processes=processes, backend=backend
         )
+        seconds_per_document = (time.perf_counter() - start) / len(changed)
+    else:
+        # nothing to embed, and nothing to estimate the savings from
+        seconds_per_document = 0.0
+    embedding_seconds = seconds_per_document * len(changed)
+    if deleted:
+        collection.delete(ids=deleted)
+    # version lets the chatbot invalidate caches built on previous documents
+    if changed or deleted:
+        collection.modify(metadata={
+            **(collection.metadata or {}), 'version': datetime.now(timezone.utc).isoformat()
+        })
+
+    report = {
+        'added': len(added),
+        'updated': len(updated),
+        'deleted': len(deleted),
+        'unchanged': unchanged,
+        'embedding_seconds': embedding_seconds,
+        'embedding_seconds_saved': seconds_per_document * unchanged,
+        'documents_per_second': ingestion['documents_per_second'],
+        'peak_rss_mb': ingestion['peak_rss_mb']
+    }
+    logger.info(
+        "Synchronized vector database: %d added, %d updated, %d deleted, %d unchanged "
+        "(%.1fs embedding, ~%.1fs saved, %.1f docs/s, peak RSS %.0f MB)",
+        report['added'], report['updated'], report['deleted'], report['unchanged'],
+        report['embedding_seconds'], report['embedding_seconds_saved'],
+        report['documents_per_second'], report['peak_rss_mb']
+    )
 
-        # add data to database
-        vector_store.add_documents(
-            documents=documents,
-            ids=["id"+str(i) for i in range(len(documents))]
+    return report
+
+def ingest_documents(
+    collection, embeddings: Embeddings, documents: dict[str, Document],
+    batch_size: int = settings.INIT_EMBED_BATCH_SIZE, processes: int = settings.INIT_EMBED_PROCESSES,
+    backend: str | None = None
+) -> dict:
+    """Embed documents in batches and upsert each batch as soon as it is embedded
+
+    With more than one process and the backend of embeddings, batches are 
+    embedded by a pool of processes that each load the model of that 
+    backend once (see _init_embedding_worker); at most two batches per 
+    process are in flight so that memory stays bounded however many 
+    documents there are. Otherwise batches are embedded in this process 
+    with embeddings: an embedding model can not be passed to the processes, 
+    so a model that was not loaded with embedding.load_embeddings (e.g. a 
+    custom model or a test double) is never replaced by the pool.
+
+    Parameters
+    ----------
+    collection : chromadb Collection or vector_index.NumpyCollection
+        Collection of the vector database the documents are upserted into.
+    embeddings : langchain_core.embeddings.Embeddings
+        Embedding model of the vector database.
+    documents : dict
+        Documents keyed on their ID.
+    batch_size : int
+        Documents per embedding batch, by default settings.INIT_EMBED_BATCH_SIZE.
+    processes : int
+        Processes embedding the batches, by default settings.INIT_EMBED_PROCESSES.
+    backend : str, optional
+        Backend embeddings was loaded with (see embedding.load_embeddings), 
+        loaded again by the processes, by default None (no processes).
+
+    Returns
+    -------
+    dict
+        Number of 'documents', 'seconds' spent, 'documents_per_second' and 
+        'peak_rss_mb' (peak resident memory of this process or of one of its 
+        embedding processes, whichever is larger).
+    """
+    ids = list(documents)
+    batches = [ids[start:start+batch_size] for start in range(0, len(ids), batch_size)]
+    upserted = 0
+
+    def upsert(batch: list[str], embeddings: list[list[float]]):
+        nonlocal upserted
+        collection.upsert(
+            ids=batch,
+            embeddings=embeddings,
+            documents=[documents[doc_id].page_content for doc_id in batch],
+            metadatas=[documents[doc_id].metadata for doc_id in batch]
         )
+        upserted += len(batch)
+        logger.info("Embedded %d/%d documents", upserted, len(ids))
+
+    start = time.perf_counter()
+    if processes > 1 and len(batches) > 1 and backend is not None:
+        # spawn: the embedding model must not be shared with a forked parent
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_embedding_worker,
+            initargs=(backend,)
+        ) as executor:
+            in_flight = deque()
+            for batch in batches:
+                texts = [documents[doc_id].page_content for doc_id in batch]
+                in_flight.append((batch, executor.submit(_embed_batch, texts)))
+                if len(in_flight) >= 2 * processes:
+                    batch, future = in_flight.popleft()
+                    upsert(batch, future.result())
+            while in_flight:
+                batch, future = in_flight.popleft()
+                upsert(batch, future.result())
+    else:
+        for batch in batches:
+            texts = [documents[doc_id].page_content for doc_id in batch]
+            upsert(batch, embeddings.embed_documents(texts))
+    seconds = time.perf_counter() - start
+
+    return {
+        'documents': len(ids),
+        'seconds': seconds,
+        'documents_per_second': len(ids) / seconds if seconds else 0.0,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def peak_rss_mb() -> float:
+    """Peak resident memory in MB of this process or of its largest child process"""
+    # ru_maxrss is in kilobytes on Linux
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024
+
+# embedding model of an embedding process (see ingest_documents)
+_worker_embeddings = None
+
+def _init_embedding_worker(backend: str):
+    """Load the embedding model once per embedding process"""
+    global _worker_embeddings
+    # one thread per process, the processes already use all cores
+    _worker_embeddings = load_embeddings(backend, threads=1)
+
+def _embed_batch(texts: list[str]) -> list[list[float]]:
+    """Embed a batch of documents in an embedding process"""
+    return _worker_embeddings.embed_documents(texts)
 
 def create_value_object_schema(
-    fieldname: str, fieldtype: Literal["Aggregations", "NumericalAggregations"], description: str | None = None
+    fieldname: str, fieldtype: Literal["Aggregations", "NumericalAggregations"], description: str | None = None,
+    enums_list: list[str] | None = None
 ) -> tuple[str, str, list[str]]:
     """Create SQON value object and description of field name
 
@@ -83,6 +471,9 @@ def create_value_object_schema(
         Data type (Aggregations or NumericalAggregations) of fieldname.
     description : str, optional
         Short description of the field associated with fieldname, by default None.
+    enums_list : list of str, optional
+        Enumerations of an Aggregations field (e.g. from get_all_buckets), by 
+        default None, i.e. queried with get_enums.
 
     Returns
     -------
@@ -96,31 +487,17 @@ def create_value_object_schema(
     """
 
     if fieldtype == "Aggregations":
-        enums_list = get_enums(fieldname)
-        mod_enums_list = '['
-        for enum in enums_list:
-            mod_enums_list = mod_enums_list + '"' + enum.replace('"', '\\"') + '", '
-        mod_enums_list = mod_enums_list[:-2] + ']'
-        
-        properties_value = (
-            '"value": {'
-                '"type": "array", '
-                '"items": {'
-                    f'"enum": {mod_enums_list}, '
-                    '"type": "string"'
-                '}, '
-                '"minItems": 1'
-            '}'
-        )
+        if enums_list is None:
+            enums_list = get_enums(fieldname)
+        properties_value = {
+            "type": "array",
+            "items": {"enum": enums_list, "type": "string"},
+            "minItems": 1
+        }
 
     elif fieldtype == "NumericalAggregations":
         enums_list = []
-
-        properties_value = (
-            '"value": {'
-                '"type": "integer"'
-            '}'
-        )
+        properties_value = {"type": "integer"}
 
     fieldname_periods = fieldname.replace("__", ".")
 
@@ -129,23 +506,19 @@ def create_value_object_schema(
         for r in ("__", "_"):
             description = description.replace(r, " ")
 
-    properties_fieldname = (
-        '"fieldName": {'
-            f'"const": "{fieldname_periods}", '
-            '"type": "string", '
-            f'"description": "{description}"'
-        '}'
-    )
+    properties_fieldname = {
+        "const": fieldname_periods,
+        "type": "string",
+        "description": description
+    }
 
-    value_object = (
-        '{'
-            '"type": "object", '
-            '"required": ["value"], '
-            '"properties": {'
-                f'{properties_fieldname}, '
-                f'{properties_value}'
-            '}'
-        '}'
+    value_object = json.dumps(
+        {
+            "type": "object",
+            "required": ["value"],
+            "properties": {"fieldName": properties_fieldname, "value": properties_value}
+        },
+        ensure_ascii=False
     )
 
     return value_object, description, enums_list
@@ -168,13 +541,93 @@ def get_enums(fieldname: str = "analysis__host__host_gender") -> list[str]:
 
     nested_enums = json_response["data"]["file"]["aggregations"][fieldname]["buckets"]
 
-    enums_list = [
-        single_enum["key"].replace('"', r'\"')
-        for single_enum in nested_enums
-    ]
+    enums_list = [single_enum["key"] for single_enum in nested_enums]
 
     return enums_list
 
+def get_all_buckets(
+    fieldinfos: list[dict], batch_size: int = settings.INIT_BATCH_SIZE,
+    max_workers: int = settings.INIT_WORKERS
+) -> dict[str, dict[str, int]]:
+    """Get the buckets of all fields with batched, concurrent GraphQL queries
+
+    Fields are queried batch_size at a time in a single aggregation query, 
+    with up to max_workers queries in flight. A batch whose query fails is 
+    split in two until the failing fields are isolated. Fields that are not 
+    'Aggregations' (i.e. usually without buckets) are queried individually.
+
+    Parameters
+    ----------
+    fieldinfos : list of dict
+        Field information from get_fieldinfos.
+    batch_size : int
+        Number of fields per GraphQL query, by default settings.INIT_BATCH_SIZE.
+    max_workers : int
+        Number of concurrent GraphQL queries, by default settings.INIT_WORKERS.
+
+    Returns
+    -------
+    dict
+        Bucket keys and their number of records of every field whose 
+        aggregation query succeeds.
+    """
+    aggregations = [info['fieldname'] for info in fieldinfos if info['fieldtype'] == 'Aggregations']
+    others = [info['fieldname'] for info in fieldinfos if info['fieldtype'] != 'Aggregations']
+    batches = [
+        aggregations[start:start+batch_size] for start in range(0, len(aggregations), batch_size)
+    ] + [[fieldname] for fieldname in others]
+
+    buckets = {}
+    queried = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(get_batch_buckets, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            buckets.update(future.result())
+            queried += len(futures[future])
+            logger.info(
+                "Fetched buckets of %d/%d fields (%d skipped)",
+                queried, len(fieldinfos), queried - len(buckets)
+            )
+
+    return buckets
+
+def get_batch_buckets(fieldnames: list[str]) -> dict[str, dict[str, int]]:
+    """Get the buckets of several fields in a single GraphQL query
+
+    Parameters
+    ----------
+    fieldnames : list of str
+        Fields that we wish to obtain buckets for.
+
+    Returns
+    -------
+    dict
+        Bucket key -> number of records (doc_count) of every field whose 
+        aggregation query succeeds. If the query fails, the batch is split 
+        in two and each half is retried.
+    """
+    json_query = (
+        "query{file{aggregations(include_missing:true){"
+        + " ".join(fieldname + "{buckets{key doc_count}}" for fieldname in fieldnames)
+        + "}}}"
+    )
+    json_response = call_graphql_api(json_query)
+
+    if 'errors' not in json_response:
+        aggregations = json_response['data']['file']['aggregations']
+        return {
+            fieldname: {
+                bucket['key']: bucket['doc_count'] for bucket in aggregations[fieldname]['buckets']
+            }
+            for fieldname in fieldnames
+        }
+    if len(fieldnames) == 1:
+        logger.debug("Skipping %s: %s", fieldnames[0], json_response['errors'])
+        return {}
+
+    middle = len(fieldnames) // 2
+    return {**get_batch_buckets(fieldnames[:middle]), **get_batch_buckets(fieldnames[middle:])}
+
 def get_fieldinfos() -> list[dict]:
     """Get field information (i.e. field type) of project using GraphQL
 
@@ -194,9 +647,8 @@ def get_fieldinfos() -> list[dict]:
     return fieldsinfo
 
 def call_graphql_api(
-    # TODO: abstract this value into an EnvVar
-    json_query: str, url: str = 'https://arranger.virusseq-dataportal.ca/graphql'
-) -> str:
+    json_query: str, url: str = settings.ARRANGER_URL
+) -> dict:
     """Create a GraphQL call and return the result
 
     Parameters
@@ -208,22 +660,46 @@ def call_graphql_api(
 
     Returns
     -------
-    str
-        GraphQL response in a JSON string.
+    dict
+        GraphQL response parsed from JSON.
+
+    See Also
+    --------
+    overture_chatbot.arranger.post_graphql: Pooled client shared with the chatbot.
     """
-    headers = {
-        'Content-Type': 'application/json',
-        'Accept': 'application/json',
-        'Connection': 'keep-alive',
-        'DNT': '1'
-    }
-    json_data = {'query': json_query}
-    response = requests.post(
-        url=url, headers=headers, json=json_data, timeout=300
-    )
-    response_json = json.loads(response.content)
+    response_json = post_graphql(json_query, url=url)
 
     return response_json
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Initialize the vector database')
+    parser.add_argument(
+        '--sync', action='store_true',
+        help='update an existing vector database with new, changed and removed fields'
+    )
+    parser.add_argument(
+        '--counts', action='store_true',
+        help='only refresh the local counts of the values of the fields'
+    )
+    parser.add_argument(
+        '--schedule', action='store_true',
+        help='with --counts, keep refreshing them every LOCAL_COUNTS_REFRESH seconds'
+    )
+    parser.add_argument(
+        '--check-counts', action='store_true',
+        help='compare a sample of the local counts with Arranger (exit code 1 on mismatches)'
+    )
+    args = parser.parse_args()
+    if args.schedule and not args.counts:
+        parser.error('--schedule only applies to --counts')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.check_counts:
+        report = counts.check_counts(counts.LocalCounts())
+        sys.exit(1 if report['mismatches'] else 0)
+    elif args.counts and args.schedule:
+        schedule_counts()
+    elif args.counts:
+        refresh_counts()
+    else:
+        main(sync=args.sync)
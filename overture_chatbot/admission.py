@@ -0,0 +1,234 @@
+"""Admission control of LLM generations
+
+Ollama generates with a fixed number of parallel slots on limited CPU, so
+generations beyond them only slow each other down. AdmissionController
+bounds the generations in flight, queues the next ones (first come, first
+served) in a bounded queue and rejects a generation with LLMOverloadedError
+when the queue is full or when it waited in the queue past the deadline.
+AdmittedLLM wraps the LLM so that every generation, streamed or not, holds
+a slot while it runs.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any
+from langchain_core.language_models import BaseLLM
+from opentelemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+meter = metrics.get_meter(__name__)
+queue_wait = meter.create_histogram(
+    'chatbot.llm.queue_wait', unit='s', description='Time LLM generations waited for a slot'
+)
+queue_depth = meter.create_up_down_counter(
+    'chatbot.llm.queue_depth', unit='{generation}', description='LLM generations waiting for a slot'
+)
+in_flight_generations = meter.create_up_down_counter(
+    'chatbot.llm.in_flight', unit='{generation}', description='LLM generations holding a slot'
+)
+rejections = meter.create_counter(
+    'chatbot.llm.rejections', unit='{generation}',
+    description='LLM generations rejected by reason (queue_full or timeout)'
+)
+
+
+class LLMOverloadedError(RuntimeError):
+    """The LLM is too busy to admit a generation (full queue or deadline passed)"""
+
+
+class _Waiter:
+    """Generation waiting in the queue for a slot"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        # granted under the lock of the controller when the slot is handed over
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self) -> bool:
+        if self.event is not None:
+            self.event.set()
+            return True
+        try:
+            self.loop.call_soon_threadsafe(self._set_result)
+        except RuntimeError:
+            # the event loop of the waiter is closed
+            return False
+        return True
+
+    def _set_result(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class AdmissionController:
+    """Thread- and event loop-safe bound on concurrent LLM generations
+
+    Slots are handed over in arrival order to threads (slot) and coroutines
+    (aslot) alike, so all chat sessions of a worker share the same bound.
+
+    Parameters
+    ----------
+    max_in_flight : int
+        Maximum number of generations running at once.
+    max_queue : int
+        Maximum number of generations waiting for a slot; more are rejected.
+    timeout : float
+        Seconds a generation may wait for a slot before it is rejected.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._waiters: deque[_Waiter] = deque()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the duration of a generation (blocking the thread while queued)"""
+        start = time.perf_counter()
+        waiter = self._enter(None)
+        if waiter is not None:
+            waiter.event.wait(self.timeout)
+            self._settle(waiter, cancelled=False)
+        self._admit(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Async version of slot (the event loop keeps running while queued)"""
+        start = time.perf_counter()
+        waiter = self._enter(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(waiter.future, self.timeout)
+            except asyncio.TimeoutError:
+                self._settle(waiter, cancelled=False)
+            except asyncio.CancelledError:
+                self._settle(waiter, cancelled=True)
+                raise
+        self._admit(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def release(self):
+        """Hand the slot of a finished generation over to the next waiter"""
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                queue_depth.add(-1)
+                waiter.granted = True
+                if waiter.wake():
+                    return
+                waiter.granted = False
+            self.in_flight -= 1
+        in_flight_generations.add(-1)
+
+    def stats(self) -> dict:
+        """Generations in flight and queued, admission counters and time waited"""
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'queued': len(self._waiters),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_seconds': self.wait_seconds,
+                'max_wait_seconds': self.max_wait_seconds
+            }
+
+    def _enter(self, loop: asyncio.AbstractEventLoop | None) -> _Waiter | None:
+        """Take a free slot (None) or queue a waiter; raise if the queue is full"""
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiters:
+                self.in_flight += 1
+                in_flight_generations.add(1)
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                rejections.add(1, {'reason': 'queue_full'})
+                raise LLMOverloadedError(
+                    f"{self.in_flight} LLM generations running and {len(self._waiters)} queued"
+                )
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+            queue_depth.add(1)
+            return waiter
+
+    def _settle(self, waiter: _Waiter, cancelled: bool):
+        """Leave the queue after waiting; raise if no slot was handed over in time"""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                queue_depth.add(-1)
+                if cancelled:
+                    return
+                self.rejected += 1
+                self.timed_out += 1
+                rejections.add(1, {'reason': 'timeout'})
+                raise LLMOverloadedError(f"No LLM generation slot within {self.timeout:g}s")
+        if cancelled:
+            # the slot was handed over as the generation was cancelled
+            self.release()
+
+    def _admit(self, seconds: float):
+        with self._lock:
+            self.admitted += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        queue_wait.record(seconds)
+
+
+class AdmittedLLM(BaseLLM):
+    """LLM whose generations are admitted by an AdmissionController
+
+    Delegates to the generation methods of the wrapped LLM (including
+    streaming, callbacks and the generation information of Ollama) while
+    holding a slot of the controller.
+    """
+
+    llm: BaseLLM
+    admission: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm._llm_type
+
+    @property
+    def _identifying_params(self) -> dict:
+        return self.llm._identifying_params
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        with self.admission.slot():
+            return self.llm._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        async with self.admission.aslot():
+            return await self.llm._agenerate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        with self.admission.slot():
+            yield from self.llm._stream(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(self, prompt, stop=None, run_manager=None, **kwargs):
+        async with self.admission.aslot():
+            async for chunk in self.llm._astream(prompt, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
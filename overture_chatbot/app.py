@@ -1,39 +1,109 @@
 """Chainlit GUI for chatbot"""
 
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import chainlit as cl
-from query_graphql import query_total_chain
+import httpx
+import requests
+from overture_chatbot import instrumentation, settings
+from overture_chatbot.query_graphql import (
+    warm_up, astream_query_total_summary, get_query_breakdown_chain,
+    KEYWORDS_STEP, SQON_STEP, TOTAL_STEP, ANSWER_STEP, TIMINGS_STEP
+)
+from overture_chatbot.admission import LLMOverloadedError
+from overture_chatbot.arranger import ArrangerQueryError
+from overture_chatbot.breakdown import is_breakdown_question, BreakdownError
+from overture_chatbot.sqon import SQONValidationError
+
+logger = logging.getLogger(__name__)
+
+# export the traces and metrics of the questions (if enabled)
+instrumentation.configure()
+
+# load the models and connect to the services in the background at start up;
+# the shared chains and resources are then reused by all chat sessions
+warm_up_future = ThreadPoolExecutor(max_workers=1).submit(warm_up) if settings.WARM_UP else None
+
+# names of the intermediate steps shown in the GUI
+STEP_NAMES = {
+    KEYWORDS_STEP: 'Keywords',
+    SQON_STEP: 'SQON',
+    TOTAL_STEP: 'Total'
+}
+
+async def wait_until_ready():
+    """Wait for the warm-up started with the app (if any) to finish"""
+    if warm_up_future is not None:
+        await asyncio.wrap_future(warm_up_future)
 
 @cl.on_chat_start
 async def on_chat_start():
     """Chainlit hook that executes on start of chat"""
+    if warm_up_future is not None and not warm_up_future.done():
+        loading = cl.Message(content="Loading the models, the chatbot will be ready in a moment...")
+        await loading.send()
+        await wait_until_ready()
+        await loading.remove()
     await cl.Message(content="Welcome to the Overture Chatbot!").send()
 
-def invoke_query_total_chain(query):
-    """Creates a Langchain chain and invokes
+@cl.on_message
+async def on_message(message: cl.Message):
+    """Chainlit hook that executes after every message
+
+    Each stage of the chain (extracted keywords, generated SQON and total
+    number of records) is shown as a step as soon as it completes, and the
+    summary is streamed token by token as the LLM generates it. Invalid 
+    SQONs are reported to the user without querying Arranger, Arranger 
+    errors and timeouts are reported as such, and questions rejected by the 
+    admission control of the LLM (see query_graphql.llm_admission) are 
+    asked to retry later. Messages 
+    sent during the warm-up wait for it to finish. With settings.SHOW_TIMINGS, 
+    the time spent in each stage is appended to the answer.
 
-    Parameters
-    ----------
-    query : dict
-        Dictionary with "query" as a key and a custom query message
+    Questions asking for the number of records per value of a field (i.e. 
+    'How many samples per province') are answered with the distribution of 
+    the values from a single Arranger aggregation instead, unless no field 
+    matches (breakdown.BreakdownError), in which case the total is answered.
 
-    Returns
-    -------
-    str
-        Returns the result of the invoked chain
-    
     See Also
     --------
-    query_graphql.query_total_chain
+    query_graphql.astream_query_total_summary
+    query_graphql.query_breakdown_chain
     """
-    chain = query_total_chain()
-    result = chain.invoke(query)
-
-    return result
-
-@cl.on_message
-async def on_message(message: cl.Message):
-    """Chainlit hook that executes after every message"""
-    answer = await cl.make_async(invoke_query_total_chain)({"query": message.content})
-    await cl.Message(
-        content=answer,
-    ).send()
+    await wait_until_ready()
+    answer = cl.Message(content="")
+    try:
+        if is_breakdown_question(message.content):
+            try:
+                breakdown = await get_query_breakdown_chain().ainvoke(message.content)
+            except BreakdownError as e:
+                logger.info("Answering the total of %r: %s", message.content, e)
+            else:
+                answer.content = '\n'.join(f"- {line}" for line in breakdown.splitlines())
+                await answer.send()
+                return
+        async for step, output in astream_query_total_summary(message.content):
+            if step == ANSWER_STEP:
+                await answer.stream_token(output)
+            elif step == TIMINGS_STEP:
+                await answer.stream_token(f"\n\n{output}")
+            else:
+                async with cl.Step(name=STEP_NAMES[step], type="tool") as chain_step:
+                    chain_step.output = output
+    except SQONValidationError as e:
+        answer.content = (
+            "Sorry, I could not turn your question into a valid query "
+            f"({e}). Please try rephrasing it."
+        )
+    except (ArrangerQueryError, requests.RequestException, httpx.HTTPError):
+        answer.content = (
+            "Sorry, the data portal could not answer your question right now. "
+            "Please try again in a minute."
+        )
+    except LLMOverloadedError:
+        answer.content = (
+            "Sorry, the chatbot is busy answering other questions right now. "
+            "Please try again in a minute."
+        )
+    await answer.send()
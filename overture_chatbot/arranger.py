@@ -0,0 +1,221 @@
+"""Arranger GraphQL client
+
+Shared client used by the chatbot and the vector database initialization
+to send GraphQL queries to Arranger. Connections are kept alive and pooled
+per endpoint so that consecutive queries reuse the same TCP/TLS connection
+instead of opening a new one for every question.
+"""
+
+import asyncio
+import json
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from overture_chatbot import settings
+
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'Connection': 'keep-alive',
+    'DNT': '1'
+}
+
+# one session (and connection pool) per GraphQL endpoint
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+# one async client per GraphQL endpoint and event loop
+_async_clients: dict[tuple[str, asyncio.AbstractEventLoop], httpx.AsyncClient] = {}
+
+
+class ArrangerQueryError(Exception):
+    """Raised when Arranger returns errors for a GraphQL query"""
+
+
+def get_session(url: str = settings.ARRANGER_URL) -> requests.Session:
+    """Get the pooled HTTP session for a GraphQL endpoint
+
+    The session is created on first use and reused afterwards. Sessions are
+    safe to share between threads (e.g. concurrent Chainlit messages).
+
+    Parameters
+    ----------
+    url : str
+        GraphQL endpoint, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    requests.Session
+        Session with keep-alive connection pooling for the endpoint.
+    """
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            adapter = HTTPAdapter(
+                pool_connections=settings.ARRANGER_POOL_CONNECTIONS,
+                pool_maxsize=settings.ARRANGER_POOL_MAXSIZE
+            )
+            session = requests.Session()
+            session.headers.update(HEADERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[url] = session
+
+    return session
+
+
+def close_sessions():
+    """Close all pooled sessions and their connections"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client(url: str = settings.ARRANGER_URL) -> httpx.AsyncClient:
+    """Get the pooled async HTTP client for a GraphQL endpoint
+
+    Async counterpart of get_session. Clients are bound to the running 
+    event loop, so one client is kept per endpoint and event loop.
+
+    Parameters
+    ----------
+    url : str
+        GraphQL endpoint, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    httpx.AsyncClient
+        Client with keep-alive connection pooling for the endpoint.
+    """
+    key = (url, asyncio.get_running_loop())
+    client = _async_clients.get(key)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=HEADERS,
+            limits=httpx.Limits(
+                max_connections=settings.ARRANGER_POOL_MAXSIZE,
+                max_keepalive_connections=settings.ARRANGER_POOL_MAXSIZE
+            ),
+            timeout=httpx.Timeout(
+                settings.ARRANGER_READ_TIMEOUT, connect=settings.ARRANGER_CONNECT_TIMEOUT
+            )
+        )
+        _async_clients[key] = client
+
+    return client
+
+
+async def aclose_clients():
+    """Close the async clients of the running event loop"""
+    loop = asyncio.get_running_loop()
+    for key in [key for key in _async_clients if key[1] is loop]:
+        await _async_clients.pop(key).aclose()
+
+
+def post_graphql(json_query: str, url: str = settings.ARRANGER_URL) -> dict:
+    """Send a GraphQL query using the pooled session of the endpoint
+
+    Parameters
+    ----------
+    json_query : str
+        GraphQL query.
+    url : str
+        GraphQL endpoint, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    dict
+        Full GraphQL response (i.e. with 'data' and/or 'errors' keys).
+
+    Raises
+    ------
+    requests.HTTPError
+        If Arranger (or a proxy in front of it) answers with a server error.
+    ArrangerQueryError
+        If the response is not JSON.
+    """
+    response = get_session(url).post(
+        url=url,
+        json={'query': json_query},
+        timeout=(settings.ARRANGER_CONNECT_TIMEOUT, settings.ARRANGER_READ_TIMEOUT)
+    )
+
+    return decode_response(response)
+
+
+def decode_response(response: requests.Response | httpx.Response) -> dict:
+    """Decode the GraphQL response of Arranger
+
+    Server errors (e.g. the 502 page of a proxy) raise the HTTP error of the 
+    client. Client errors are decoded: GraphQL errors (i.e. invalid 
+    filters) come with a 400 status and a JSON body with 'errors'.
+
+    Parameters
+    ----------
+    response : requests.Response or httpx.Response
+        Response of Arranger.
+
+    Returns
+    -------
+    dict
+        Full GraphQL response.
+
+    Raises
+    ------
+    requests.HTTPError or httpx.HTTPStatusError
+        If the status is a server error (5xx).
+    ArrangerQueryError
+        If the body is not JSON.
+    """
+    if response.status_code >= 500:
+        response.raise_for_status()
+    try:
+        return json.loads(response.content)
+    except ValueError as e:
+        raise ArrangerQueryError(
+            f"Arranger answered with status {response.status_code} and a body that is not JSON ({e})"
+        ) from e
+
+
+def run_graphql(json_query: str, url: str = settings.ARRANGER_URL) -> dict:
+    """Send a GraphQL query and return its data
+
+    Parameters
+    ----------
+    json_query : str
+        GraphQL query.
+    url : str
+        GraphQL endpoint, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    dict
+        'data' field of the GraphQL response.
+
+    Raises
+    ------
+    ArrangerQueryError
+        If the response contains GraphQL errors.
+    """
+    json_response = post_graphql(json_query, url=url)
+    if 'errors' in json_response:
+        raise ArrangerQueryError(json_response['errors'])
+
+    return json_response['data']
+
+
+async def apost_graphql(json_query: str, url: str = settings.ARRANGER_URL) -> dict:
+    """Async version of post_graphql"""
+    response = await get_async_client(url).post(url, json={'query': json_query})
+
+    return decode_response(response)
+
+
+async def arun_graphql(json_query: str, url: str = settings.ARRANGER_URL) -> dict:
+    """Async version of run_graphql"""
+    json_response = await apost_graphql(json_query, url=url)
+    if 'errors' in json_response:
+        raise ArrangerQueryError(json_response['errors'])
+
+    return json_response['data']
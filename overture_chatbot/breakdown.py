@@ -0,0 +1,185 @@
+"""Breakdown questions
+
+Recognizes questions asking for the number of records per value of a field
+(e.g. 'How many samples per province' or 'males vs females') and builds the
+Arranger aggregation query returning the number of records of every value
+(bucket) of the field in one request, with the SQON filters of the
+question applied.
+"""
+
+import json
+import re
+from overture_chatbot.keywords import STOPWORDS, _WORD_REGEX, normalize_word
+
+# words introducing the field to break the records down by (e.g. 'per province'); bare 'each'
+# and 'across' also introduce filters (e.g. 'where each host is male', 'across Canada')
+GROUP_BY_REGEX = re.compile(
+    r'\b(?:per|for each|by each|in each|does each|grouped by|broken down by|split by|'
+    r'breakdown (?:of|by)|distribution (?:of|by|across))\s+(?:the\s+|each\s+|every\s+)?',
+    re.IGNORECASE
+)
+# words comparing values of a field (e.g. 'males vs females')
+COMPARISON_REGEX = re.compile(r'\s(?:vs\.?|versus|compared (?:to|with))\s', re.IGNORECASE)
+# words ending the phrase of a field or value, besides the stopwords of keywords
+PHRASE_BREAKS = STOPWORDS | {'among', 'amongst', 'during', 'since', 'until', 'within', 'without'}
+# Arranger key of the bucket of records without a value (include_missing)
+MISSING_KEY = '__missing__'
+
+
+class BreakdownError(ValueError):
+    """Raised when the field to break the records down by can not be found"""
+
+
+def breakdown_keywords(question: str) -> list[str]:
+    """Get the keywords of the field (or of the values) to break the records down by
+
+    Parameters
+    ----------
+    question : str
+        Question asked by the user.
+
+    Returns
+    -------
+    list of str
+        Phrase following a group-by word (e.g. ['province'] for 'How many
+        samples per province'), or the compared values (e.g. ['males',
+        'females'] for 'How many males vs females'); empty if the question
+        does not ask for a breakdown.
+    """
+    comparison = COMPARISON_REGEX.search(question)
+    if comparison:
+        before = _phrase(reversed(_WORD_REGEX.findall(question[:comparison.start()])))
+        after = _phrase(_WORD_REGEX.findall(question[comparison.end():]))
+        return [' '.join(reversed(before)), ' '.join(after)] if before and after else []
+
+    group_by = GROUP_BY_REGEX.search(question)
+    if group_by:
+        phrase = _phrase(_WORD_REGEX.findall(question[group_by.end():]))
+        return [' '.join(phrase)] if phrase else []
+
+    return []
+
+
+def is_breakdown_question(question: str) -> bool:
+    """Whether the question asks for the number of records per value of a field"""
+    return bool(breakdown_keywords(question))
+
+
+def is_comparison(question: str) -> bool:
+    """Whether the question compares values of a field (e.g. 'males vs females')"""
+    return COMPARISON_REGEX.search(question) is not None
+
+
+def select_breakdown_field(keywords: list[str], sqons: list[str], match_values: bool = True) -> str:
+    """Select the field to break the records down by
+
+    Fields whose description contains the most words of the keywords come
+    first (e.g. 'province'), then fields with the most words of the
+    keywords in their enumerations (e.g. 'males' and 'females').
+
+    Parameters
+    ----------
+    keywords : list of str
+        Keywords of the field or of the values (see breakdown_keywords).
+    sqons : list of str
+        SQON value objects of the fields retrieved for the keywords, most
+        relevant first. Only fields with enumerations have buckets.
+    match_values : bool
+        Select fields whose enumerations match the keywords, by default
+        True. Keywords following a group-by word name the field (e.g. 'per
+        province'), whereas a value there (e.g. 'per Nova Scotia') is a
+        filter, so only descriptions match them.
+
+    Returns
+    -------
+    str
+        Name of the field (e.g. 'analysis.host.host_gender').
+
+    Raises
+    ------
+    BreakdownError
+        If no field with enumerations matches the keywords (or, without
+        match_values, no description does).
+    """
+    words = {
+        normalize_word(word) for keyword in keywords for word in _WORD_REGEX.findall(keyword)
+    } - STOPWORDS
+    best_field, best_score = None, (0, 0)
+    for sqon in sqons:
+        try:
+            properties = json.loads(sqon)['properties']
+            field = properties['fieldName']['const']
+            enums = properties['value']['items']['enum']
+        except (json.JSONDecodeError, KeyError, TypeError):
+            continue
+        description = properties['fieldName'].get('description') or field.replace('.', ' ')
+        description_words = {normalize_word(word) for word in _WORD_REGEX.findall(description)}
+        enum_words = {
+            normalize_word(word) for enum in enums for word in _WORD_REGEX.findall(str(enum))
+        }
+        score = (len(words & description_words), len(words & enum_words) if match_values else 0)
+        if score > best_score:
+            best_field, best_score = field, score
+
+    if best_field is None:
+        raise BreakdownError(f"No field with values matches {', '.join(keywords)!r}")
+
+    return best_field
+
+
+def aggregation_graphql(field: str, sqon_filters: str | None = None) -> str:
+    """GraphQL query of the number of records of every value of a field
+
+    Parameters
+    ----------
+    field : str
+        Name of the field (e.g. 'analysis.host.host_gender').
+    sqon_filters : str, optional
+        Canonical SQON filters (GraphQL literal) applied to the records,
+        including to the buckets of the field itself.
+
+    Returns
+    -------
+    str
+        Aggregation query, in the shape used to get the enumerations of the
+        fields when initializing the vector database.
+    """
+    arguments = 'aggregations_filter_themselves:true, include_missing:true'
+    if sqon_filters:
+        arguments = f'filters:{sqon_filters}, {arguments}'
+    name = field.replace('.', '__')
+
+    return f"query{{file{{aggregations({arguments}){{{name}{{buckets{{key doc_count}}}}}}}}}}"
+
+
+def format_breakdown(buckets: dict[str, int]) -> str:
+    """Format the number of records per value, largest first
+
+    Parameters
+    ----------
+    buckets : dict
+        Value -> number of records (MISSING_KEY for records without a value).
+
+    Returns
+    -------
+    str
+        One 'value: number' line per value.
+    """
+    ranked = sorted(buckets.items(), key=lambda bucket: -bucket[1])
+
+    return '\n'.join(
+        f"{'No value' if key == MISSING_KEY else key}: {count}" for key, count in ranked
+    )
+
+
+def _phrase(words) -> list[str]:
+    """Leading words up to the first stopword, skipping leading stopwords"""
+    phrase = []
+    for word in words:
+        if word.lower() in PHRASE_BREAKS:
+            if phrase:
+                break
+            continue
+        phrase.append(word)
+
+    return phrase
@@ -0,0 +1,172 @@
+"""Bulk questions
+
+Runs a file of questions (e.g. reports or regression sets) through the
+SQON generation of query_total_chain and sends the SQON filters of each
+batch of questions to Arranger in a single GraphQL request (see
+query_graphql.query_graphql_batch). Results are written as JSON lines as
+soon as their batch is answered.
+
+Each line of the input is a JSON object with a 'question' (or 'query') and
+an optional 'id' (the line number by default).
+"""
+
+import argparse
+import json
+import logging
+import sys
+import time
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from langchain_core.runnables import RunnableLambda
+from overture_chatbot import query_graphql, settings
+
+logger = logging.getLogger(__name__)
+
+def main(
+    input_file: str, output_file: str | None = None,
+    batch_size: int = settings.BULK_BATCH_SIZE,
+    max_concurrency: int = settings.BULK_MAX_CONCURRENCY
+):
+    """Answer the questions of a JSONL file and write the results as JSONL
+
+    Parameters
+    ----------
+    input_file : str
+        JSONL file of questions ('-' for the standard input).
+    output_file : str, optional
+        JSONL file of results, by default the standard output.
+    batch_size : int
+        Questions per Arranger request, by default settings.BULK_BATCH_SIZE.
+    max_concurrency : int
+        SQONs generated at once, by default settings.BULK_MAX_CONCURRENCY.
+    """
+    questions_file = sys.stdin if input_file == '-' else open(input_file, encoding='utf-8')
+    results_file = open(output_file, 'w', encoding='utf-8') if output_file else sys.stdout
+    answered = failed = 0
+    try:
+        for result in answer_questions(read_questions(questions_file), batch_size, max_concurrency):
+            results_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            results_file.flush()
+            answered += 1
+            failed += result['error'] is not None
+    finally:
+        if questions_file is not sys.stdin:
+            questions_file.close()
+        if results_file is not sys.stdout:
+            results_file.close()
+    logger.info("Answered %d questions (%d failed)", answered, failed)
+
+def read_questions(lines: Iterable[str]) -> Iterator[dict]:
+    """Read the questions of JSON lines
+
+    Parameters
+    ----------
+    lines : iterable of str
+        JSON objects with a 'question' (or 'query') and an optional 'id';
+        blank lines are skipped.
+
+    Yields
+    ------
+    dict
+        'id' (the line number if missing) and 'question' of every line.
+
+    Raises
+    ------
+    ValueError
+        If a line is not a JSON object with a question.
+    """
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            question = item.get('question', item.get('query'))
+        except (json.JSONDecodeError, AttributeError) as e:
+            raise ValueError(f"Line {number} is not a JSON object: {e}") from e
+        if not isinstance(question, str) or not question.strip():
+            raise ValueError(f"Line {number} has no 'question'")
+        yield {'id': item.get('id', number), 'question': question}
+
+def answer_questions(
+    questions: Iterable[dict],
+    batch_size: int = settings.BULK_BATCH_SIZE,
+    max_concurrency: int = settings.BULK_MAX_CONCURRENCY
+) -> Iterator[dict]:
+    """Answer questions in batches, with one Arranger request per batch
+
+    Parameters
+    ----------
+    questions : iterable of dict
+        Questions with an 'id' and a 'question' (see read_questions).
+    batch_size : int
+        Questions per Arranger request, by default settings.BULK_BATCH_SIZE.
+    max_concurrency : int
+        SQONs generated at once, by default settings.BULK_MAX_CONCURRENCY.
+
+    Yields
+    ------
+    dict
+        Result of every question, in the order of the questions: 'id',
+        'question', 'sqon_filters', 'total' (int) and 'error' (None unless
+        the SQON generation or Arranger failed), and 'seconds' spent
+        generating the SQON ('sqon') and in the Arranger request of the
+        batch ('arranger', shared by the questions of the batch).
+    """
+    sqon_chain = query_graphql.create_cached_sqon_schema() | query_graphql.format_sqon_filters
+
+    def generate_sqon(question: str) -> dict:
+        start = time.perf_counter()
+        try:
+            sqon_filters, error = sqon_chain.invoke({'query': question}), None
+        except Exception as e:
+            sqon_filters, error = None, f"{type(e).__name__}: {e}"
+        return {
+            'sqon_filters': sqon_filters, 'error': error,
+            'seconds': {'sqon': time.perf_counter() - start}
+        }
+
+    generate_sqons = RunnableLambda(generate_sqon)
+    questions = iter(questions)
+    while batch := list(islice(questions, batch_size)):
+        results = generate_sqons.batch(
+            [item['question'] for item in batch], config={'max_concurrency': max_concurrency}
+        )
+        answered = [result for result in results if result['error'] is None]
+
+        start = time.perf_counter()
+        responses = query_graphql.query_graphql_batch(
+            [result['sqon_filters'].strip() for result in answered]
+        ) if answered else []
+        seconds = time.perf_counter() - start
+        for result, response in zip(answered, responses):
+            if isinstance(response, Exception):
+                result['error'] = f"{type(response).__name__}: {response}"
+            else:
+                result['total'] = json.loads(response)['file']['hits']['total']
+            result['seconds']['arranger'] = seconds
+
+        for item, result in zip(batch, results):
+            yield {
+                **item,
+                'sqon_filters': result['sqon_filters'],
+                'total': result.get('total'),
+                'error': result['error'],
+                'seconds': result['seconds']
+            }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Answer a JSONL file of questions')
+    parser.add_argument('questions', help="JSONL file of questions ('-' for the standard input)")
+    parser.add_argument('--output', help='JSONL file of results (the standard output by default)')
+    parser.add_argument(
+        '--batch-size', type=int, default=settings.BULK_BATCH_SIZE,
+        help='questions per Arranger request'
+    )
+    parser.add_argument(
+        '--max-concurrency', type=int, default=settings.BULK_MAX_CONCURRENCY,
+        help='SQONs generated at once'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    main(args.questions, args.output, args.batch_size, args.max_concurrency)
@@ -0,0 +1,385 @@
+"""Caches for the chatbot
+
+In-process caches shared by all Chainlit sessions of a worker.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from collections.abc import Callable, Hashable
+import numpy as np
+
+# returned by TTLCache.get on a cache miss when no default is given
+MISSING = object()
+
+
+def sizeof(value: object) -> int:
+    """Approximate size in bytes of a cached key or value"""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+
+    return sys.getsizeof(value)
+
+
+class TTLCache:
+    """Thread-safe least recently used cache with expiring entries
+
+    The cache is bounded both in number of entries and in bytes (keys and
+    values); the least recently used entries are evicted first. Entries
+    older than the time to live are dropped when they are next looked up.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of entries; 0 disables the cache.
+    max_bytes : int
+        Maximum total size in bytes of keys and values.
+    ttl : float
+        Time to live of an entry in seconds.
+    getsizeof : callable, optional
+        Function returning the size in bytes of a key or value, by default sizeof.
+    """
+
+    def __init__(
+        self, max_entries: int, max_bytes: int, ttl: float,
+        getsizeof: Callable[[object], int] = sizeof
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.getsizeof = getsizeof
+
+        # key -> (expiry time, value, size in bytes)
+        self._entries: OrderedDict[Hashable, tuple[float, object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: object = MISSING) -> object:
+        """Get the value of key, or default if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def set(self, key: Hashable, value: object):
+        """Add or replace the value of key, evicting entries if needed"""
+        size = self.getsizeof(key) + self.getsizeof(value)
+        if self.max_entries < 1 or size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: Hashable):
+        """Remove the entry of key if present"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        """Counters and size of the cache"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def _remove(self, key: Hashable):
+        self.bytes -= self._entries.pop(key)[2]
+
+
+class SemanticCache:
+    """Thread-safe cache of SQONs keyed on the embedding of the question
+
+    A question is a hit when the cosine similarity between its embedding and
+    the embedding of a previously answered question is at least the
+    threshold, and both questions have the same literals (e.g. the numbers
+    and values they filter on, which barely change the embedding). Embeddings are kept in an in-process matrix so that a lookup
+    is a single matrix-vector product. Entries are evicted in least recently
+    used order and expire after the time to live.
+
+    The cache is tied to a version of the vector database (see
+    query_graphql.get_collection_version); all entries are dropped when
+    the version changes, i.e. when the 'overture' collection is rebuilt.
+
+    Parameters
+    ----------
+    max_entries : int
+        Maximum number of questions; 0 disables the cache.
+    threshold : float
+        Minimum cosine similarity for a hit.
+    ttl : float
+        Time to live of an entry in seconds.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, ttl: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.version = None
+
+        # rows of the matrix are the normalized embeddings of the questions
+        self._matrix: np.ndarray | None = None
+        # row -> {'question', 'literals', 'sqon', 'latency', 'expires'}, least recently used first
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(
+        self, embedding: list[float], version: str | None = None, literals: Hashable = None
+    ) -> str | None:
+        """Get the SQON of the most similar question
+
+        Parameters
+        ----------
+        embedding : list of float
+            Embedding of the question.
+        version : str, optional
+            Version of the vector database, by default None.
+        literals : hashable, optional
+            Literals of the question; only questions added with equal 
+            literals are matched, by default None.
+
+        Returns
+        -------
+        str or None
+            SQON of the most similar question, or None on a miss.
+        """
+        with self._lock:
+            self._check_version(version)
+            # expired entries are removed first, so that they do not hide a live match
+            now = time.monotonic()
+            for row in [row for row, entry in self._entries.items() if entry['expires'] < now]:
+                del self._entries[row]
+            rows = [row for row, entry in self._entries.items() if entry['literals'] == literals]
+            if not rows:
+                self.misses += 1
+                return None
+
+            rows = np.array(rows, dtype=int)
+            similarities = self._matrix[rows] @ _normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            best = int(rows[best])
+            entry = self._entries[best]
+            self._entries.move_to_end(best)
+            self.hits += 1
+            self.latency_saved += entry['latency']
+
+            return entry['sqon']
+
+    def add(
+        self, question: str, embedding: list[float], sqon: str,
+        latency: float, version: str | None = None, literals: Hashable = None
+    ):
+        """Add the SQON generated for a question
+
+        Parameters
+        ----------
+        question : str
+            Question asked by the user.
+        embedding : list of float
+            Embedding of the question.
+        sqon : str
+            SQON generated for the question.
+        latency : float
+            Seconds it took to generate the SQON (i.e. saved on a hit).
+        version : str, optional
+            Version of the vector database, by default None.
+        literals : hashable, optional
+            Literals of the question (see lookup), by default None.
+        """
+        if self.max_entries < 1:
+            return
+
+        with self._lock:
+            self._check_version(version)
+            vector = _normalize(embedding)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+            if len(self._entries) < self.max_entries:
+                row = next(i for i in range(self.max_entries) if i not in self._entries)
+            else:
+                row, _ = self._entries.popitem(last=False)
+                self.evictions += 1
+
+            self._matrix[row] = vector
+            self._entries[row] = {
+                'question': question,
+                'literals': literals,
+                'sqon': sqon,
+                'latency': latency,
+                'expires': time.monotonic() + self.ttl
+            }
+
+    def invalidate(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Counters, hit rate and seconds of SQON generation saved by the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'latency_saved': self.latency_saved
+            }
+
+    def _check_version(self, version: str | None):
+        if version != self.version:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self.version = version
+
+
+class SingleFlight:
+    """Coalescing of identical in-flight calls (single flight)
+
+    Concurrent calls with the same key share one computation: the first
+    call runs the function and the calls arriving before it completes wait
+    for its result (or its exception) instead of running it again. Nothing
+    is kept once the computation completes (see TTLCache for that).
+
+    Threads are coalesced with do and coroutines of the same event loop
+    with ado; an async computation runs in its own task, so that it carries
+    on for the other callers when the caller that started it is cancelled.
+
+    Parameters
+    ----------
+    enabled : bool
+        Coalesce calls, by default True (False runs every call).
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # key -> future of the computation run by a thread
+        self._calls: dict[Hashable, Future] = {}
+        # (event loop, key) -> task of the computation
+        self._tasks: dict[tuple[asyncio.AbstractEventLoop, Hashable], asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> object:
+        """Call func(*args, **kwargs), or wait for the identical call in flight"""
+        if not self.enabled:
+            return func(*args, **kwargs)
+
+        with self._lock:
+            self.calls += 1
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                self._calls[key] = Future()
+        if future is not None:
+            return future.result()
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self._done(key).set_exception(e)
+            raise
+        self._done(key).set_result(result)
+
+        return result
+
+    async def ado(self, key: Hashable, func: Callable, *args, **kwargs) -> object:
+        """Await func(*args, **kwargs), or the identical call in flight"""
+        if not self.enabled:
+            return await func(*args, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get((loop, key))
+            if task is not None:
+                self.coalesced += 1
+            else:
+                task = self._tasks[(loop, key)] = loop.create_task(func(*args, **kwargs))
+                task.add_done_callback(lambda task: self._task_done(loop, key, task))
+
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        """Calls and calls coalesced with an identical call in flight"""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls) + len(self._tasks)
+            }
+
+    def _done(self, key: Hashable) -> Future:
+        with self._lock:
+            return self._calls.pop(key)
+
+    def _task_done(self, loop: asyncio.AbstractEventLoop, key: Hashable, task: asyncio.Task):
+        with self._lock:
+            del self._tasks[(loop, key)]
+        # the exception is retrieved even if every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+
+    return vector / norm if norm else vector
@@ -0,0 +1,420 @@
+"""Local counts of single-field filters
+
+The vector database initialization stores the number of records of every
+value (bucket) of the fields of Arranger, and the total number of records,
+in a small SQLite file (see write_counts). SQON filters selecting values of
+a single field (e.g. host gender in ['Male'], or in ['Female', 'Male']) are
+answered from it without querying Arranger (see LocalCounts.total); any
+other filters, and counts older than settings.LOCAL_COUNTS_MAX_AGE, are
+left to Arranger. check_counts compares a sample of the local counts with
+live Arranger results.
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+from overture_chatbot import settings
+from overture_chatbot.arranger import run_graphql
+from overture_chatbot.sqon import canonicalize_sqon, to_graphql
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE counts (
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    doc_count INTEGER NOT NULL,
+    PRIMARY KEY (field, value)
+) WITHOUT ROWID;
+CREATE TABLE fields (field TEXT PRIMARY KEY, complete INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+"""
+
+
+class Snapshot(NamedTuple):
+    """Counts loaded from the file written by write_counts"""
+    # field (e.g. 'analysis.host.host_gender') -> value -> number of records
+    counts: dict[str, dict[str, int]]
+    # fields whose records have exactly one value (or none) each
+    complete: frozenset[str]
+    total: int
+    refreshed_at: float
+    arranger_url: str
+
+
+def write_counts(
+    buckets: dict[str, dict[str, int]], total: int,
+    path: str = settings.LOCAL_COUNTS_PATH, url: str = settings.ARRANGER_URL
+) -> dict:
+    """Write the number of records of every value of the fields
+
+    The file is written to a temporary file renamed over the previous one,
+    so that the chatbot never reads a partially written file.
+
+    Parameters
+    ----------
+    buckets : dict
+        Field name (e.g. 'analysis__host__host_gender') -> value -> number of
+        records, including the records without a value ('__missing__').
+    total : int
+        Total number of records, queried with the buckets.
+    path : str
+        SQLite file, by default settings.LOCAL_COUNTS_PATH.
+    url : str
+        Arranger endpoint the counts come from, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    dict
+        Number of 'fields', 'complete_fields' and 'values' written.
+
+    Notes
+    -----
+    A field is complete when the numbers of records of its values add up
+    to the total, i.e. every record has exactly one value (or none) and
+    Arranger returned all of them. The number of records of several values
+    of a field is the sum of their numbers only for complete fields.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temporary_path = path + '.tmp'
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+
+    complete = 0
+    connection = sqlite3.connect(temporary_path)
+    try:
+        connection.executescript(SCHEMA)
+        for fieldname, field_buckets in buckets.items():
+            field = fieldname.replace('__', '.')
+            is_complete = sum(field_buckets.values()) == total
+            complete += is_complete
+            connection.execute('INSERT INTO fields VALUES (?, ?)', (field, int(is_complete)))
+            connection.executemany(
+                'INSERT INTO counts VALUES (?, ?, ?)',
+                [(field, str(value), doc_count) for value, doc_count in field_buckets.items()]
+            )
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)', [
+            ('total', str(total)),
+            ('refreshed_at', datetime.now(timezone.utc).isoformat()),
+            ('arranger_url', url)
+        ])
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temporary_path, path)
+
+    return {
+        'fields': len(buckets),
+        'complete_fields': complete,
+        'values': sum(len(field_buckets) for field_buckets in buckets.values())
+    }
+
+
+def read_counts(path: str = settings.LOCAL_COUNTS_PATH) -> Snapshot:
+    """Read the counts written by write_counts
+
+    Raises
+    ------
+    sqlite3.Error
+        If path is not a file written by write_counts.
+    """
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        counts = {}
+        for field, value, doc_count in connection.execute('SELECT field, value, doc_count FROM counts'):
+            counts.setdefault(field, {})[value] = doc_count
+        complete = frozenset(
+            field for field, in connection.execute('SELECT field FROM fields WHERE complete')
+        )
+        metadata = dict(connection.execute('SELECT key, value FROM metadata'))
+    finally:
+        connection.close()
+
+    return Snapshot(
+        counts=counts,
+        complete=complete,
+        total=int(metadata['total']),
+        refreshed_at=datetime.fromisoformat(metadata['refreshed_at']).timestamp(),
+        arranger_url=metadata['arranger_url']
+    )
+
+
+def field_values(sqon: dict) -> tuple[str, list[str]] | None:
+    """Field and values of SQON filters selecting values of a single field
+
+    Parameters
+    ----------
+    sqon : dict
+        SQON filters as a dictionary.
+
+    Returns
+    -------
+    tuple of (str, list of str) or None
+        Field and values (e.g. ('analysis.host.host_gender', ['Male'])) of an
+        'in' operation, alone or as the only operation of an 'and' or an
+        'or', or of an 'or' of 'in' operations of the same field (a union
+        of values); None for any other filters.
+    """
+    if not isinstance(sqon, dict) or set(sqon) != {'op', 'content'}:
+        return None
+    op, content = sqon['op'], sqon['content']
+
+    if op == 'in':
+        if not isinstance(content, dict) or set(content) != {'fieldName', 'value'}:
+            return None
+        field, values = content['fieldName'], content['value']
+        if isinstance(values, str):
+            values = [values]
+        if not (isinstance(field, str) and isinstance(values, list) and values):
+            return None
+        if not all(isinstance(value, str) for value in values):
+            return None
+        return field, values
+
+    if op in ('and', 'or') and isinstance(content, list) and content:
+        # an 'and' of several operations is an intersection
+        if op == 'and' and len(content) > 1:
+            return None
+        selections = [field_values(item) for item in content]
+        if None in selections or len({field for field, values in selections}) > 1:
+            return None
+        return selections[0][0], [value for field, values in selections for value in values]
+
+    return None
+
+
+class LocalCounts:
+    """Number of records of the values of the fields, read from a local file
+
+    The file written by write_counts is loaded in memory on first use and
+    reloaded whenever it changes (e.g. refreshed by initialize_db).
+
+    Parameters
+    ----------
+    path : str
+        SQLite file, by default settings.LOCAL_COUNTS_PATH.
+    max_age : float
+        Seconds after their refresh the counts are used (0 for ever), by
+        default settings.LOCAL_COUNTS_MAX_AGE.
+    url : str
+        Arranger endpoint the counts must come from, by default settings.ARRANGER_URL.
+    enabled : bool
+        Answer from the local counts, by default True (False leaves every
+        question to Arranger).
+    """
+
+    def __init__(
+        self, path: str = settings.LOCAL_COUNTS_PATH, max_age: float = settings.LOCAL_COUNTS_MAX_AGE,
+        url: str = settings.ARRANGER_URL, enabled: bool = True
+    ):
+        self.path = path
+        self.max_age = max_age
+        self.url = url
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # modification time of the loaded file and its counts (None if unusable)
+        self._modified = None
+        self._snapshot: Snapshot | None = None
+        self._warned_stale = False
+        self.hits = 0
+        self.misses = 0
+
+    def total(self, sqon: dict, check_age: bool = True) -> int | None:
+        """Number of records of SQON filters, if they can be answered locally
+
+        Parameters
+        ----------
+        sqon : dict
+            SQON filters as a dictionary.
+        check_age : bool
+            Leave the filters to Arranger if the counts are older than
+            max_age, by default True.
+
+        Returns
+        -------
+        int or None
+            Number of records, or None if the filters are not on the values
+            of a single field (see field_values), if the counts are missing
+            or stale, or if the values of a field can not be added up (see
+            write_counts).
+        """
+        if not self.enabled:
+            return None
+        snapshot = self._load()
+        if snapshot is None or (check_age and self._is_stale(snapshot)):
+            return None
+
+        if sqon == {'op': 'and', 'content': []}:
+            self.hits += 1
+            return snapshot.total
+        selection = field_values(sqon)
+        total = None if selection is None else self._count(snapshot, *selection)
+        if total is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return total
+
+    def stats(self) -> dict:
+        """Statistics of the loaded counts: 'refreshed_at' (ISO), 'age_seconds', 'stale',
+        'fields', 'complete_fields', 'values', 'total', 'hits' and 'misses' (empty if none)"""
+        snapshot = self._load()
+        if snapshot is None:
+            return {}
+
+        return {
+            'refreshed_at': datetime.fromtimestamp(snapshot.refreshed_at, timezone.utc).isoformat(),
+            'age_seconds': time.time() - snapshot.refreshed_at,
+            'stale': self._is_stale(snapshot),
+            'fields': len(snapshot.counts),
+            'complete_fields': len(snapshot.complete),
+            'values': sum(len(values) for values in snapshot.counts.values()),
+            'total': snapshot.total,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def _count(self, snapshot: Snapshot, field: str, values: list[str]) -> int | None:
+        field_counts = snapshot.counts.get(field)
+        if field_counts is None:
+            return None
+        values = list(dict.fromkeys(values))
+        if len(values) == 1 and values[0] in field_counts:
+            return field_counts[values[0]]
+        # values without records are not in the buckets of complete fields
+        if field not in snapshot.complete:
+            return None
+
+        return sum(field_counts.get(value, 0) for value in values)
+
+    def _is_stale(self, snapshot: Snapshot) -> bool:
+        stale = bool(self.max_age) and time.time() - snapshot.refreshed_at > self.max_age
+        if stale and not self._warned_stale:
+            self._warned_stale = True
+            logger.warning(
+                "Local counts of %s are older than %.0fs, questions are answered by Arranger",
+                self.path, self.max_age
+            )
+
+        return stale
+
+    def _load(self) -> Snapshot | None:
+        """Counts of the file, reloaded when it changed (None if missing or unusable)"""
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            modified = None
+        if modified == self._modified:
+            return self._snapshot
+
+        with self._lock:
+            if modified != self._modified:
+                self._snapshot = self._read() if modified is not None else None
+                self._modified = modified
+                self._warned_stale = False
+
+        return self._snapshot
+
+    def _read(self) -> Snapshot | None:
+        try:
+            snapshot = read_counts(self.path)
+        except (sqlite3.Error, KeyError, ValueError) as e:
+            logger.warning("Can not read the local counts of %s: %s", self.path, e)
+            return None
+        if snapshot.arranger_url != self.url:
+            logger.warning(
+                "Local counts of %s come from %s, not %s; questions are answered by Arranger",
+                self.path, snapshot.arranger_url, self.url
+            )
+            return None
+        logger.info(
+            "Loaded local counts of %d fields (%d complete), refreshed %s",
+            len(snapshot.counts), len(snapshot.complete),
+            datetime.fromtimestamp(snapshot.refreshed_at, timezone.utc).isoformat()
+        )
+
+        return snapshot
+
+
+def check_counts(
+    counts: LocalCounts, sample_size: int = 20, seed: int = 0, url: str = settings.ARRANGER_URL
+) -> dict:
+    """Compare a sample of the local counts with live Arranger results
+
+    The total and the number of records of sample_size random fields, one
+    value (or, for every other complete field, two values) each, are
+    queried in one GraphQL request and compared with the local counts,
+    whatever their age (and whether counts is enabled).
+
+    Parameters
+    ----------
+    counts : LocalCounts
+        Local counts to check.
+    sample_size : int
+        Fields sampled, by default 20.
+    seed : int
+        Seed of the sample, by default 0.
+    url : str
+        GraphQL endpoint, by default settings.ARRANGER_URL.
+
+    Returns
+    -------
+    dict
+        'refreshed_at' of the counts, number of SQON filters 'checked' and
+        'mismatches': the 'sqon_filters', 'local' and 'live' number of
+        records of every filter whose numbers differ.
+
+    Raises
+    ------
+    ValueError
+        If there are no local counts.
+    overture_chatbot.arranger.ArrangerQueryError
+        If Arranger returns errors.
+    """
+    snapshot = counts._load()
+    if snapshot is None:
+        raise ValueError(f"No local counts in {counts.path}")
+
+    rng = random.Random(seed)
+    sqons = [{'op': 'and', 'content': []}]
+    fields = sorted(snapshot.counts)
+    for i, field in enumerate(rng.sample(fields, min(sample_size, len(fields)))):
+        values = sorted(snapshot.counts[field])
+        size = 2 if i % 2 and field in snapshot.complete and len(values) > 1 else 1
+        sqons.append(canonicalize_sqon({'op': 'and', 'content': [
+            {'op': 'in', 'content': {'fieldName': field, 'value': rng.sample(values, size)}}
+        ]}))
+
+    graphql_query = "{" + " ".join(
+        f"c{i}: file{{hits{f'(filters:{to_graphql(sqon)})' if sqon['content'] else ''}{{total}}}}"
+        for i, sqon in enumerate(sqons)
+    ) + "}"
+    data = run_graphql(graphql_query, url=url)
+
+    mismatches = []
+    for i, sqon in enumerate(sqons):
+        local = counts._count(snapshot, *field_values(sqon)) if sqon['content'] else snapshot.total
+        live = data[f'c{i}']['hits']['total']
+        if local != live:
+            mismatches.append({'sqon_filters': to_graphql(sqon), 'local': local, 'live': live})
+    report = {
+        'refreshed_at': datetime.fromtimestamp(snapshot.refreshed_at, timezone.utc).isoformat(),
+        'checked': len(sqons),
+        'mismatches': mismatches
+    }
+    logger.info(
+        "Checked %d local counts refreshed %s against Arranger: %d mismatches",
+        report['checked'], report['refreshed_at'], len(mismatches)
+    )
+    for mismatch in mismatches:
+        logger.warning(
+            "Local count %s of %s, Arranger %s", mismatch['local'], mismatch['sqon_filters'], mismatch['live']
+        )
+
+    return report
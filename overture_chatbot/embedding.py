@@ -0,0 +1,285 @@
+"""Embedding models
+
+Embedding models shared by the chatbot and the vector database
+initialization. The backend is chosen with settings.EMBEDDING_BACKEND:
+
+- 'torch': sentence-transformers (PyTorch) model of settings.EMBEDDING_MODEL;
+- 'onnx': ONNX Runtime export of the same model;
+- 'onnx-int8': ONNX Runtime export with int8 (dynamically quantized) weights.
+
+The ONNX exports are created from the sentence-transformers model on first
+use (which requires PyTorch) and saved in settings.EMBEDDING_ONNX_PATH.
+Documents and questions must be embedded with the same backend, so the
+vector database is initialized again when the backend changes.
+"""
+
+import json
+import logging
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from overture_chatbot import settings
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# files of an ONNX export (see export_onnx)
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_INT8_MODEL_FILE = 'model_int8.onnx'
+ONNX_CONFIG_FILE = 'embedding_config.json'
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings of an ONNX Runtime export of a sentence-transformers model
+
+    Reproduces the sentence-transformers pipeline of the exported model:
+    tokenization (truncated to the maximum sequence length of the model),
+    transformer, pooling ('mean' or 'cls') and, for cosine similarity
+    models, normalization.
+
+    Parameters
+    ----------
+    session : onnxruntime.InferenceSession
+        Transformer returning the token embeddings.
+    tokenizer : tokenizers.Tokenizer
+        Tokenizer of the model.
+    config : dict
+        'pooling_mode', 'normalize', 'max_seq_length', 'pad_token' and
+        'pad_token_id' of the model (see export_onnx).
+    batch_size : int
+        Texts per inference, by default 32.
+    """
+
+    def __init__(self, session, tokenizer, config: dict, batch_size: int = 32):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.config = config
+        self.batch_size = batch_size
+        self.tokenizer.enable_truncation(config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=config['pad_token_id'], pad_token=config['pad_token'])
+        self.input_names = [model_input.name for model_input in session.get_inputs()]
+
+    @classmethod
+    def load(cls, path: str, quantized: bool = False, threads: int | None = None) -> 'OnnxEmbeddings':
+        """Load an export of export_onnx
+
+        Parameters
+        ----------
+        path : str
+            Folder of the export.
+        quantized : bool
+            Load the int8-quantized model, by default False.
+        threads : int, optional
+            Threads of ONNX Runtime, by default None (i.e. all cores).
+
+        Returns
+        -------
+        OnnxEmbeddings
+            Embedding model.
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, ONNX_CONFIG_FILE), encoding='utf-8') as file:
+            config = json.load(file)
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        session = onnxruntime.InferenceSession(
+            os.path.join(path, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE),
+            options, providers=['CPUExecutionProvider']
+        )
+
+        return cls(session, Tokenizer.from_file(os.path.join(path, 'tokenizer.json')), config)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed documents (like langchain_huggingface.HuggingFaceEmbeddings)"""
+        texts = [text.replace('\n', ' ') for text in texts]
+        embeddings = [
+            self._embed_batch(texts[start:start+self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        return np.concatenate(embeddings).tolist() if embeddings else []
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a question"""
+        return self.embed_documents([text])[0]
+
+    def _embed_batch(self, texts: list[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        inputs = {
+            'input_ids': np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            'attention_mask': attention_mask,
+            'token_type_ids': np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        token_embeddings = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+
+        if self.config['pooling_mode'] == 'cls':
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[:, :, np.newaxis].astype(token_embeddings.dtype)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config['normalize']:
+            embeddings = embeddings / np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+
+        return embeddings
+
+
+def load_embeddings(
+    backend: str = settings.EMBEDDING_BACKEND, threads: int | None = None
+) -> Embeddings:
+    """Load the embedding model of a backend
+
+    Parameters
+    ----------
+    backend : str
+        'torch', 'onnx' or 'onnx-int8', by default settings.EMBEDDING_BACKEND.
+    threads : int, optional
+        Threads used to embed, by default None (i.e. all cores).
+
+    Returns
+    -------
+    langchain_core.embeddings.Embeddings
+        HuggingFaceEmbeddings or OnnxEmbeddings of settings.EMBEDDING_MODEL.
+        The ONNX export is created if it does not exist.
+    """
+    if backend == 'torch':
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return HuggingFaceEmbeddings(
+            model_name=settings.EMBEDDING_MODEL,
+            cache_folder=settings.EMBEDDING_CACHE_FOLDER
+        )
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+
+    path = get_onnx_path()
+    quantized = backend == 'onnx-int8'
+    model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+    if not os.path.exists(os.path.join(path, model_file)):
+        export_onnx(path, quantize=quantized)
+
+    return OnnxEmbeddings.load(path, quantized=quantized, threads=threads)
+
+
+def get_onnx_path(model_name: str = settings.EMBEDDING_MODEL) -> str:
+    """Folder of the ONNX export of a model"""
+    return os.path.join(settings.EMBEDDING_ONNX_PATH, model_name.replace('/', '__'))
+
+
+def export_onnx(path: str, model_name: str = settings.EMBEDDING_MODEL, quantize: bool = True):
+    """Export a sentence-transformers model to ONNX
+
+    Writes the transformer (model.onnx), its tokenizer (tokenizer.json)
+    and the pooling and normalization of the model (embedding_config.json)
+    to path. Requires PyTorch and sentence-transformers.
+
+    Parameters
+    ----------
+    path : str
+        Folder of the export.
+    model_name : str
+        sentence-transformers model, by default settings.EMBEDDING_MODEL.
+    quantize : bool
+        Also write the model with int8 weights (model_int8.onnx), by default True.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    logger.info("Exporting %s to ONNX in %s", model_name, path)
+    model = SentenceTransformer(
+        model_name, cache_folder=settings.EMBEDDING_CACHE_FOLDER, device='cpu'
+    )
+    transformer = model[0]
+    pooling = next(module for module in model if isinstance(module, Pooling))
+    os.makedirs(path, exist_ok=True)
+    transformer.tokenizer.save_pretrained(path)
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, *inputs):
+            return self.auto_model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    sample = transformer.tokenizer(['warm up'], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    model_path = os.path.join(path, ONNX_MODEL_FILE)
+    torch.onnx.export(
+        TokenEmbeddings(transformer.auto_model).eval(),
+        tuple(sample[name] for name in input_names),
+        model_path,
+        input_names=input_names,
+        output_names=['token_embeddings'],
+        dynamic_axes={
+            **{name: {0: 'batch', 1: 'sequence'} for name in input_names},
+            'token_embeddings': {0: 'batch', 1: 'sequence'}
+        },
+        opset_version=14
+    )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(model_path, os.path.join(path, ONNX_INT8_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(path, ONNX_CONFIG_FILE), 'w', encoding='utf-8') as file:
+        json.dump({
+            'model_name': model_name,
+            'pooling_mode': 'cls' if pooling.pooling_mode_cls_token else 'mean',
+            'normalize': any(isinstance(module, Normalize) for module in model),
+            'max_seq_length': model.max_seq_length,
+            'pad_token': transformer.tokenizer.pad_token,
+            'pad_token_id': transformer.tokenizer.pad_token_id
+        }, file)
+
+
+def retrieval_overlap(
+    reference: Embeddings, candidate: Embeddings, texts: list[str], queries: list[str], k: int = 3
+) -> float:
+    """Overlap of the top-k documents retrieved with two embedding models
+
+    Parameters
+    ----------
+    reference : langchain_core.embeddings.Embeddings
+        Reference model (e.g. the PyTorch model).
+    candidate : langchain_core.embeddings.Embeddings
+        Model compared with the reference (e.g. an ONNX export).
+    texts : list of str
+        Documents to retrieve from.
+    queries : list of str
+        Questions or keywords.
+    k : int
+        Number of documents retrieved per query, by default 3.
+
+    Returns
+    -------
+    float
+        Average fraction of the top-k documents of the reference that are
+        also in the top-k documents of the candidate (1.0 is identical retrieval).
+    """
+    if not texts or not queries:
+        return 1.0
+
+    top_k = []
+    for model in (reference, candidate):
+        documents = np.asarray(model.embed_documents(texts), dtype=np.float32)
+        questions = np.asarray(model.embed_documents(queries), dtype=np.float32)
+        # squared L2 distance, as in the vector database (up to a constant per query)
+        distances = (documents ** 2).sum(axis=1)[np.newaxis, :] - 2 * questions @ documents.T
+        top_k.append(np.argsort(distances, axis=1, kind='stable')[:, :k])
+    k = top_k[0].shape[1]
+
+    return float(np.mean([
+        len(set(reference_rows) & set(candidate_rows)) / k
+        for reference_rows, candidate_rows in zip(*top_k)
+    ]))
@@ -0,0 +1,264 @@
+"""Per-stage instrumentation of the query chain
+
+Records, for every question, the wall time of each stage of the chain
+(keywords, SQON, total and answer), the LLM tokens in and out of each
+stage, the number of SQONs retrieved from the vector database and the
+response time of Arranger. Measurements are exported as OpenTelemetry
+spans (one span per question with a child span per stage) and metrics,
+and can be shown under the answer in Chainlit (settings.SHOW_TIMINGS).
+
+Instrumentation is off unless settings.INSTRUMENTATION is set: no callback
+is attached to the chain and the record_* functions return after a single
+context variable lookup.
+"""
+
+import contextvars
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackHandler
+from opentelemetry import metrics, trace
+from overture_chatbot import settings
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer(__name__)
+meter = metrics.get_meter(__name__)
+stage_duration = meter.create_histogram(
+    'chatbot.stage.duration', unit='s', description='Wall time of a stage of the query chain'
+)
+llm_tokens = meter.create_counter(
+    'chatbot.llm.tokens', unit='{token}', description='LLM tokens by stage and direction (in/out)'
+)
+retrieved_documents = meter.create_histogram(
+    'chatbot.retrieval.documents', unit='{document}', description='SQONs retrieved per question'
+)
+arranger_duration = meter.create_histogram(
+    'chatbot.arranger.duration', unit='s', description='Response time of Arranger'
+)
+
+# trace of the question being answered in the current context
+_current_trace: contextvars.ContextVar['QueryTrace | None'] = contextvars.ContextVar(
+    'current_trace', default=None
+)
+
+
+class QueryTrace:
+    """Measurements of the stages of the chain for one question
+
+    Parameters
+    ----------
+    stages : iterable of str
+        Run names of the stages of the chain (e.g. query_graphql.KEYWORDS_STEP).
+    span : opentelemetry.trace.Span, optional
+        Span of the question, parent of the spans of the stages, by default None.
+    """
+
+    def __init__(self, stages, span: trace.Span | None = None):
+        self.stages = tuple(stages)
+        self.span = span
+        self.start = time.perf_counter()
+        self.seconds: dict[str, float] = {}
+        # stage -> {'in': tokens, 'out': tokens}
+        self.tokens: dict[str, dict[str, int]] = defaultdict(lambda: {'in': 0, 'out': 0})
+        self.retrieved_documents = 0
+        self.retrieval_seconds = 0.0
+        self.arranger_seconds = 0.0
+        self.arranger_cached = 0
+        self.callback = StageCallbackHandler(self)
+
+    def summary(self) -> str:
+        """Breakdown of the question as a markdown table"""
+        lines = ['| Stage | Seconds | LLM tokens in/out |', '| --- | --- | --- |']
+        for stage in self.stages:
+            if stage in self.seconds:
+                tokens = self.tokens.get(stage)
+                lines.append(
+                    f"| {stage} | {self.seconds[stage]:.2f} | "
+                    + (f"{tokens['in']}/{tokens['out']} |" if tokens else "- |")
+                )
+        lines.append(f"| whole question | {time.perf_counter() - self.start:.2f} | |")
+        lines.append('')
+        lines.append(
+            f"Retrieved {self.retrieved_documents} SQONs in {self.retrieval_seconds:.2f}s; "
+            f"Arranger answered in {self.arranger_seconds:.2f}s"
+            + (f" ({self.arranger_cached} cached)" if self.arranger_cached else "")
+        )
+
+        return '\n'.join(lines)
+
+
+class StageCallbackHandler(AsyncCallbackHandler):
+    """LangChain callback handler timing the stages of a chain
+
+    Runs named after a stage are timed (and traced as a child span of the
+    question); the LLM tokens of any run nested in a stage are added to
+    that stage. The callbacks are coroutines, so that the async chain 
+    calls them in the event loop instead of a thread of the executor.
+
+    Parameters
+    ----------
+    query_trace : QueryTrace
+        Trace the measurements are added to.
+    """
+
+    def __init__(self, query_trace: QueryTrace):
+        self.query_trace = query_trace
+        # run ID -> stage of the run (or of its enclosing run)
+        self._run_stages: dict[UUID, str] = {}
+        # run ID of a stage -> (start time, span)
+        self._stage_runs: dict[UUID, tuple[float, trace.Span | None]] = {}
+
+    async def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start_run(run_id, parent_run_id, kwargs.get('name'))
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start_run(run_id, parent_run_id, kwargs.get('name'))
+
+    async def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        self._start_run(run_id, parent_run_id, kwargs.get('name'))
+
+    async def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end_run(run_id)
+
+    async def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end_run(run_id, error)
+
+    async def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end_run(run_id)
+
+    async def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end_run(run_id, error)
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        stage = self._run_stages.get(run_id)
+        if stage is not None:
+            for generations in response.generations:
+                for generation in generations:
+                    info = generation.generation_info or {}
+                    # token counts reported by Ollama
+                    self.query_trace.tokens[stage]['in'] += info.get('prompt_eval_count') or 0
+                    self.query_trace.tokens[stage]['out'] += info.get('eval_count') or 0
+        self._end_run(run_id)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end_run(run_id, error)
+
+    def _start_run(self, run_id: UUID, parent_run_id: UUID | None, name: str | None):
+        if name in self.query_trace.stages and name not in self._run_stages.values():
+            self._run_stages[run_id] = name
+            span = None
+            if self.query_trace.span is not None:
+                span = tracer.start_span(
+                    name, context=trace.set_span_in_context(self.query_trace.span)
+                )
+            self._stage_runs[run_id] = (time.perf_counter(), span)
+        elif parent_run_id in self._run_stages:
+            self._run_stages[run_id] = self._run_stages[parent_run_id]
+
+    def _end_run(self, run_id: UUID, error: BaseException | None = None):
+        if run_id not in self._stage_runs:
+            return
+        start, span = self._stage_runs.pop(run_id)
+        stage = self._run_stages[run_id]
+        self.query_trace.seconds[stage] = time.perf_counter() - start
+        if span is not None:
+            tokens = self.query_trace.tokens.get(stage)
+            if tokens:
+                span.set_attribute('llm.tokens.in', tokens['in'])
+                span.set_attribute('llm.tokens.out', tokens['out'])
+            if error is not None:
+                span.record_exception(error)
+                span.set_status(trace.Status(trace.StatusCode.ERROR))
+            span.end()
+
+
+@contextmanager
+def trace_query(question: str, stages, enabled: bool | None = None):
+    """Trace the stages of the chain while answering a question
+
+    Parameters
+    ----------
+    question : str
+        Question asked by the user.
+    stages : iterable of str
+        Run names of the stages of the chain.
+    enabled : bool, optional
+        Trace the question, by default settings.INSTRUMENTATION.
+
+    Yields
+    ------
+    QueryTrace or None
+        Trace of the question, whose callback is passed to the chain (e.g.
+        config={'callbacks': [query_trace.callback]}); None when disabled.
+    """
+    if not (settings.INSTRUMENTATION if enabled is None else enabled):
+        yield None
+        return
+
+    with tracer.start_as_current_span('question', attributes={'question': question}) as span:
+        query_trace = QueryTrace(stages, span)
+        token = _current_trace.set(query_trace)
+        try:
+            yield query_trace
+        finally:
+            _current_trace.reset(token)
+            span.set_attribute('retrieval.documents', query_trace.retrieved_documents)
+            span.set_attribute('arranger.seconds', query_trace.arranger_seconds)
+            for stage, seconds in query_trace.seconds.items():
+                stage_duration.record(seconds, {'stage': stage})
+            for stage, tokens in query_trace.tokens.items():
+                for direction, count in tokens.items():
+                    llm_tokens.add(count, {'stage': stage, 'direction': direction})
+            retrieved_documents.record(query_trace.retrieved_documents)
+            logger.debug("trace_query: %s", dict(query_trace.seconds))
+
+
+def record_retrieval(documents: int, seconds: float):
+    """Record a vector database query of the question being answered (if traced)"""
+    query_trace = _current_trace.get()
+    if query_trace is None:
+        return
+    query_trace.retrieved_documents += documents
+    query_trace.retrieval_seconds += seconds
+
+
+def record_arranger(seconds: float, cached: bool = False):
+    """Record an Arranger query of the question being answered (if traced)"""
+    query_trace = _current_trace.get()
+    if query_trace is None:
+        return
+    if cached:
+        query_trace.arranger_cached += 1
+    else:
+        query_trace.arranger_seconds += seconds
+        arranger_duration.record(seconds)
+
+
+def configure():
+    """Export spans and metrics with OTLP when settings.OTEL_EXPORTER_OTLP_ENDPOINT is set
+
+    Without an exporter, spans and metrics go to the no-op providers of the
+    OpenTelemetry API (or to the providers configured by the application).
+    """
+    if not (settings.INSTRUMENTATION and settings.OTEL_EXPORTER_OTLP_ENDPOINT):
+        return
+
+    from opentelemetry.exporter.otlp.proto.http.metric_exporter import OTLPMetricExporter
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    resource = Resource.create({'service.name': 'overture-chatbot'})
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    metrics.set_meter_provider(MeterProvider(
+        resource=resource, metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())]
+    ))
+    logger.info("Exporting traces and metrics to %s", settings.OTEL_EXPORTER_OTLP_ENDPOINT)
@@ -0,0 +1,245 @@
+"""Local keyword matching
+
+Extracts the keywords of a question without the LLM by matching it against
+the field descriptions and enumerations of the vector database (i.e. the
+SQON value objects created by initialize_db.main.create_value_object_schema).
+"""
+
+import difflib
+import json
+import re
+import threading
+
+# maximum number of keywords, as asked of the LLM by query_graphql.get_keyword_chain
+MAX_KEYWORDS = 5
+# longest phrase (in words) of a field description or enumeration that is indexed
+MAX_PHRASE_WORDS = 4
+# words of questions matched approximately that are remembered
+FUZZY_CACHE_SIZE = 4096
+# minimum similarity (difflib ratio) of a misspelled word to an indexed word
+FUZZY_CUTOFF = 0.85
+# shortest word that is matched approximately
+FUZZY_MIN_LENGTH = 5
+
+# words that do not identify a field or a value on their own
+STOPWORDS = frozenset('''
+    a about after all an analysis and any are as at before between by collected count
+    data database did do does find filter for from get has have how in is many
+    me not number of on or records sample samples show than that the there
+    these this those to total were what when where which who with
+'''.split())
+
+# words of questions standing for an indexed word
+SYNONYMS = {'men': 'male', 'man': 'male', 'women': 'female', 'woman': 'female'}
+
+_WORD_REGEX = re.compile(r"[^\W_]+(?:[-'][^\W_]+)*")
+
+
+def normalize_word(word: str) -> str:
+    """Lower case a word and strip a plural 's' (e.g. 'Males' -> 'male')"""
+    word = word.lower()
+    if word in SYNONYMS:
+        return SYNONYMS[word]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+
+    return word
+
+
+class KeywordIndex:
+    """In-memory index of the phrases of field descriptions and enumerations
+
+    Every contiguous phrase of up to MAX_PHRASE_WORDS words of a description
+    or enumeration is indexed, except phrases starting or ending with a
+    stopword. A question is matched by looking up its own phrases, longest
+    first, so that 'Nova Scotia' matches 'Nova Scotia Health Authority'.
+    Words that are not indexed are matched approximately (difflib) to catch
+    misspellings.
+
+    Parameters
+    ----------
+    terms : iterable of str
+        Field descriptions and enumerations to index.
+    """
+
+    def __init__(self, terms):
+        self.phrases: set[tuple[str, ...]] = set()
+        for term in terms:
+            words = [normalize_word(word) for word in _WORD_REGEX.findall(term)]
+            for start in range(len(words)):
+                for end in range(start + 1, min(start + MAX_PHRASE_WORDS, len(words)) + 1):
+                    phrase = tuple(words[start:end])
+                    if phrase[0] not in STOPWORDS and phrase[-1] not in STOPWORDS:
+                        self.phrases.add(phrase)
+        self.words = sorted({phrase[0] for phrase in self.phrases if len(phrase) == 1})
+        self._fuzzy_lock = threading.Lock()
+        self._fuzzy_matches: dict[str, str | None] = {}
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    @classmethod
+    def from_schemas(cls, schemas) -> 'KeywordIndex':
+        """Create the index from SQON value object schemas
+
+        Parameters
+        ----------
+        schemas : iterable of str
+            JSON value object schemas (the 'schema' metadata of the vector database).
+
+        Returns
+        -------
+        KeywordIndex
+            Index of the descriptions and enumerations of the fields.
+        """
+        terms = set()
+        for schema in set(schemas):
+            properties = json.loads(schema)['properties']
+            terms.add(properties['fieldName'].get('description', ''))
+            terms.update(properties['value'].get('items', {}).get('enum', []))
+
+        return cls(terms)
+
+    def match(self, question: str) -> list[str]:
+        """Get the keywords of a question
+
+        Parameters
+        ----------
+        question : str
+            Question asked by the user.
+
+        Returns
+        -------
+        list of str
+            Phrases of the question matching a field description or 
+            enumeration, in order of appearance; empty if nothing matches. 
+            Misspelled words are replaced by the indexed word.
+        """
+        words = _WORD_REGEX.findall(question)
+        normalized = [self._match_word(normalize_word(word)) for word in words]
+        words = [
+            word if normalize_word(word) == normalized_word else normalized_word
+            for word, normalized_word in zip(words, normalized)
+        ]
+
+        keywords = []
+        start = 0
+        while start < len(words) and len(keywords) < MAX_KEYWORDS:
+            for end in range(min(start + MAX_PHRASE_WORDS, len(words)), start, -1):
+                if tuple(normalized[start:end]) in self.phrases:
+                    keywords.append(' '.join(words[start:end]))
+                    start = end
+                    break
+            else:
+                start += 1
+
+        return keywords
+
+    def _match_word(self, word: str) -> str:
+        """Get the indexed word closest to a word that is not indexed"""
+        if len(word) < FUZZY_MIN_LENGTH or word in STOPWORDS or (word,) in self.phrases:
+            return word
+        with self._fuzzy_lock:
+            if word not in self._fuzzy_matches:
+                if len(self._fuzzy_matches) >= FUZZY_CACHE_SIZE:
+                    self._fuzzy_matches.clear()
+                close_matches = difflib.get_close_matches(
+                    word, self.words, n=1, cutoff=FUZZY_CUTOFF
+                )
+                self._fuzzy_matches[word] = close_matches[0] if close_matches else None
+
+            return self._fuzzy_matches[word] or word
+
+
+class EnumIndex:
+    """Lexical index of the enumerations of a field
+
+    Ranks the enumerations of a field by their similarity to the keywords
+    of a question, so that fields with hundreds or thousands of values
+    (e.g. lineages or sample collectors) only put the relevant ones in the
+    prompt of the LLM. Words are normalized as in KeywordIndex and keyword
+    words that are not indexed are matched approximately (difflib).
+
+    Parameters
+    ----------
+    enums : list of str
+        Enumerations of the field.
+    """
+
+    def __init__(self, enums: list[str]):
+        self.enums = list(enums)
+        self._words = [
+            tuple(normalize_word(word) for word in _WORD_REGEX.findall(enum)) for enum in self.enums
+        ]
+        # word -> positions of the enumerations containing it
+        self._postings: dict[str, list[int]] = {}
+        for i, words in enumerate(self._words):
+            for word in set(words):
+                self._postings.setdefault(word, []).append(i)
+        self._vocabulary = sorted(self._postings)
+
+    def __len__(self) -> int:
+        return len(self.enums)
+
+    def select(self, keywords: list[str], max_enums: int) -> list[str]:
+        """Get the enumerations most similar to keywords
+
+        An enumeration equal to a keyword (after normalization) is always
+        kept; the others are ranked by the share of the words of a keyword
+        they contain, enumerations containing a whole keyword first.
+
+        Parameters
+        ----------
+        keywords : list of str
+            Keywords of the question.
+        max_enums : int
+            Number of enumerations to keep (more when more enumerations are 
+            equal to a keyword).
+
+        Returns
+        -------
+        list of str
+            Kept enumerations, in their original order.
+        """
+        if len(self.enums) <= max_enums:
+            return self.enums
+
+        scores: dict[int, float] = {}
+        exact = set()
+        for keyword in keywords:
+            words = tuple(self._match_word(normalize_word(word)) for word in _WORD_REGEX.findall(keyword))
+            content_words = {word for word in words if word not in STOPWORDS} or set(words)
+            if not content_words:
+                continue
+            candidates = {i for word in content_words for i in self._postings.get(word, ())}
+            for i in candidates:
+                enum_words = self._words[i]
+                if enum_words == words:
+                    exact.add(i)
+                    continue
+                score = len(content_words.intersection(enum_words)) / len(content_words)
+                if _contains(enum_words, words):
+                    score += 1.0
+                scores[i] = max(scores.get(i, 0.0), score)
+
+        ranked = sorted(
+            (i for i in scores if i not in exact), key=lambda i: (-scores[i], i)
+        )[:max(max_enums - len(exact), 0)]
+        # questions that match no enumeration keep the first ones
+        kept = exact.union(ranked) or set(range(max_enums))
+
+        return [self.enums[i] for i in sorted(kept)]
+
+    def _match_word(self, word: str) -> str:
+        if len(word) < FUZZY_MIN_LENGTH or word in self._postings or word in STOPWORDS:
+            return word
+        close_matches = difflib.get_close_matches(word, self._vocabulary, n=1, cutoff=FUZZY_CUTOFF)
+
+        return close_matches[0] if close_matches else word
+
+
+def _contains(words: tuple[str, ...], phrase: tuple[str, ...]) -> bool:
+    """Whether phrase is a contiguous part of words"""
+    return any(
+        words[start:start + len(phrase)] == phrase for start in range(len(words) - len(phrase) + 1)
+    )
@@ -2,38 +2,318 @@
 
 Functions associated with querying GraphQL APIs with LLMs.
 Module is intended to be imported by a GUI.  
+
+The LLM, the embedding model and the vector database clients are created 
+on first use (see get_llm, get_embeddings and get_collection) so that 
+importing the module neither loads models nor connects to services; 
+warm_up creates them ahead of the first question.
 """
 
+import asyncio
 import json
+import logging
+import re
+import time
+from collections.abc import AsyncIterator
+from functools import cache, lru_cache
 from operator import itemgetter
-import chromadb
-from chromadb.config import Settings
-from langchain_community.utilities.graphql import GraphQLAPIWrapper
-from langchain_ollama import OllamaLLM
+import requests
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableBranch, RunnablePassthrough, RunnableLambda
 from langchain_core.runnables import RunnableSequence, Runnable, RunnableConfig
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.tools import tool
+from overture_chatbot import instrumentation, settings, vector_index
+from overture_chatbot.admission import AdmissionController, AdmittedLLM
+from overture_chatbot.arranger import post_graphql, run_graphql, arun_graphql, ArrangerQueryError
+from overture_chatbot.breakdown import (
+    aggregation_graphql, breakdown_keywords, format_breakdown, is_breakdown_question, is_comparison,
+    select_breakdown_field, BreakdownError
+)
+from overture_chatbot.caching import TTLCache, SemanticCache, SingleFlight, MISSING
+from overture_chatbot.counts import LocalCounts
+from overture_chatbot.keywords import EnumIndex, KeywordIndex, normalize_word
+from overture_chatbot.sqon import (
+    canonical_sqon_filters, canonicalize_sqon, parse_sqon, remove_field, to_graphql, validate_sqon,
+    SQONValidationError
+)
+
+logger = logging.getLogger(__name__)
+
+# run names of the chain stages, followed by astream_query_total_summary
+KEYWORDS_STEP = 'keywords'
+SQON_STEP = 'sqon'
+TOTAL_STEP = 'total'
+ANSWER_STEP = 'summarize_answer'
+# run name of the last stage of query_breakdown_chain
+BREAKDOWN_STEP = 'breakdown'
+# breakdown of the stages yielded by astream_query_total_summary (settings.SHOW_TIMINGS)
+TIMINGS_STEP = 'timings'
+
+# async client of the vector database, created on first use in the event loop
+async_chroma_clients: dict[asyncio.AbstractEventLoop, asyncio.Task] = {}
+
+# composed SQON schemas kept for reuse (per combination of retrieved fields)
+SCHEMA_CACHE_SIZE = 256
 
-llm = OllamaLLM(base_url='http://ollama-llm:11434', model='mistral', temperature=0)
-embeddings = HuggingFaceEmbeddings(
-    model_name='multi-qa-mpnet-base-cos-v1',
-    cache_folder='resources/huggingface'
+# numbers of a question (e.g. years, timestamps, lineages), see get_question_literals
+NUMBER_REGEX = re.compile(r'\d+(?:[.,]\d+)*')
+
+# index of the field descriptions and enumerations of the vector database, by version
+keyword_indexes: dict[str, KeywordIndex] = {}
+
+# Arranger responses keyed on canonical SQON filters
+result_cache = TTLCache(
+    max_entries=settings.RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    ttl=settings.RESULT_CACHE_TTL
 )
 
-# vector database containing the filtering SQONs
-chroma_client = chromadb.HttpClient(
-        host='chroma-db', port=8000, settings=Settings(allow_reset=True, anonymized_telemetry=False)
-    )
-vector_store = Chroma(
-    collection_name="overture",
-    embedding_function=embeddings,
-    client=chroma_client
+# number of records of the values of the fields, answering single-field SQON filters
+local_counts = LocalCounts(enabled=settings.LOCAL_COUNTS)
+
+# generated SQONs keyed on the embedding of the question
+semantic_cache = SemanticCache(
+    max_entries=settings.SEMANTIC_CACHE_MAX_ENTRIES,
+    threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+    ttl=settings.SEMANTIC_CACHE_TTL
+)
+
+# concurrent identical questions (normalized) and SQON filters (canonical) share one computation
+question_flight = SingleFlight(enabled=settings.SINGLE_FLIGHT)
+sqon_flight = SingleFlight(enabled=settings.SINGLE_FLIGHT)
+# bound on the LLM generations of all sessions (see get_llm)
+llm_admission = AdmissionController(
+    max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+    max_queue=settings.LLM_MAX_QUEUE,
+    timeout=settings.LLM_QUEUE_TIMEOUT
+)
+
+# version of the vector database, refreshed every SEMANTIC_CACHE_VERSION_CHECK seconds
+# (the async 'overture' collection of each event loop is refreshed at the same time)
+version_cache = TTLCache(
+    max_entries=16, max_bytes=1024*1024, ttl=settings.SEMANTIC_CACHE_VERSION_CHECK
 )
 
+@cache
+def get_llm() -> 'langchain_core.language_models.BaseLLM':
+    """Get the shared LLM, created on first use
+
+    Returns
+    -------
+    langchain_core.language_models.BaseLLM
+        Ollama LLM of settings.OLLAMA_MODEL. Unless settings.LLM_MAX_IN_FLIGHT 
+        is 0, its generations wait for a slot of llm_admission, and raise 
+        admission.LLMOverloadedError when the queue is full or the wait 
+        exceeds settings.LLM_QUEUE_TIMEOUT.
+    """
+    from langchain_ollama import OllamaLLM
+
+    llm = OllamaLLM(
+        base_url=settings.OLLAMA_URL, model=settings.OLLAMA_MODEL, temperature=0,
+        **get_ollama_options()
+    )
+    if settings.LLM_MAX_IN_FLIGHT < 1:
+        return llm
+
+    return AdmittedLLM(llm=llm, admission=llm_admission)
+
+def get_ollama_options() -> dict:
+    """Get the options keeping the model and its prompt cache loaded in Ollama
+
+    Every request must use the same options: Ollama reloads the model, and 
+    drops the evaluated prompt prefixes, when the context size changes.
+
+    Returns
+    -------
+    dict
+        keep_alive (settings.OLLAMA_KEEP_ALIVE, a duration such as '1h', or 
+        seconds with -1 keeping the model loaded) and, unless 
+        settings.OLLAMA_NUM_CTX is 0, num_ctx.
+    """
+    keep_alive = settings.OLLAMA_KEEP_ALIVE
+    options = {
+        'keep_alive': int(keep_alive) if keep_alive.lstrip('-').isdigit() else keep_alive
+    }
+    if settings.OLLAMA_NUM_CTX > 0:
+        options['num_ctx'] = settings.OLLAMA_NUM_CTX
+
+    return options
+
+@cache
+def get_embeddings() -> 'langchain_core.embeddings.Embeddings':
+    """Get the shared embedding model, loaded on first use
+
+    Returns
+    -------
+    langchain_core.embeddings.Embeddings
+        Model of settings.EMBEDDING_MODEL with the backend of 
+        settings.EMBEDDING_BACKEND (see embedding.load_embeddings).
+    """
+    from overture_chatbot.embedding import load_embeddings
+
+    return load_embeddings()
+
+@cache
+def get_vector_store() -> 'langchain_chroma.Chroma':
+    """Get the LangChain vector store of the 'overture' collection
+
+    Returns
+    -------
+    langchain_chroma.Chroma
+        Vector store of the Chroma backends of settings.VECTOR_BACKEND.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not a Chroma backend (i.e. 'numpy').
+    """
+    from langchain_chroma import Chroma
+
+    if settings.VECTOR_BACKEND == 'numpy':
+        raise ValueError("The 'numpy' vector database backend has no LangChain vector store")
+
+    return Chroma(
+        collection_name="overture",
+        embedding_function=get_embeddings(),
+        client=vector_index.get_client()
+    )
+
+def warm_up() -> dict[str, float]:
+    """Create the shared resources ahead of the first question
+
+    Loads the embedding model, connects to the vector database (and builds 
+    the keyword index when settings.KEYWORD_EXTRACTOR is 'local'), loads 
+    the LLM into the memory of Ollama, reads the local counts and builds 
+    the shared chains. 
+    Failures are logged and left to be retried on first use.
+
+    Returns
+    -------
+    dict
+        Seconds spent creating each resource.
+    """
+    def load_vector_database():
+        get_collection_version()
+        if settings.KEYWORD_EXTRACTOR == 'local':
+            get_keyword_index()
+
+    def load_llm():
+        from ollama import Client
+
+        # an empty prompt only loads the model (with the context size of the chains)
+        options = get_ollama_options()
+        Client(host=settings.OLLAMA_URL).generate(
+            model=settings.OLLAMA_MODEL, prompt='', keep_alive=options.pop('keep_alive'),
+            options=options
+        )
+
+    steps = {
+        'embeddings': lambda: get_embeddings().embed_query('warm up'),
+        'vector_database': load_vector_database,
+        'llm': load_llm,
+        'local_counts': local_counts.stats,
+        'chains': lambda: (get_query_total_chain(), get_query_total_summary_chain())
+    }
+    timings = {}
+    for name, step in steps.items():
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("warm_up: %s failed: %s: %s", name, type(e).__name__, e)
+        timings[name] = time.perf_counter() - start
+    logger.info(
+        "Warm-up done in %.1fs (%s)", sum(timings.values()),
+        ', '.join(f"{name} {seconds:.1f}s" for name, seconds in timings.items())
+    )
+
+    return timings
+
+@cache
+def get_query_total_chain() -> RunnableSequence:
+    """Get the shared chain created by query_total_chain()
+
+    The chain is created on the first call and reused afterwards. Chains 
+    do not hold state between invocations, so the same chain can be 
+    invoked concurrently by all Chainlit sessions.
+
+    Returns
+    -------
+    langchain_core.runnables.base.RunnableSequence
+        Langchain chain that will return total number of records from unstructured text.
+    """
+    return query_total_chain()
+
+@cache
+def get_query_total_summary_chain() -> RunnableSequence:
+    """Get the shared chain created by query_total_summary_chain()
+
+    Returns
+    -------
+    langchain_core.runnables.base.RunnableSequence
+        Langchain chain that summarizes the total number of records from unstructured text.
+
+    See Also
+    --------
+    get_query_total_chain
+    """
+    return query_total_summary_chain()
+
+@cache
+def get_query_breakdown_chain() -> RunnableSequence:
+    """Get the shared chain created by query_breakdown_chain()
+
+    Returns
+    -------
+    langchain_core.runnables.base.RunnableSequence
+        Langchain chain that returns the number of records per value of a field from unstructured text.
+
+    See Also
+    --------
+    get_query_total_chain
+    """
+    return query_breakdown_chain()
+
+async def astream_query_total_summary(query: str) -> AsyncIterator[tuple[str, str]]:
+    """Stream the stages and the answer of the shared summary chain
+
+    Intermediate results are yielded as soon as their stage of the chain 
+    completes, followed by the tokens of the answer as they are generated 
+    by the LLM.
+
+    Parameters
+    ----------
+    query : str
+        Question asked by the user.
+
+    Yields
+    ------
+    tuple of (str, str)
+        Stage (KEYWORDS_STEP, SQON_STEP, TOTAL_STEP or ANSWER_STEP) and its 
+        output, or the next token of the answer for ANSWER_STEP. When 
+        settings.INSTRUMENTATION and settings.SHOW_TIMINGS are set, the 
+        breakdown of the stages (as markdown) is yielded last for TIMINGS_STEP.
+
+    See Also
+    --------
+    get_query_total_summary_chain
+    overture_chatbot.instrumentation.trace_query
+    """
+    chain = get_query_total_summary_chain()
+    stages = (KEYWORDS_STEP, SQON_STEP, TOTAL_STEP, ANSWER_STEP)
+    with instrumentation.trace_query(query, stages) as query_trace:
+        config = {'callbacks': [query_trace.callback]} if query_trace else None
+        async for event in chain.astream_events({"query": query}, config, version="v2"):
+            if event['event'] == 'on_llm_stream' and event['name'] == ANSWER_STEP:
+                yield ANSWER_STEP, event['data']['chunk'].text
+            elif event['event'] == 'on_chain_end' and event['name'] in (
+                KEYWORDS_STEP, SQON_STEP, TOTAL_STEP
+            ):
+                yield event['name'], str(event['data']['output'])
+        if query_trace and settings.SHOW_TIMINGS:
+            yield TIMINGS_STEP, query_trace.summary()
+
 def query_total_chain() ->  RunnableSequence:
     """Create a Langchain LCEL chain that returns the total number of records from unstructured text
 
@@ -48,6 +328,10 @@ def query_total_chain() ->  RunnableSequence:
     query_total_chain() returns only the number (i.e. 5) and query_total_summary_chain()
     returns the number as a summary (i.e. There are 5 records that match your criteria 
     of X, Y, and Z).
+
+    Like errors of the tool, SQON filters failing validation (see 
+    validate_generated_sqon) are returned as an error message instead of 
+    being raised.
     """
     
     def try_except_total_graphql(args: str, config: RunnableConfig) -> Runnable:
@@ -57,15 +341,199 @@ def query_total_chain() ->  RunnableSequence:
         ---------
         https://python.langchain.com/docs/how_to/tools_error/#tryexcept-tool-call
         """
-        sqon = args[1:]
+        sqon = args.strip()
         try:
             return get_total_graphql.invoke(sqon, config=config)
         except Exception as e:
             return f"Calling tool with arguments:\n\n{sqon}\n\nraised the following error:\n\n{type(e)}: {e}"
-    
-    query_total = create_sqon_schema() | format_sqon_filters | try_except_total_graphql
 
-    return query_total
+    async def atry_except_total_graphql(args: str, config: RunnableConfig) -> str:
+        """Async version of try_except_total_graphql"""
+        sqon = args.strip()
+        try:
+            return await get_total_graphql.ainvoke(sqon, config=config)
+        except Exception as e:
+            return f"Calling tool with arguments:\n\n{sqon}\n\nraised the following error:\n\n{type(e)}: {e}"
+
+    query_total = (
+        create_cached_sqon_schema()
+        | format_sqon_filters
+        | RunnableLambda(try_except_total_graphql, afunc=atry_except_total_graphql)
+    )
+
+    def try_except_query_total(query: str | dict, config: RunnableConfig) -> str:
+        """Try/except for the SQON filters generated by query_total"""
+        try:
+            return query_total.invoke(query, config=config)
+        except SQONValidationError as e:
+            return f"Generating SQON filters for the question raised the following error:\n\n{type(e)}: {e}"
+
+    async def atry_except_query_total(query: str | dict, config: RunnableConfig) -> str:
+        """Async version of try_except_query_total"""
+        try:
+            return await query_total.ainvoke(query, config=config)
+        except SQONValidationError as e:
+            return f"Generating SQON filters for the question raised the following error:\n\n{type(e)}: {e}"
+
+    return RunnableLambda(try_except_query_total, afunc=atry_except_query_total)
+
+def query_breakdown_chain() -> RunnableSequence:
+    """Create a Langchain LCEL chain that returns the number of records per value of a field from unstructured text
+
+    Returns
+    -------
+    langchain_core.runnables.base.RunnableSequence
+        Langchain chain that returns the number of records of every value of 
+        the field the question breaks the records down by (i.e. 'Male: 5' 
+        and 'Female: 4' on two lines) from a single Arranger aggregation query.
+
+    Notes
+    -----
+    The field is the retrieved field that best matches the words following 
+    a group-by word (i.e. 'per province') or the compared values (i.e. 
+    'males vs females'), see get_breakdown_field. The SQON filters generated 
+    for the question are applied (see get_breakdown_filters); if no valid 
+    SQON can be generated, the records are not filtered.
+
+    See Also
+    --------
+    query_total_chain
+    query_chain
+    """
+    sqon_chain = create_cached_sqon_schema()
+
+    def generate_sqon(inputs: dict, config: RunnableConfig) -> str | None:
+        try:
+            return sqon_chain.invoke(inputs, config=config)
+        except SQONValidationError as e:
+            logger.info("query_breakdown_chain: records not filtered (%s)", e)
+            return None
+
+    async def agenerate_sqon(inputs: dict, config: RunnableConfig) -> str | None:
+        try:
+            return await sqon_chain.ainvoke(inputs, config=config)
+        except SQONValidationError as e:
+            logger.info("query_breakdown_chain: records not filtered (%s)", e)
+            return None
+
+    def try_except_breakdown(inputs: dict) -> str:
+        sqon_filters = get_breakdown_filters(inputs['query'], inputs['field'], inputs['sqon'])
+        try:
+            return format_breakdown(json.loads(query_breakdown(inputs['field'], sqon_filters)))
+        except Exception as e:
+            return f"Querying the values of {inputs['field']} raised the following error:\n\n{type(e)}: {e}"
+
+    async def atry_except_breakdown(inputs: dict) -> str:
+        sqon_filters = get_breakdown_filters(inputs['query'], inputs['field'], inputs['sqon'])
+        try:
+            return format_breakdown(json.loads(await aquery_breakdown(inputs['field'], sqon_filters)))
+        except Exception as e:
+            return f"Querying the values of {inputs['field']} raised the following error:\n\n{type(e)}: {e}"
+
+    query_breakdown_chain = (
+        RunnableLambda(lambda query: {'query': get_question(query)})
+        | RunnablePassthrough.assign(
+            field=RunnableLambda(
+                get_breakdown_field, afunc=aget_breakdown_field
+            ).with_config(run_name=KEYWORDS_STEP),
+            sqon=RunnableLambda(generate_sqon, afunc=agenerate_sqon).with_config(run_name=SQON_STEP)
+        )
+        | RunnableLambda(
+            try_except_breakdown, afunc=atry_except_breakdown
+        ).with_config(run_name=BREAKDOWN_STEP)
+    )
+
+    return query_breakdown_chain
+
+def query_chain() -> Runnable:
+    """Create a Langchain LCEL chain that answers total and breakdown questions
+
+    Returns
+    -------
+    langchain_core.runnables.base.Runnable
+        Langchain chain routing breakdown questions (see 
+        breakdown.is_breakdown_question) to query_breakdown_chain and the 
+        other questions, and breakdown questions without a field to break 
+        the records down by (breakdown.BreakdownError), to query_total_chain.
+    """
+    total_chain = query_total_chain()
+    breakdown_chain = query_breakdown_chain().with_fallbacks(
+        [total_chain], exceptions_to_handle=(BreakdownError,)
+    )
+
+    return RunnableBranch(
+        (lambda query: is_breakdown_question(get_question(query)), breakdown_chain),
+        total_chain
+    )
+
+def get_breakdown_field(query: str | dict) -> str:
+    """Get the field a question breaks the records down by
+
+    Parameters
+    ----------
+    query : str or dict
+        Question, or the input of the chain with the question in 'query'.
+
+    Returns
+    -------
+    str
+        Name of the field (i.e. 'analysis.host.host_gender') among the 
+        fields retrieved for the breakdown keywords of the question (see 
+        breakdown.breakdown_keywords and breakdown.select_breakdown_field).
+
+    Raises
+    ------
+    breakdown.BreakdownError
+        If the question does not ask for a breakdown or no field matches 
+        (the values compared by a question match the enumerations of the 
+        fields, the words following a group-by word their descriptions).
+    """
+    question = get_question(query)
+    keywords = breakdown_keywords(question)
+    if not keywords:
+        raise BreakdownError(f"{question!r} does not ask for a breakdown")
+
+    return select_breakdown_field(
+        keywords, get_sqon_keyword(', '.join(keywords)), match_values=is_comparison(question)
+    )
+
+async def aget_breakdown_field(query: str | dict) -> str:
+    """Async version of get_breakdown_field"""
+    question = get_question(query)
+    keywords = breakdown_keywords(question)
+    if not keywords:
+        raise BreakdownError(f"{question!r} does not ask for a breakdown")
+
+    return select_breakdown_field(
+        keywords, await aget_sqon_keyword(', '.join(keywords)), match_values=is_comparison(question)
+    )
+
+def get_breakdown_filters(question: str, field: str, sqon_filters: str | None) -> str | None:
+    """Get the SQON filters of a breakdown query
+
+    Parameters
+    ----------
+    question : str
+        Question asked by the user.
+    field : str
+        Field the records are broken down by.
+    sqon_filters : str or None
+        SQON filters generated for the question.
+
+    Returns
+    -------
+    str or None
+        Canonical SQON filters, without the operations on the field unless 
+        the question compares values of the field (i.e. 'males vs females'), 
+        or None if nothing is filtered.
+    """
+    if not sqon_filters:
+        return None
+    sqon = parse_sqon(sqon_filters)
+    if not is_comparison(question):
+        sqon = remove_field(sqon, field)
+
+    return to_graphql(canonicalize_sqon(sqon)) if sqon else None
 
 def query_total_summary_chain() -> RunnableSequence:
     """Create a Langchain LCEL chain that summarizes total number of records from unstructured text
@@ -114,15 +582,19 @@ def query_total_summary_chain() -> RunnableSequence:
         """
         answer_prompt = PromptTemplate(template=answer_prompt_template)
 
-        answer_chain = answer_prompt | llm
+        answer_chain = answer_prompt | get_llm().with_config(run_name=ANSWER_STEP)
 
         return answer_chain
 
-    query_schema_chain = create_sqon_schema() | format_sqon_filters
+    query_schema_chain = (
+        create_cached_sqon_schema() | format_sqon_filters
+    ).with_config(run_name=SQON_STEP)
 
     answer_chain = (
         RunnablePassthrough.assign(query_schema=query_schema_chain).assign(
-            result=itemgetter("query_schema") | RunnableLambda(get_total_graphql)
+            result=itemgetter("query_schema") | RunnableLambda(
+                get_total_graphql, afunc=aget_total_graphql
+            ).with_config(run_name=TOTAL_STEP)
         )
         | summarize_answer()
         | StrOutputParser()
@@ -142,11 +614,16 @@ def create_sqon_schema() -> RunnableSequence:
     --------
     query_total_summary_chain
     query_total_chain
+
+    Notes
+    -----
+    As in the keyword and answer prompts, the instructions and examples 
+    come before the parts that depend on the question (the retrieved JSON 
+    schema and the query), so that Ollama reuses the evaluated prompt 
+    prefix (KV cache) of the previous request instead of evaluating it again.
     """
     sqon_prompt_template = """
-        You are a structured output bot. Your task is to take a query and format it into the following JSON schema:
-
-        {schema}
+        You are a structured output bot. Your task is to take a query and format it into the JSON schema given after the examples.
 
         Make sure to check for common mistakes, including:
         - Respect the 'maxItems' and 'minItems' value
@@ -168,6 +645,10 @@ def create_sqon_schema() -> RunnableSequence:
         Response: {{"op": "and", "content": [{{"op": ">=", "content": {{"fieldName": "analysis.first_published_at", "value": 1640926800000}}}}]}}
         ###
 
+        JSON schema:
+
+        {schema}
+
         <<<
         Query: {query}
         >>>
@@ -178,19 +659,335 @@ def create_sqon_schema() -> RunnableSequence:
         input_variables=["schema", "query"]
     )
 
-    sqon_schema_chain = get_keyword_chain() | get_sqon_keyword | format_sqons_schema
+    def get_schema(inputs: dict) -> str:
+        # only the prompt is pruned, the generated SQON is validated against all enumerations
+        return format_sqons_schema(prune_sqon_enums(inputs["sqons"], split_keywords(inputs["keywords"])))
+
+    def generate_sqon(inputs: dict, config: RunnableConfig) -> str:
+        prompt = sqon_prompt.invoke(
+            {"schema": get_schema(inputs), "query": inputs["query"]},
+            config=config
+        )
+        sqon = get_sqon_llm(inputs["sqons"]).invoke(prompt, config=config)
+        validate_generated_sqon(sqon, inputs["sqons"])
+
+        return sqon
+
+    async def agenerate_sqon(inputs: dict, config: RunnableConfig) -> str:
+        prompt = await sqon_prompt.ainvoke(
+            {"schema": get_schema(inputs), "query": inputs["query"]},
+            config=config
+        )
+        sqon = await get_sqon_llm(inputs["sqons"]).ainvoke(prompt, config=config)
+        validate_generated_sqon(sqon, inputs["sqons"])
+
+        return sqon
 
     sqon_chain = (
         {
-            "schema": sqon_schema_chain,
+            "keywords": get_keyword_chain(),
             "query": RunnablePassthrough()
         }
-        | sqon_prompt
-        | llm
+        | RunnablePassthrough.assign(
+            sqons=itemgetter("keywords") | RunnableLambda(get_sqon_keyword, afunc=aget_sqon_keyword)
+        )
+        | RunnableLambda(generate_sqon, afunc=agenerate_sqon)
     )
 
     return sqon_chain
 
+def get_sqon_llm(sqons: list[str]) -> Runnable:
+    """Get the LLM constrained to generate SQON filters
+
+    Depending on settings.SQON_OUTPUT_FORMAT, Ollama constrains decoding to 
+    the JSON schema of the SQONs ('schema', requires Ollama 0.5 or later), 
+    to any JSON ('json') or does not constrain it ('text').
+
+    Parameters
+    ----------
+    sqons : list of str
+        SQON value objects of the fields that may be filtered.
+
+    Returns
+    -------
+    langchain_core.runnables.base.Runnable
+        LLM generating SQON filters.
+    """
+    llm = get_llm()
+    if settings.SQON_OUTPUT_FORMAT == 'schema':
+        try:
+            return llm.bind(format=sqon_json_schema(sqons))
+        except ValueError:
+            logger.warning("SQON value objects are not valid JSON, falling back to JSON mode")
+            return llm.bind(format='json')
+    if settings.SQON_OUTPUT_FORMAT == 'json':
+        return llm.bind(format='json')
+
+    return llm
+
+def validate_generated_sqon(sqon_filters: str, sqons: list[str]):
+    """Check SQON filters generated by the LLM before they are sent to Arranger
+
+    Parameters
+    ----------
+    sqon_filters : str
+        SQON filters generated by the LLM.
+    sqons : list of str
+        SQON value objects of the fields that may be filtered.
+
+    Raises
+    ------
+    sqon.SQONValidationError
+        If the filters can not be parsed or do not match the value objects.
+    """
+    try:
+        sqon = parse_sqon(sqon_filters)
+    except ValueError as e:
+        raise SQONValidationError(f"SQON filters can not be parsed: {e}") from e
+
+    try:
+        value_objects = [json.loads(value_object) for value_object in sqons]
+    except json.JSONDecodeError:
+        logger.debug("validate_generated_sqon: SQON value objects are not valid JSON")
+        return
+    validate_sqon(sqon, value_objects)
+
+def create_cached_sqon_schema() -> Runnable:
+    """Create a Langchain runnable that creates SQON from unstructured text using a cache
+
+    Questions similar enough to a previously answered question, with the 
+    same numbers and values (see get_question_literals and 
+    caching.SemanticCache), reuse its SQON, skipping both LLM calls of 
+    create_sqon_schema. Identical questions (see normalize_question) asked 
+    while their SQON is being generated wait for it instead of generating 
+    it again (see question_flight).
+
+    Returns
+    -------
+    langchain_core.runnables.base.Runnable
+        Langchain runnable that creates SQON from unstructured text.
+
+    See Also
+    --------
+    create_sqon_schema
+    """
+    sqon_chain = create_sqon_schema()
+
+    def generate_sqon(query: str | dict, config: RunnableConfig) -> str:
+        if semantic_cache.max_entries < 1:
+            return sqon_chain.invoke(query, config=config)
+
+        question = get_question(query)
+        embedding = get_embeddings().embed_query(question)
+        version = get_collection_version()
+        literals = get_question_literals(question, get_keyword_index())
+
+        sqon = semantic_cache.lookup(embedding, version=version, literals=literals)
+        if sqon is not None:
+            return sqon
+
+        start = time.perf_counter()
+        sqon = sqon_chain.invoke(query, config=config)
+        latency = time.perf_counter() - start
+
+        # SQONs that can not be parsed will fail in Arranger; do not reuse them
+        try:
+            parse_sqon(sqon)
+        except ValueError:
+            return sqon
+        semantic_cache.add(question, embedding, sqon, latency, version=version, literals=literals)
+
+        return sqon
+
+    async def agenerate_sqon(query: str | dict, config: RunnableConfig) -> str:
+        if semantic_cache.max_entries < 1:
+            return await sqon_chain.ainvoke(query, config=config)
+
+        question = get_question(query)
+        embedding = await get_embeddings().aembed_query(question)
+        version = await aget_collection_version()
+        literals = get_question_literals(question, await aget_keyword_index())
+
+        sqon = semantic_cache.lookup(embedding, version=version, literals=literals)
+        if sqon is not None:
+            return sqon
+
+        start = time.perf_counter()
+        sqon = await sqon_chain.ainvoke(query, config=config)
+        latency = time.perf_counter() - start
+
+        try:
+            parse_sqon(sqon)
+        except ValueError:
+            return sqon
+        semantic_cache.add(question, embedding, sqon, latency, version=version, literals=literals)
+
+        return sqon
+
+    def sqon_with_cache(query: str | dict, config: RunnableConfig) -> str:
+        question = normalize_question(get_question(query))
+        return question_flight.do(question, generate_sqon, query, config)
+
+    async def asqon_with_cache(query: str | dict, config: RunnableConfig) -> str:
+        question = normalize_question(get_question(query))
+        return await question_flight.ado(question, agenerate_sqon, query, config)
+
+    return RunnableLambda(sqon_with_cache, afunc=asqon_with_cache)
+
+def get_question(query: str | dict) -> str:
+    """Get the question from the input of a chain
+
+    Parameters
+    ----------
+    query : str or dict
+        Question, or dictionary with "query" as a key and the question.
+
+    Returns
+    -------
+    str
+        Question asked by the user.
+    """
+    if isinstance(query, dict):
+        return query['query']
+
+    return query
+
+def get_question_literals(question: str, keyword_index: KeywordIndex) -> tuple:
+    """Get the numbers and values a question filters on
+
+    Questions differing only in a number, a date or a value (e.g. 'after 
+    2020' and 'after 2021', or two provinces) have nearly identical 
+    embeddings but different SQONs; the semantic cache only reuses the SQON 
+    of a question with the same literals.
+
+    Parameters
+    ----------
+    question : str
+        Question asked by the user.
+    keyword_index : keywords.KeywordIndex
+        Index of the field descriptions and enumerations (see get_keyword_index).
+
+    Returns
+    -------
+    tuple
+        Numbers of the question and its normalized keywords matching a field 
+        description or enumeration (e.g. 'men' and 'males' are both 'male'), 
+        in order of appearance.
+    """
+    numbers = tuple(NUMBER_REGEX.findall(question))
+    keywords = tuple(
+        ' '.join(normalize_word(word) for word in keyword.split())
+        for keyword in keyword_index.match(question)
+    )
+
+    return numbers, keywords
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so that identical questions are recognized
+
+    Parameters
+    ----------
+    question : str
+        Question asked by the user.
+
+    Returns
+    -------
+    str
+        Question in lower case, with single spaces and without trailing 
+        punctuation (e.g. 'Find the  number of males?' -> 'find the number of males').
+    """
+    return ' '.join(question.casefold().split()).rstrip(' ?.!')
+
+def get_collection_version() -> str:
+    """Get the version of the vector database
+
+    The version changes when initialize_db.main rebuilds the 'overture' 
+    collection. It is cached for settings.SEMANTIC_CACHE_VERSION_CHECK seconds.
+
+    Returns
+    -------
+    str
+        Identifier and 'version' metadata of the 'overture' collection.
+    """
+    collection = get_collection()
+
+    return f"{collection.id}:{(collection.metadata or {}).get('version', '')}"
+
+def get_collection():
+    """Get the 'overture' collection of the vector database
+
+    The collection is cached for settings.SEMANTIC_CACHE_VERSION_CHECK seconds 
+    so that a rebuilt collection is picked up.
+
+    Returns
+    -------
+    chromadb Collection or vector_index.NumpyCollection
+        Collection containing the filtering SQONs.
+    """
+    collection = version_cache.get('overture')
+    if collection is MISSING:
+        collection = vector_index.get_collection('overture')
+        version_cache.set('overture', collection)
+
+    return collection
+
+async def aget_collection_version() -> str:
+    """Async version of get_collection_version"""
+    collection = await aget_collection()
+
+    return f"{collection.id}:{(collection.metadata or {}).get('version', '')}"
+
+async def aget_collection() -> 'chromadb.api.models.AsyncCollection.AsyncCollection':
+    """Get the 'overture' collection from the async client of the vector database
+
+    The collection is cached for settings.SEMANTIC_CACHE_VERSION_CHECK seconds 
+    so that a rebuilt collection is picked up.
+
+    Returns
+    -------
+    chromadb.api.models.AsyncCollection.AsyncCollection
+        Collection containing the filtering SQONs. For in-process backends, 
+        the collection of get_collection behind a vector_index.AsyncCollection.
+    """
+    if settings.VECTOR_BACKEND != 'http':
+        return vector_index.AsyncCollection(get_collection())
+
+    key = ('collection', asyncio.get_running_loop())
+    collection = version_cache.get(key)
+    if collection is MISSING:
+        # cache the task so that concurrent calls share one request
+        collection = asyncio.ensure_future(_aget_collection())
+        version_cache.set(key, collection)
+    try:
+        return await collection
+    except Exception:
+        version_cache.delete(key)
+        raise
+
+async def _aget_collection() -> 'chromadb.api.models.AsyncCollection.AsyncCollection':
+    return await (await get_async_chroma_client()).get_collection('overture')
+
+async def get_async_chroma_client() -> 'chromadb.api.AsyncClientAPI':
+    """Get the async client of the vector database for the running event loop
+
+    Returns
+    -------
+    chromadb.api.AsyncClientAPI
+        Async client connected to the same Chroma server as vector_index.get_client.
+    """
+    import chromadb
+    from chromadb.config import Settings
+
+    loop = asyncio.get_running_loop()
+    if loop not in async_chroma_clients:
+        # concurrent first calls wait for the same client
+        async_chroma_clients[loop] = loop.create_task(chromadb.AsyncHttpClient(
+            host=settings.CHROMA_HOST, port=settings.CHROMA_PORT,
+            settings=Settings(anonymized_telemetry=False)
+        ))
+
+    return await async_chroma_clients[loop]
+
 def get_keyword_chain() -> RunnableSequence:
     """Create a Langchain LCEL chain that returns keywords extracted from unstructured text
 
@@ -198,6 +995,12 @@ def get_keyword_chain() -> RunnableSequence:
     -------
     langchain_core.runnables.base.RunnableSequence
         Langchain chain that will keywords extracted from unstructured text.
+
+    Notes
+    -----
+    When settings.KEYWORD_EXTRACTOR is 'local', keywords are matched against 
+    the field descriptions and enumerations of the vector database (see 
+    keywords.KeywordIndex) and the LLM is only called when nothing matches.
     """
     keyword_prompt_template = """
         You are expert English linguist. Extract all the keywords from the given database query.
@@ -224,9 +1027,63 @@ def get_keyword_chain() -> RunnableSequence:
         template=keyword_prompt_template,
         input_variables=['query']
     )
-    chain = prompt | llm
+    chain = prompt | get_llm()
+    if settings.KEYWORD_EXTRACTOR != 'local':
+        return chain.with_config(run_name=KEYWORDS_STEP)
+
+    llm_chain = chain
+
+    def match_keywords(query: str | dict, config: RunnableConfig) -> str:
+        keywords = get_keyword_index().match(get_question(query))
+        if keywords:
+            return ', '.join(keywords)
+        logger.debug("get_keyword_chain: no local match, falling back to the LLM")
+        return llm_chain.invoke(query, config=config)
+
+    async def amatch_keywords(query: str | dict, config: RunnableConfig) -> str:
+        keywords = (await aget_keyword_index()).match(get_question(query))
+        if keywords:
+            return ', '.join(keywords)
+        logger.debug("get_keyword_chain: no local match, falling back to the LLM")
+        return await llm_chain.ainvoke(query, config=config)
+
+    chain = RunnableLambda(match_keywords, afunc=amatch_keywords)
+
+    return chain.with_config(run_name=KEYWORDS_STEP)
 
-    return chain
+def get_keyword_index() -> KeywordIndex:
+    """Get the keyword index of the current version of the vector database
+
+    The index is built from the SQON value objects stored in the vector 
+    database on first use, and rebuilt when the collection is rebuilt.
+
+    Returns
+    -------
+    keywords.KeywordIndex
+        Index of the field descriptions and enumerations.
+    """
+    version = get_collection_version()
+    index = keyword_indexes.get(version)
+    if index is None:
+        metadatas = get_collection().get(include=['metadatas'])['metadatas']
+        index = KeywordIndex.from_schemas(metadata['schema'] for metadata in metadatas)
+        keyword_indexes.clear()
+        keyword_indexes[version] = index
+
+    return index
+
+async def aget_keyword_index() -> KeywordIndex:
+    """Async version of get_keyword_index"""
+    version = await aget_collection_version()
+    index = keyword_indexes.get(version)
+    if index is None:
+        collection = await aget_collection()
+        metadatas = (await collection.get(include=['metadatas']))['metadatas']
+        index = KeywordIndex.from_schemas(metadata['schema'] for metadata in metadatas)
+        keyword_indexes.clear()
+        keyword_indexes[version] = index
+
+    return index
 
 def get_sqon_keyword(keyword_str: str) -> list[str]:
     """Get SQONs (as JSON) from a keyword
@@ -242,25 +1099,174 @@ def get_sqon_keyword(keyword_str: str) -> list[str]:
     Returns
     -------
     list of str
-        List containing strings of filtering SQONs related to keywords.
+        List containing strings of filtering SQONs related to keywords, 
+        ordered by keyword and then by relevance, with all their 
+        enumerations (the prompt of create_sqon_schema prunes them, see 
+        prune_sqon_enums).
+
+    Notes
+    -----
+    All keywords are embedded in one batch and looked up in a single 
+    (multi-vector) query to the vector database. The time spent in each 
+    stage is logged at the DEBUG level.
 
     See Also
     --------
     initialize_db.main.main: Function to initialize vector store.
     """
-    retriever = vector_store.as_retriever(search_kwargs={"k": 3})
+    keyword_lst = split_keywords(keyword_str)
+    if not keyword_lst:
+        return []
+
+    start = time.perf_counter()
+    keyword_embeddings = get_embeddings().embed_documents(keyword_lst)
+    embedded = time.perf_counter()
+    results = get_collection().query(
+        query_embeddings=keyword_embeddings, n_results=3, include=['metadatas']
+    )
+    log_keyword_timings(len(keyword_lst), results, start, embedded)
+
+    return get_unique_sqons(results)
+
+async def aget_sqon_keyword(keyword_str: str) -> list[str]:
+    """Async version of get_sqon_keyword
+
+    The vector database is queried with the async Chroma client, without 
+    blocking the event loop on the HTTP call (in-process backends are 
+    queried directly).
+
+    See Also
+    --------
+    get_sqon_keyword
+    """
+    keyword_lst = split_keywords(keyword_str)
+    if not keyword_lst:
+        return []
+
+    start = time.perf_counter()
+    keyword_embeddings = await get_embeddings().aembed_documents(keyword_lst)
+    embedded = time.perf_counter()
+    collection = await aget_collection()
+    results = await collection.query(
+        query_embeddings=keyword_embeddings, n_results=3, include=['metadatas']
+    )
+    log_keyword_timings(len(keyword_lst), results, start, embedded)
+
+    return get_unique_sqons(results)
+
+def split_keywords(keyword_str: str) -> list[str]:
+    """Separate string into individual keywords
+
+    Parameters
+    ----------
+    keyword_str : str
+        String containing keywords separated by a comma (e.g. 'man, woman').
+
+    Returns
+    -------
+    list of str
+        Non-empty keywords without surrounding whitespace.
+    """
+    return [kwrd.strip() for kwrd in keyword_str.split(',') if kwrd.strip()]
+
+def get_unique_sqons(results: dict) -> list[str]:
+    """Get the SQONs of a vector database query without duplicates
+
+    The order is deterministic (by keyword, then by relevance) so that the 
+    same keywords always produce the same prompt.
+
+    Parameters
+    ----------
+    results : dict
+        Result of a Chroma query, with metadatas included.
+
+    Returns
+    -------
+    list of str
+        Filtering SQONs in order of first appearance.
+    """
+    sqons = [
+        metadata['schema']
+        for keyword_metadatas in results['metadatas']
+        for metadata in keyword_metadatas
+    ]
+
+    return list(dict.fromkeys(sqons))
+
+def prune_sqon_enums(
+    sqons: list[str], keywords: list[str], max_enums: int | None = None
+) -> list[str]:
+    """Keep the enumerations of SQON value objects relevant to keywords
+
+    The prompt of create_sqon_schema (and the time Ollama spends reading 
+    it) grows with the enumerations of the retrieved fields, which run to 
+    thousands of values for some fields. Fields with more than max_enums 
+    enumerations only keep those most similar to the keywords (see 
+    keywords.EnumIndex.select), including every enumeration equal to a keyword. 
+    Only the prompt is pruned: generated SQONs are validated against (and 
+    Ollama constrained to) all the enumerations.
+
+    Parameters
+    ----------
+    sqons : list of str
+        SQON value objects (JSON) of the retrieved fields.
+    keywords : list of str
+        Keywords of the question (e.g. ['males', 'Nova Scotia']).
+    max_enums : int, optional
+        Enumerations kept per field, by default settings.SQON_MAX_ENUMS 
+        (0 keeps all of them).
+
+    Returns
+    -------
+    list of str
+        SQON value objects, in the same order, with pruned enumerations.
+    """
+    if max_enums is None:
+        max_enums = settings.SQON_MAX_ENUMS
+    if max_enums < 1:
+        return sqons
+
+    pruned = []
+    for sqon in sqons:
+        value_object, enum_index = get_enum_index(sqon)
+        if enum_index is None or len(enum_index) <= max_enums:
+            pruned.append(sqon)
+            continue
+        enums = enum_index.select(keywords, max_enums)
+        value_object = {
+            **value_object,
+            'properties': {
+                **value_object['properties'],
+                'value': {
+                    **value_object['properties']['value'],
+                    'items': {**value_object['properties']['value']['items'], 'enum': enums}
+                }
+            }
+        }
+        pruned.append(json.dumps(value_object, ensure_ascii=False))
+
+    return pruned
 
-    # separate string into individual keywords
-    keyword_lst = keyword_str.split(', ')
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def get_enum_index(sqon: str) -> tuple[dict, EnumIndex | None]:
+    """Get a SQON value object and the index of its enumerations (None without enumerations)"""
+    value_object = json.loads(sqon)
+    enums = value_object['properties']['value'].get('items', {}).get('enum')
 
-    sqons = []
-    for kwrd in keyword_lst:
-        documents = retriever.invoke(kwrd.strip())
-        sqons.extend([doc.metadata['schema'] for doc in documents])
+    return value_object, EnumIndex(enums) if enums else None
 
-    sqons = list(set(sqons))
+def log_keyword_timings(keyword_count: int, results: dict, start: float, embedded: float):
+    """Log the time spent embedding keywords and searching the vector database
 
-    return sqons
+    The search is also recorded in the trace of the question (see 
+    overture_chatbot.instrumentation.record_retrieval).
+    """
+    end = time.perf_counter()
+    logger.debug(
+        "get_sqon_keyword: %d keywords, embed %.1f ms, search %.1f ms",
+        keyword_count, (embedded - start) * 1e3, (end - embedded) * 1e3
+    )
+    instrumentation.record_retrieval(sum(len(ids) for ids in results['ids']), end - embedded)
 
 def format_sqons_schema(sqons: list[str]) -> str:
     """Integrate SQONs into JSON schema
@@ -279,39 +1285,76 @@ def format_sqons_schema(sqons: list[str]) -> str:
     -----
     More information about JSON schemas can be found at 
     https://json-schema.org/understanding-json-schema/structuring.
+
+    The schema is the serialization of sqon_json_schema. It is memoized on 
+    the sorted SQONs, so the same combination of fields always produces the 
+    same string (and the same prompt prefix) whatever the retrieval order.
     """
-    json_refs_open = (
-        '{{"type": "object", "required": ["content", "op"], "properties": {{"content": '
-        '{{"type": "array", "items": {{"oneOf": [{{"$ref": "#/$defs/FieldOperations"}}, '
-        '{{"$ref": "#"}}]}}, "minItems": 1}}, "op": {{"default": "and", '
-        '"enum": ["and", "or", "not"], "type": "string"}}}}, "$defs": '
-        '{{"FieldOperations": {{"type": "object", "required": ["content", "op"], '
-        '"properties": {{"content": {{"type": "array", "items": {{"oneOf": ['
-    )
-    json_refs_close = (
-        ']}}, "maxItems": 1, "minItems": 1}}, "op": {{"default": "in", '
-        '"enum": ["in", "<=", ">="], "type": "string"}}}}}}, '
-    )
-    schema_close = '}}}}}'
+    return _format_sqons_schema(tuple(sorted(set(sqons))))
 
-    json_refs = ''
-    json_defs = ''
-    for count, value in enumerate(sqons):
-        json_refs = json_refs + """{{"$ref": "#/$defs/Value""" + str(count) + """"}}"""
-        json_defs = json_defs + """"Value""" + str(count) + '": ' + value
-        if count != (len(sqons)-1):
-            json_refs = json_refs + ', '
-            json_defs = json_defs + ', '
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _format_sqons_schema(sqons: tuple[str, ...]) -> str:
+    return json.dumps(_sqon_json_schema(sqons), ensure_ascii=False)
 
-    sqon_json = json_refs_open + json_refs + json_refs_close + json_defs + schema_close
+def sqon_json_schema(sqons: list[str]) -> dict:
+    """Create the JSON schema of SQON filters on the given fields
 
-    return sqon_json
+    The content of a field operation is a single value object, as expected 
+    by Arranger, so that the schema can also be used to constrain decoding.
+
+    Parameters
+    ----------
+    sqons : list of str
+        SQON value objects (JSON) of the fields that may be filtered.
+
+    Returns
+    -------
+    dict
+        JSON schema of the SQON filters. The schema is memoized and shared 
+        between calls; it must not be modified.
+
+    Raises
+    ------
+    ValueError
+        If a value object is not valid JSON.
+    """
+    return _sqon_json_schema(tuple(sorted(set(sqons))))
+
+@lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def _sqon_json_schema(sqons: tuple[str, ...]) -> dict:
+    value_defs = {f"Value{count}": json.loads(value) for count, value in enumerate(sqons)}
+
+    return {
+        "type": "object",
+        "required": ["content", "op"],
+        "properties": {
+            "content": {
+                "type": "array",
+                "items": {"oneOf": [{"$ref": "#/$defs/FieldOperations"}, {"$ref": "#"}]},
+                "minItems": 1
+            },
+            "op": {"default": "and", "enum": ["and", "or", "not"], "type": "string"}
+        },
+        "$defs": {
+            "FieldOperations": {
+                "type": "object",
+                "required": ["content", "op"],
+                "properties": {
+                    "content": {"oneOf": [{"$ref": f"#/$defs/{name}"} for name in value_defs]},
+                    "op": {"default": "in", "enum": ["in", "<=", ">="], "type": "string"}
+                }
+            },
+            **value_defs
+        }
+    }
 
 def format_sqon_filters(sqon_filters: str) -> str:
     """Format string into SQON format
 
     String from LLM may need to be slightly modified to be used 
-    in a GraphQL query (i.e. single vs double quotes).
+    in a GraphQL query (i.e. single vs double quotes). Filters that can be 
+    parsed are serialized as a GraphQL literal; others have their quotes 
+    rewritten.
 
     Parameters
     ----------
@@ -324,6 +1367,11 @@ def format_sqon_filters(sqon_filters: str) -> str:
     str
         String representation of SQON with quotes modified.
     """
+    try:
+        return to_graphql(parse_sqon(sqon_filters))
+    except ValueError:
+        pass
+
     modified_filters = sqon_filters.replace("'", '"')
     for sqon_keyword in ['fieldName', 'value', 'op', 'content']:
         modified_filters = modified_filters.replace(
@@ -352,6 +1400,17 @@ def get_total_graphql(sqon_filters: str) -> str:
 
     return str(total)
 
+async def aget_total_graphql(sqon_filters: str) -> str:
+    """Async version of get_total_graphql"""
+    json_response = await aquery_graphql(sqon_filters)
+    total = json.loads(json_response)['file']['hits']['total']
+
+    return str(total)
+
+# get_total_graphql.ainvoke awaits aget_total_graphql instead of running the 
+# sync function in a thread
+get_total_graphql.coroutine = aget_total_graphql
+
 def query_graphql(sqon_filters: str) -> str:
     """Query GraphQL endpoint with SQON filters
 
@@ -370,15 +1429,282 @@ def query_graphql(sqon_filters: str) -> str:
     -----
     Information about SQON filter notation can be found at Overtures website 
     (https://www.overture.bio/documentation/arranger/reference/sqon/)
-    
+
+    Responses are cached in result_cache, keyed on the canonical form of the 
+    SQON filters so that semantically identical filters share one entry. 
+    Filters that can not be parsed are sent to Arranger as they are and 
+    their responses are not cached. Filters on the values of a single field 
+    are answered from local_counts when they are fresh (see get_local_total). 
+    Identical filters queried concurrently share one Arranger query (see sqon_flight).
     """
+    key = get_result_cache_key(sqon_filters)
+    if key is None:
+        return fetch_total(sqon_filters, cache=False)
+    response = result_cache.get(key)
+    if response is MISSING:
+        response = get_local_total(key)
+    if response is not MISSING:
+        instrumentation.record_arranger(0.0, cached=True)
+        return response
+
+    # identical SQON filters in flight share one Arranger query
+    return sqon_flight.do(key, fetch_total, key)
 
+def fetch_total(sqon_filters: str, cache: bool = True) -> str:
+    """Query Arranger for the total of canonical SQON filters and cache the response
+
+    The response of filters that are not canonical (cache False) is not cached.
+
+    See Also
+    --------
+    query_graphql
+    """
     graphql_query = f"{{file{{hits(filters:{sqon_filters}){{total}}}}}}"
 
-    graphql = GraphQLAPIWrapper(
-        # TODO: abstract this value into an EnvVar
-        graphql_endpoint="https://arranger.virusseq-dataportal.ca/graphql"
-    )
-    response = graphql.run(query=graphql_query)
+    # shared, kept-alive connection to Arranger (see overture_chatbot.arranger)
+    start = time.perf_counter()
+    response = json.dumps(run_graphql(graphql_query), indent=2)
+    instrumentation.record_arranger(time.perf_counter() - start)
+    if cache:
+        result_cache.set(sqon_filters, response)
+
+    return response
+
+async def aquery_graphql(sqon_filters: str) -> str:
+    """Async version of query_graphql"""
+    key = get_result_cache_key(sqon_filters)
+    if key is None:
+        return await afetch_total(sqon_filters, cache=False)
+    response = result_cache.get(key)
+    if response is MISSING:
+        response = get_local_total(key)
+    if response is not MISSING:
+        instrumentation.record_arranger(0.0, cached=True)
+        return response
+
+    return await sqon_flight.ado(key, afetch_total, key)
+
+async def afetch_total(sqon_filters: str, cache: bool = True) -> str:
+    """Async version of fetch_total"""
+    graphql_query = f"{{file{{hits(filters:{sqon_filters}){{total}}}}}}"
+
+    start = time.perf_counter()
+    response = json.dumps(await arun_graphql(graphql_query), indent=2)
+    instrumentation.record_arranger(time.perf_counter() - start)
+    if cache:
+        result_cache.set(sqon_filters, response)
+
+    return response
+
+def query_breakdown(field: str, sqon_filters: str | None = None) -> str:
+    """Query GraphQL endpoint for the number of records of every value of a field
+
+    Parameters
+    ----------
+    field : str
+        Name of the field (i.e. 'analysis.host.host_gender').
+    sqon_filters : str, optional
+        Canonical SQON filters applied to the records.
+
+    Returns
+    -------
+    JSON as str
+        Value -> number of records, from a single aggregation query (see 
+        breakdown.aggregation_graphql).
+
+    Notes
+    -----
+    Responses are cached in result_cache and identical queries in flight 
+    share one Arranger query (see sqon_flight), as in query_graphql.
+    """
+    key = get_breakdown_cache_key(field, sqon_filters)
+    response = result_cache.get(key)
+    if response is not MISSING:
+        instrumentation.record_arranger(0.0, cached=True)
+        return response
+
+    return sqon_flight.do(key, fetch_breakdown, field, sqon_filters)
+
+def fetch_breakdown(field: str, sqon_filters: str | None = None) -> str:
+    """Query Arranger for the number of records per value of a field and cache the response
+
+    See Also
+    --------
+    query_breakdown
+    """
+    start = time.perf_counter()
+    data = run_graphql(aggregation_graphql(field, sqon_filters))
+    instrumentation.record_arranger(time.perf_counter() - start)
+    response = get_breakdown_response(data, field)
+    result_cache.set(get_breakdown_cache_key(field, sqon_filters), response)
 
     return response
+
+async def aquery_breakdown(field: str, sqon_filters: str | None = None) -> str:
+    """Async version of query_breakdown"""
+    key = get_breakdown_cache_key(field, sqon_filters)
+    response = result_cache.get(key)
+    if response is not MISSING:
+        instrumentation.record_arranger(0.0, cached=True)
+        return response
+
+    return await sqon_flight.ado(key, afetch_breakdown, field, sqon_filters)
+
+async def afetch_breakdown(field: str, sqon_filters: str | None = None) -> str:
+    """Async version of fetch_breakdown"""
+    start = time.perf_counter()
+    data = await arun_graphql(aggregation_graphql(field, sqon_filters))
+    instrumentation.record_arranger(time.perf_counter() - start)
+    response = get_breakdown_response(data, field)
+    result_cache.set(get_breakdown_cache_key(field, sqon_filters), response)
+
+    return response
+
+def get_breakdown_response(data: dict, field: str) -> str:
+    """Get the number of records per value (JSON) from the data of an aggregation query"""
+    buckets = data['file']['aggregations'][field.replace('.', '__')]['buckets']
+
+    return json.dumps({bucket['key']: bucket['doc_count'] for bucket in buckets})
+
+def get_breakdown_cache_key(field: str, sqon_filters: str | None) -> str:
+    """Get the key of a breakdown query in result_cache (SQON filters are keyed on their literal)"""
+    return f"breakdown:{field}:{sqon_filters or ''}"
+
+def query_graphql_batch(sqon_filters: list[str]) -> list[str | Exception]:
+    """Query GraphQL endpoint with several SQON filters in a single request
+
+    Parameters
+    ----------
+    sqon_filters : list of str
+        Representations of Serializable Query Object Notation (SQON) 
+        filters, one per question.
+
+    Returns
+    -------
+    list of (JSON as str or Exception)
+        Response of each SQON filters, as returned by query_graphql, or the 
+        error Arranger returned for them (ArrangerQueryError), or the error 
+        of a request that failed (e.g. requests.Timeout).
+
+    Notes
+    -----
+    Filters are deduplicated on their canonical form and looked up in 
+    result_cache and local_counts; the others are sent as aliased fields of 
+    one GraphQL query (i.e. {q0: file{hits(filters:...){total}} q1: ...}, 
+    see fetch_totals). Filters that can not be parsed are sent as they are 
+    and their responses are not cached.
+    """
+    canonical = [get_result_cache_key(filters) for filters in sqon_filters]
+    keys = [key or filters for key, filters in zip(canonical, sqon_filters)]
+    uncached = frozenset(filters for key, filters in zip(canonical, sqon_filters) if key is None)
+    responses = {}
+    for key in keys:
+        if key in uncached:
+            continue
+        response = result_cache.get(key)
+        if response is MISSING:
+            response = get_local_total(key)
+        if response is not MISSING:
+            instrumentation.record_arranger(0.0, cached=True)
+            responses[key] = response
+
+    missing = list(dict.fromkeys(key for key in keys if key not in responses))
+    if missing:
+        responses.update(fetch_totals(missing, uncached))
+
+    return [responses[key] for key in keys]
+
+def fetch_totals(
+    sqon_filters: list[str], uncached: frozenset[str] = frozenset()
+) -> dict[str, str | Exception]:
+    """Query Arranger for the totals of canonical SQON filters in one request and cache the responses
+
+    The responses of the filters in uncached (filters that are not 
+    canonical) are not cached. If the request fails as a whole (e.g. filters that are not valid GraphQL), 
+    it is split in two and each half is retried; filters whose field fails 
+    get the errors of their alias. If Arranger can not be reached or does 
+    not answer with JSON (e.g. a timeout or a 5xx page), every filter of 
+    the request gets that error, so that the other requests still run.
+
+    See Also
+    --------
+    query_graphql_batch
+    """
+    graphql_query = "{" + " ".join(
+        f"q{i}: file{{hits(filters:{filters}){{total}}}}" for i, filters in enumerate(sqon_filters)
+    ) + "}"
+
+    start = time.perf_counter()
+    try:
+        json_response = post_graphql(graphql_query)
+    except (requests.RequestException, ArrangerQueryError) as e:
+        return {filters: e for filters in sqon_filters}
+    finally:
+        instrumentation.record_arranger(time.perf_counter() - start)
+    data = json_response.get('data') or {}
+    if not data and len(sqon_filters) > 1:
+        middle = len(sqon_filters) // 2
+        return {
+            **fetch_totals(sqon_filters[:middle], uncached),
+            **fetch_totals(sqon_filters[middle:], uncached)
+        }
+
+    errors = {}
+    for error in json_response.get('errors', []):
+        errors.setdefault((error.get('path') or [None])[0], []).append(error)
+    responses = {}
+    for i, filters in enumerate(sqon_filters):
+        if data.get(f'q{i}') is None:
+            responses[filters] = ArrangerQueryError(errors.get(f'q{i}') or json_response.get('errors'))
+            continue
+        response = json.dumps({'file': data[f'q{i}']}, indent=2)
+        if filters not in uncached:
+            result_cache.set(filters, response)
+        responses[filters] = response
+
+    return responses
+
+def get_local_total(sqon_filters: str) -> str | object:
+    """Answer canonical SQON filters from local_counts
+
+    Parameters
+    ----------
+    sqon_filters : str
+        Canonical SQON filters (see get_result_cache_key).
+
+    Returns
+    -------
+    JSON as str or MISSING
+        Response in the shape of an Arranger response (see fetch_total), or 
+        MISSING if the filters are left to Arranger (see counts.LocalCounts.total).
+    """
+    if not local_counts.enabled:
+        return MISSING
+    try:
+        total = local_counts.total(parse_sqon(sqon_filters))
+    except ValueError:
+        total = None
+    if total is None:
+        return MISSING
+
+    return json.dumps({'file': {'hits': {'total': total}}}, indent=2)
+
+def get_result_cache_key(sqon_filters: str) -> str | None:
+    """Get the key of SQON filters in result_cache
+
+    Parameters
+    ----------
+    sqon_filters : str
+        Representation of Serializable Query Object Notation (SQON) 
+        filters that are passed to the GraphQL query
+
+    Returns
+    -------
+    str or None
+        Canonical SQON filters, or None if they can not be parsed (such 
+        filters are not cached, Arranger reports the error).
+    """
+    try:
+        return canonical_sqon_filters(sqon_filters)
+    except ValueError:
+        return None
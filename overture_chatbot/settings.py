@@ -0,0 +1,107 @@
+"""Configuration for the chatbot
+
+Settings are read from environment variables (e.g. set in docker-compose.yaml)
+and fall back to the defaults used in the Docker deployment.
+"""
+
+import os
+
+# Ollama server and model used to generate keywords, SQONs and answers
+OLLAMA_URL = os.environ.get('OLLAMA_URL', 'http://ollama-llm:11434')
+OLLAMA_MODEL = os.environ.get('OLLAMA_MODEL', 'mistral')
+# time Ollama keeps the model and its cached prompt prefixes loaded after a request (e.g. '1h',
+# or seconds, -1 for ever) and context size of every request (0 uses the default of the model)
+OLLAMA_KEEP_ALIVE = os.environ.get('OLLAMA_KEEP_ALIVE', '1h')
+OLLAMA_NUM_CTX = int(os.environ.get('OLLAMA_NUM_CTX', '4096'))
+# LLM generations running at once (at most OLLAMA_NUM_PARALLEL of the Ollama server; 0 disables
+# admission control), generations waiting for one of them and seconds they may wait
+LLM_MAX_IN_FLIGHT = int(os.environ.get('LLM_MAX_IN_FLIGHT', '2'))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '32'))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', '60'))
+
+# constraint on SQON generation: 'schema' (JSON schema of the SQONs, Ollama 0.5+), 'json' or 'text'
+SQON_OUTPUT_FORMAT = os.environ.get('SQON_OUTPUT_FORMAT', 'json')
+# enumerations of a field kept in the SQON prompt, those most similar to the keywords (0 keeps all)
+SQON_MAX_ENUMS = int(os.environ.get('SQON_MAX_ENUMS', '50'))
+
+# keyword extraction: 'llm' (Ollama) or 'local' (keywords.KeywordIndex, with the LLM as fallback)
+KEYWORD_EXTRACTOR = os.environ.get('KEYWORD_EXTRACTOR', 'llm')
+
+# sentence-transformers model embedding the documents of the vector database and the questions
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'multi-qa-mpnet-base-cos-v1')
+EMBEDDING_CACHE_FOLDER = os.environ.get('EMBEDDING_CACHE_FOLDER', 'resources/huggingface')
+# embedding backend (see embedding): 'torch' (sentence-transformers), 'onnx' (ONNX Runtime 
+# export of EMBEDDING_MODEL) or 'onnx-int8' (int8-quantized export), exported to EMBEDDING_ONNX_PATH
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_PATH = os.environ.get('EMBEDDING_ONNX_PATH', 'resources/onnx')
+# minimum top-3 retrieval overlap of an ONNX backend with the PyTorch model (checked by initialize_db)
+EMBEDDING_MIN_OVERLAP = float(os.environ.get('EMBEDDING_MIN_OVERLAP', '0.9'))
+
+# create the models and clients when the Chainlit app starts (see query_graphql.warm_up)
+# instead of on the first question
+WARM_UP = os.environ.get('WARM_UP', 'true').lower() == 'true'
+
+# trace the stages of every question (see overture_chatbot.instrumentation)
+INSTRUMENTATION = os.environ.get('INSTRUMENTATION', 'false').lower() == 'true'
+# append the time spent in each stage to the answers (requires INSTRUMENTATION)
+SHOW_TIMINGS = os.environ.get('SHOW_TIMINGS', 'false').lower() == 'true'
+# OpenTelemetry collector receiving the traces and metrics (not exported if empty)
+OTEL_EXPORTER_OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', '')
+
+# Chroma server holding the vector database of SQONs
+CHROMA_HOST = os.environ.get('CHROMA_HOST', 'chroma-db')
+CHROMA_PORT = int(os.environ.get('CHROMA_PORT', '8000'))
+# backend of the vector database (see vector_index): 'http' (Chroma server), 
+# 'persistent' (local Chroma) or 'numpy' (in-process index), the last two stored in VECTOR_PATH
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'http')
+VECTOR_PATH = os.environ.get('VECTOR_PATH', 'resources/vector_index')
+
+# Arranger GraphQL endpoint of the Overture project
+ARRANGER_URL = os.environ.get(
+    'ARRANGER_URL', 'https://arranger.virusseq-dataportal.ca/graphql'
+)
+# number of endpoints (hosts) that keep a connection pool
+ARRANGER_POOL_CONNECTIONS = int(os.environ.get('ARRANGER_POOL_CONNECTIONS', '4'))
+# maximum number of kept-alive connections per endpoint
+ARRANGER_POOL_MAXSIZE = int(os.environ.get('ARRANGER_POOL_MAXSIZE', '16'))
+# timeouts (seconds) for opening a connection and for reading a response
+ARRANGER_CONNECT_TIMEOUT = float(os.environ.get('ARRANGER_CONNECT_TIMEOUT', '10'))
+ARRANGER_READ_TIMEOUT = float(os.environ.get('ARRANGER_READ_TIMEOUT', '300'))
+
+# vector database initialization: fields per aggregation query and concurrent queries
+INIT_BATCH_SIZE = int(os.environ.get('INIT_BATCH_SIZE', '50'))
+INIT_WORKERS = int(os.environ.get('INIT_WORKERS', '4'))
+# maximum characters of an enumeration document (longer lists are split into several documents)
+INIT_ENUM_CHUNK_CHARS = int(os.environ.get('INIT_ENUM_CHUNK_CHARS', '1000'))
+# documents per embedding batch and processes embedding the batches
+INIT_EMBED_BATCH_SIZE = int(os.environ.get('INIT_EMBED_BATCH_SIZE', '64'))
+INIT_EMBED_PROCESSES = int(os.environ.get('INIT_EMBED_PROCESSES', str(min(4, os.cpu_count() or 1))))
+
+# cache of Arranger results keyed on canonical SQON filters (0 entries disables it)
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get('RESULT_CACHE_MAX_ENTRIES', '1024'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(1024 * 1024)))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '600'))
+
+# cache of generated SQONs keyed on the embedding of the question (0 entries disables it)
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', '512'))
+# minimum cosine similarity between two questions to reuse the SQON
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', '0.97'))
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', '86400'))
+# seconds between checks of whether the 'overture' collection was rebuilt
+SEMANTIC_CACHE_VERSION_CHECK = float(os.environ.get('SEMANTIC_CACHE_VERSION_CHECK', '60'))
+
+# concurrent identical questions and SQON filters share one LLM generation and Arranger query
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', 'true').lower() == 'true'
+
+# bulk questions (see overture_chatbot.bulk): questions per Arranger request and SQONs generated at once
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '50'))
+BULK_MAX_CONCURRENCY = int(os.environ.get('BULK_MAX_CONCURRENCY', '4'))
+
+# answer SQON filters on the values of a single field from the number of records of every value,
+# stored by initialize_db in LOCAL_COUNTS_PATH (see overture_chatbot.counts); counts are refreshed
+# every LOCAL_COUNTS_REFRESH seconds (initialize_db --counts --schedule) and left unused once
+# older than LOCAL_COUNTS_MAX_AGE seconds (0 uses them whatever their age)
+LOCAL_COUNTS = os.environ.get('LOCAL_COUNTS', 'true').lower() == 'true'
+LOCAL_COUNTS_PATH = os.environ.get('LOCAL_COUNTS_PATH', 'resources/counts/counts.sqlite')
+LOCAL_COUNTS_REFRESH = float(os.environ.get('LOCAL_COUNTS_REFRESH', '3600'))
+LOCAL_COUNTS_MAX_AGE = float(os.environ.get('LOCAL_COUNTS_MAX_AGE', '10800'))
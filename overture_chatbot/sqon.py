@@ -0,0 +1,316 @@
+"""Serializable Query Object Notation (SQON) helpers
+
+Functions to parse SQON filters produced by the LLM (JSON, Python-style
+single quotes or the GraphQL literal returned by format_sqon_filters),
+put them in a canonical form and serialize them for GraphQL queries.
+
+Notes
+-----
+Information about SQON filter notation can be found at Overtures website
+(https://www.overture.bio/documentation/arranger/reference/sqon/)
+"""
+
+import json
+import re
+
+# operators for which the order of the content does not matter
+COMMUTATIVE_OPS = ('and', 'or')
+# operators combining other filters and operators filtering a field
+BOOLEAN_OPS = ('and', 'or', 'not')
+FIELD_OPS = ('in', '<=', '>=')
+
+_TOKEN_REGEX = re.compile(r'''
+    (?P<space>[\s,]+)
+    |(?P<punct>[{}\[\]:])
+    |(?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+    |(?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+    |(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+''', re.VERBOSE)
+
+_NAMES = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+
+
+class SQONValidationError(ValueError):
+    """Raised when SQON filters do not match the value objects of the fields"""
+
+
+def _tokenize(sqon_filters: str) -> list[tuple[str, str]]:
+    """Split SQON filters into (kind, text) tokens, ignoring whitespace and commas"""
+    tokens = []
+    position = 0
+    while position < len(sqon_filters):
+        match = _TOKEN_REGEX.match(sqon_filters, position)
+        if match is None:
+            raise ValueError(
+                f"Unexpected character {sqon_filters[position]!r} at position {position}"
+            )
+        if match.lastgroup != 'space':
+            tokens.append((match.lastgroup, match.group()))
+        position = match.end()
+
+    return tokens
+
+
+def _decode_string(text: str) -> str:
+    """Decode a double or single quoted string token"""
+    if text[0] == "'":
+        # re-quote single quoted strings so json can decode the escapes
+        text = '"' + re.sub(r'(?<!\\)"', r'\\"', text[1:-1].replace("\\'", "'")) + '"'
+
+    return json.loads(text)
+
+
+def _parse_value(tokens: list[tuple[str, str]], index: int) -> tuple[object, int]:
+    """Parse the value starting at tokens[index] and return it with the next index"""
+    if index >= len(tokens):
+        raise ValueError("Unexpected end of SQON filters")
+
+    kind, text = tokens[index]
+    if text == '{':
+        obj = {}
+        index += 1
+        while tokens[index][1] != '}':
+            key_kind, key = tokens[index]
+            if key_kind == 'string':
+                key = _decode_string(key)
+            elif key_kind != 'name':
+                raise ValueError(f"Expected a key, got {key!r}")
+            if tokens[index+1][1] != ':':
+                raise ValueError(f"Expected ':' after key {key!r}")
+            obj[key], index = _parse_value(tokens, index+2)
+        return obj, index + 1
+    if text == '[':
+        array = []
+        index += 1
+        while tokens[index][1] != ']':
+            item, index = _parse_value(tokens, index)
+            array.append(item)
+        return array, index + 1
+    if kind == 'string':
+        return _decode_string(text), index + 1
+    if kind == 'number':
+        return json.loads(text), index + 1
+    if kind == 'name' and text in _NAMES:
+        return _NAMES[text], index + 1
+    if kind == 'name':
+        # GraphQL enum value
+        return text, index + 1
+
+    raise ValueError(f"Unexpected token {text!r}")
+
+
+def parse_sqon(sqon_filters: str) -> dict:
+    """Parse SQON filters into a dictionary
+
+    Parameters
+    ----------
+    sqon_filters : str
+        SQON filters as JSON, with Python-style single quotes or as a
+        GraphQL literal with unquoted keys (i.e. output of format_sqon_filters).
+
+    Returns
+    -------
+    dict
+        SQON filters as a dictionary.
+
+    Raises
+    ------
+    ValueError
+        If sqon_filters can not be parsed.
+    """
+    tokens = _tokenize(sqon_filters)
+    try:
+        sqon, index = _parse_value(tokens, 0)
+    except IndexError as e:
+        raise ValueError("Unexpected end of SQON filters") from e
+    if index != len(tokens):
+        raise ValueError(f"Unexpected trailing content {tokens[index][1]!r}")
+    if not isinstance(sqon, dict):
+        raise ValueError("SQON filters must be an object")
+
+    return sqon
+
+
+def _sorted_unique(items: list) -> list:
+    """Deduplicate items and sort them by their GraphQL literal"""
+    unique = {to_graphql(item): item for item in items}
+
+    return [unique[key] for key in sorted(unique)]
+
+
+def canonicalize_sqon(sqon: dict) -> dict:
+    """Put SQON filters into a canonical form
+
+    Semantically identical filters share the same canonical form: the content
+    of commutative operators ('and', 'or') is sorted and deduplicated and the
+    values of field operations are sorted and deduplicated.
+
+    Parameters
+    ----------
+    sqon : dict
+        SQON filters as a dictionary.
+
+    Returns
+    -------
+    dict
+        Canonical SQON filters.
+    """
+    if not isinstance(sqon, dict):
+        return sqon
+
+    canonical = {}
+    for key, value in sqon.items():
+        if key == 'content' and isinstance(value, list):
+            value = [canonicalize_sqon(item) for item in value]
+            if sqon.get('op') in COMMUTATIVE_OPS:
+                value = _sorted_unique(value)
+        elif key == 'content' and isinstance(value, dict):
+            value = canonicalize_sqon(value)
+        elif key == 'value' and isinstance(value, list):
+            value = _sorted_unique(value)
+        canonical[key] = value
+
+    return dict(sorted(canonical.items()))
+
+
+def to_graphql(sqon: object) -> str:
+    """Serialize SQON filters as a GraphQL literal
+
+    Keys are written without quotes, as in the output of format_sqon_filters.
+
+    Parameters
+    ----------
+    sqon : dict
+        SQON filters (or any part of them).
+
+    Returns
+    -------
+    str
+        GraphQL literal of the SQON filters.
+    """
+    if isinstance(sqon, dict):
+        return '{' + ', '.join(f'{key}: {to_graphql(value)}' for key, value in sqon.items()) + '}'
+    if isinstance(sqon, list):
+        return '[' + ', '.join(to_graphql(item) for item in sqon) + ']'
+
+    return json.dumps(sqon)
+
+
+def canonical_sqon_filters(sqon_filters: str) -> str:
+    """Canonical GraphQL literal of SQON filters
+
+    Parameters
+    ----------
+    sqon_filters : str
+        SQON filters in any format accepted by parse_sqon.
+
+    Returns
+    -------
+    str
+        Canonical GraphQL literal usable as a cache key and in a GraphQL query.
+
+    Raises
+    ------
+    ValueError
+        If sqon_filters can not be parsed.
+    """
+    return to_graphql(canonicalize_sqon(parse_sqon(sqon_filters)))
+
+
+def remove_field(sqon: dict, field: str) -> dict | None:
+    """Remove the operations filtering a field from SQON filters
+
+    Parameters
+    ----------
+    sqon : dict
+        SQON filters.
+    field : str
+        Name of the field (e.g. 'analysis.host.host_gender').
+
+    Returns
+    -------
+    dict or None
+        SQON filters without the operations on the field (and without the 
+        operations left empty), or None if nothing else is filtered.
+    """
+    content = sqon.get('content')
+    if isinstance(content, dict):
+        return None if content.get('fieldName') == field else sqon
+    if not isinstance(content, list):
+        return sqon
+    kept = [item for item in (remove_field(item, field) for item in content) if item is not None]
+
+    return {**sqon, 'content': kept} if kept else None
+
+
+def validate_sqon(sqon: dict, value_objects: list[dict]) -> None:
+    """Check SQON filters against the value objects of the fields
+
+    Catches invalid filters generated by the LLM before they are sent to
+    Arranger: unknown operators, fields that are not in the value objects,
+    values missing from the enumeration of a field and non-integer values
+    of numerical fields.
+
+    Parameters
+    ----------
+    sqon : dict
+        SQON filters as a dictionary.
+    value_objects : list of dict
+        JSON schemas of the SQON value objects of the fields that may be
+        filtered (see initialize_db.main.create_value_object_schema).
+
+    Raises
+    ------
+    SQONValidationError
+        If the filters are invalid.
+    """
+    fields = {
+        value_object['properties']['fieldName']['const']: value_object['properties']['value']
+        for value_object in value_objects
+    }
+    _validate_operation(sqon, fields, 'sqon')
+
+
+def _validate_operation(sqon: object, fields: dict[str, dict], path: str):
+    if not isinstance(sqon, dict) or 'op' not in sqon or 'content' not in sqon:
+        raise SQONValidationError(f"{path} must be an object with 'op' and 'content'")
+
+    op, content = sqon['op'], sqon['content']
+    if op in BOOLEAN_OPS:
+        if not isinstance(content, list) or not content:
+            raise SQONValidationError(f"{path}.content of '{op}' must be a non-empty array")
+        for index, item in enumerate(content):
+            _validate_operation(item, fields, f'{path}.content[{index}]')
+    elif op in FIELD_OPS:
+        if not isinstance(content, dict):
+            raise SQONValidationError(f"{path}.content of '{op}' must be an object")
+        _validate_field(op, content, fields, f'{path}.content')
+    else:
+        raise SQONValidationError(f"{path}.op {op!r} is not one of {BOOLEAN_OPS + FIELD_OPS}")
+
+
+def _validate_field(op: str, content: dict, fields: dict[str, dict], path: str):
+    field_name = content.get('fieldName')
+    if field_name not in fields:
+        raise SQONValidationError(f"{path}.fieldName {field_name!r} is not a known field")
+    if 'value' not in content:
+        raise SQONValidationError(f"{path}.value is missing")
+
+    value, value_schema = content['value'], fields[field_name]
+    if value_schema.get('type') == 'integer':
+        values = value if isinstance(value, list) else [value]
+        # bool is a subclass of int, but true/false are not timestamps or counts
+        if not values or not all(isinstance(item, int) and not isinstance(item, bool) for item in values):
+            raise SQONValidationError(f"{path}.value of {field_name!r} must be an integer")
+        return
+
+    if op != 'in':
+        raise SQONValidationError(f"{path}: {field_name!r} can only be filtered with 'in'")
+    values = value if isinstance(value, list) else [value]
+    enums = value_schema.get('items', {}).get('enum')
+    if not values:
+        raise SQONValidationError(f"{path}.value of {field_name!r} must not be empty")
+    if enums is not None:
+        invalid = [item for item in values if item not in enums]
+        if invalid:
+            raise SQONValidationError(f"{path}.value {invalid!r} not in the values of {field_name!r}")
@@ -0,0 +1,323 @@
+"""Vector database backends
+
+Collections of the vector database shared by the chatbot and the vector
+database initialization. The backend is chosen with settings.VECTOR_BACKEND:
+
+- 'http': Chroma server (settings.CHROMA_HOST), one network round-trip per query;
+- 'persistent': Chroma stored in settings.VECTOR_PATH, queried in-process;
+- 'numpy': NumpyCollection stored in settings.VECTOR_PATH and memory-mapped
+  when loaded, queried in-process with a single matrix product.
+
+All backends expose the chromadb Collection methods used by the project
+(get, query, upsert, delete, modify and count). chromadb is only imported 
+when a Chroma backend is used.
+"""
+
+import json
+import os
+import threading
+import uuid
+from functools import cache
+import numpy as np
+from overture_chatbot import settings
+
+BACKENDS = ('http', 'persistent', 'numpy')
+
+# loaded NumpyCollections, by path, with the modification time of their files
+_numpy_collections: dict[str, tuple[float, 'NumpyCollection']] = {}
+_numpy_collections_lock = threading.Lock()
+
+
+class NumpyCollection:
+    """In-process collection of embeddings held in a NumPy array
+
+    Queries compute the squared L2 distance (the default space of Chroma
+    collections) to every embedding with one matrix product, which takes
+    well under a millisecond for the few thousand documents of a portal.
+    Changes are kept in memory until save is called.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the collection (see save).
+    metadata : dict, optional
+        Metadata of the collection (e.g. its 'version'), by default None.
+    """
+
+    def __init__(self, path: str, metadata: dict | None = None):
+        self.path = path
+        self.name = os.path.basename(os.path.normpath(path))
+        self.id = str(uuid.uuid4())
+        self.metadata = metadata
+        self._ids: list[str] = []
+        self._documents: list[str | None] = []
+        self._metadatas: list[dict | None] = []
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._squared_norms = np.zeros(0, dtype=np.float32)
+        self._rows: dict[str, int] = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'NumpyCollection':
+        """Load a collection saved with save, memory-mapping its embeddings
+
+        Parameters
+        ----------
+        path : str
+            Directory of the collection.
+
+        Returns
+        -------
+        NumpyCollection
+            Loaded collection.
+
+        Raises
+        ------
+        FileNotFoundError
+            If no collection was saved in path.
+        """
+        with open(os.path.join(path, 'collection.json'), encoding='utf-8') as file:
+            saved = json.load(file)
+        collection = cls(path, saved['metadata'])
+        collection.id = saved['id']
+        collection._ids = saved['ids']
+        collection._documents = saved['documents']
+        collection._metadatas = saved['metadatas']
+        collection._set_embeddings(np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r'))
+
+        return collection
+
+    def save(self):
+        """Write the collection to its directory
+
+        The embeddings are written first and the records last, each to a
+        temporary file renamed over the previous one, so that a chatbot
+        reloading the collection never reads a partially written file.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        embeddings_path = os.path.join(self.path, 'embeddings.npy')
+        with open(embeddings_path + '.tmp', 'wb') as file:
+            np.save(file, np.ascontiguousarray(self._embeddings))
+        os.replace(embeddings_path + '.tmp', embeddings_path)
+
+        collection_path = os.path.join(self.path, 'collection.json')
+        with open(collection_path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump({
+                'id': self.id,
+                'metadata': self.metadata,
+                'ids': self._ids,
+                'documents': self._documents,
+                'metadatas': self._metadatas
+            }, file, ensure_ascii=False)
+        os.replace(collection_path + '.tmp', collection_path)
+
+    def count(self) -> int:
+        """Number of documents in the collection"""
+        return len(self._ids)
+
+    def get(self, ids: list[str] | None = None, include: list[str] = ('metadatas', 'documents')) -> dict:
+        """Get documents by ID (all documents by default), like chromadb Collection.get"""
+        rows = range(len(self._ids)) if ids is None else [
+            self._rows[doc_id] for doc_id in ids if doc_id in self._rows
+        ]
+
+        return {
+            'ids': [self._ids[row] for row in rows],
+            'embeddings': [self._embeddings[row].tolist() for row in rows] if 'embeddings' in include else None,
+            'documents': [self._documents[row] for row in rows] if 'documents' in include else None,
+            'metadatas': [self._metadatas[row] for row in rows] if 'metadatas' in include else None
+        }
+
+    def query(
+        self, query_embeddings: list[list[float]], n_results: int = 10,
+        include: list[str] = ('metadatas', 'documents', 'distances')
+    ) -> dict:
+        """Get the nearest documents of each query embedding, like chromadb Collection.query"""
+        results = {'ids': [], 'distances': [], 'documents': [], 'metadatas': []}
+        if self._ids:
+            queries = np.asarray(query_embeddings, dtype=np.float32)
+            distances = (
+                self._squared_norms[np.newaxis, :]
+                - 2 * queries @ self._embeddings.T
+                + np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+            )
+            k = min(n_results, len(self._ids))
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            nearest = [[] for _ in query_embeddings]
+
+        for i, rows in enumerate(nearest):
+            rows = sorted(rows, key=lambda row: (distances[i, row], row))
+            results['ids'].append([self._ids[row] for row in rows])
+            results['distances'].append([float(distances[i, row]) for row in rows])
+            results['documents'].append([self._documents[row] for row in rows])
+            results['metadatas'].append([self._metadatas[row] for row in rows])
+
+        return {
+            'ids': results['ids'],
+            'embeddings': None,
+            **{key: results[key] if key in include else None for key in ('distances', 'documents', 'metadatas')}
+        }
+
+    def upsert(
+        self, ids: list[str], embeddings: list[list[float]],
+        documents: list[str] | None = None, metadatas: list[dict] | None = None
+    ):
+        """Add documents or replace those with the same ID, like chromadb Collection.upsert"""
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        matrix = np.array(self._embeddings) if len(self._ids) else np.zeros(
+            (0, vectors.shape[1]), dtype=np.float32
+        )
+
+        new_rows = []
+        for doc_id, vector, document, metadata in zip(ids, vectors, documents, metadatas):
+            if doc_id in self._rows:
+                row = self._rows[doc_id]
+                matrix[row] = vector
+                self._documents[row] = document
+                self._metadatas[row] = metadata
+            else:
+                self._rows[doc_id] = len(self._ids)
+                self._ids.append(doc_id)
+                self._documents.append(document)
+                self._metadatas.append(metadata)
+                new_rows.append(vector)
+        if new_rows:
+            matrix = np.vstack([matrix, np.asarray(new_rows, dtype=np.float32)])
+        self._set_embeddings(matrix)
+
+    def delete(self, ids: list[str]):
+        """Remove documents by ID, like chromadb Collection.delete"""
+        deleted = {self._rows[doc_id] for doc_id in ids if doc_id in self._rows}
+        kept = [row for row in range(len(self._ids)) if row not in deleted]
+        self._ids = [self._ids[row] for row in kept]
+        self._documents = [self._documents[row] for row in kept]
+        self._metadatas = [self._metadatas[row] for row in kept]
+        self._set_embeddings(np.array(self._embeddings[kept]))
+
+    def modify(self, metadata: dict | None = None):
+        """Replace the metadata of the collection, like chromadb Collection.modify"""
+        if metadata is not None:
+            self.metadata = metadata
+
+    def _set_embeddings(self, matrix: np.ndarray):
+        self._embeddings = matrix
+        self._squared_norms = np.einsum('ij,ij->i', matrix, matrix) if len(matrix) else (
+            np.zeros(0, dtype=np.float32)
+        )
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+
+
+class AsyncCollection:
+    """Async interface of an in-process collection
+
+    Queries of in-process backends do not wait on the network, so they are
+    run directly in the event loop.
+
+    Parameters
+    ----------
+    collection : chromadb Collection or NumpyCollection
+        In-process collection.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.id = collection.id
+        self.metadata = collection.metadata
+
+    async def get(self, **kwargs) -> dict:
+        return self.collection.get(**kwargs)
+
+    async def query(self, **kwargs) -> dict:
+        return self.collection.query(**kwargs)
+
+
+@cache
+def get_client(backend: str = settings.VECTOR_BACKEND) -> 'chromadb.api.ClientAPI':
+    """Get the Chroma client of a backend
+
+    Parameters
+    ----------
+    backend : str
+        'http' or 'persistent', by default settings.VECTOR_BACKEND.
+
+    Returns
+    -------
+    chromadb.api.ClientAPI
+        Client of the Chroma server or of the local Chroma in settings.VECTOR_PATH.
+    """
+    import chromadb
+    from chromadb.config import Settings
+
+    if backend == 'http':
+        return chromadb.HttpClient(
+            host=settings.CHROMA_HOST, port=settings.CHROMA_PORT,
+            settings=Settings(allow_reset=True, anonymized_telemetry=False)
+        )
+    if backend == 'persistent':
+        return chromadb.PersistentClient(
+            path=os.path.join(settings.VECTOR_PATH, 'chroma'),
+            settings=Settings(allow_reset=True, anonymized_telemetry=False)
+        )
+
+    raise ValueError(f"Unknown vector database backend {backend!r}, expected one of {BACKENDS}")
+
+
+def get_collection(name: str, backend: str = settings.VECTOR_BACKEND, create: bool = False):
+    """Get a collection of the vector database
+
+    Parameters
+    ----------
+    name : str
+        Name of the collection (e.g. 'overture').
+    backend : str
+        Backend of the vector database, by default settings.VECTOR_BACKEND.
+    create : bool
+        Create the collection if it does not exist, by default False.
+
+    Returns
+    -------
+    chromadb Collection or NumpyCollection
+        Collection of the backend. NumpyCollections are only reloaded when
+        their files changed.
+
+    Raises
+    ------
+    ValueError
+        If the collection does not exist and create is False.
+    """
+    if backend != 'numpy':
+        client = get_client(backend)
+        if create:
+            return client.get_or_create_collection(name)
+        return client.get_collection(name)
+
+    path = os.path.join(settings.VECTOR_PATH, name)
+    try:
+        modified = os.stat(os.path.join(path, 'collection.json')).st_mtime
+    except FileNotFoundError:
+        if create:
+            return NumpyCollection(path)
+        raise ValueError(f"Collection {name} does not exist.") from None
+    with _numpy_collections_lock:
+        loaded = _numpy_collections.get(path)
+        if loaded is None or loaded[0] != modified:
+            loaded = (modified, NumpyCollection.load(path))
+            _numpy_collections[path] = loaded
+
+    return loaded[1]
+
+
+def collection_exists(name: str, backend: str = settings.VECTOR_BACKEND) -> bool:
+    """Whether a collection of the vector database exists"""
+    if backend == 'numpy':
+        return os.path.exists(os.path.join(settings.VECTOR_PATH, name, 'collection.json'))
+
+    return name in [collection.name for collection in get_client(backend).list_collections()]
+
+
+def persist_collection(collection):
+    """Save the changes made to a collection (Chroma collections are saved as they change)"""
+    if isinstance(collection, NumpyCollection):
+        collection.save()
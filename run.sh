@@ -1,3 +1,5 @@
 #!/bin/sh
-python3 initialize_db/main.py
+python3 -m initialize_db.main
+# refresh the local counts every LOCAL_COUNTS_REFRESH seconds
+python3 -m initialize_db.main --counts --schedule &
 chainlit run overture_chatbot/app.py --host=0.0.0.0 --port=5000 --headless
@@ -0,0 +1,174 @@
+"""Tests for overture_chatbot.admission"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from langchain_core.language_models import LLM
+from langchain_core.outputs import GenerationChunk
+from overture_chatbot.admission import AdmissionController, AdmittedLLM, LLMOverloadedError
+
+
+class SlowStreamingLLM(LLM):
+    """Fake LLM streaming its answer one word at a time"""
+    answer: str
+    latency: float = 0.01
+
+    @property
+    def _llm_type(self) -> str:
+        return 'slow-streaming'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return self.answer
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for token in self.answer.split(' '):
+            time.sleep(self.latency)
+            chunk = GenerationChunk(text=token + ' ')
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+param_admission_queue = [
+    # (max in flight, max queue, generations, expected admitted, expected rejected)
+    (1, 1, 3, 2, 1),
+    (2, 0, 3, 2, 1),
+    (1, 5, 4, 4, 0)
+]
+
+@pytest.mark.parametrize(
+    'max_in_flight_1, max_queue_1, generations_1, expected_admitted_1, expected_rejected_1',
+    param_admission_queue
+)
+
+def test_admission_queue(
+    max_in_flight_1, max_queue_1, generations_1, expected_admitted_1, expected_rejected_1
+):
+    """Test for overture_chatbot.admission.AdmissionController.aslot with a bounded queue"""
+    admission = AdmissionController(max_in_flight_1, max_queue_1, timeout=5)
+    running = []
+    order = []
+
+    async def generate(i):
+        async with admission.aslot():
+            running.append(admission.in_flight)
+            order.append(i)
+            await asyncio.sleep(0.02)
+
+    async def run():
+        return await asyncio.gather(
+            *[generate(i) for i in range(generations_1)], return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert sum(isinstance(result, LLMOverloadedError) for result in results) == expected_rejected_1
+    assert max(running) <= max_in_flight_1
+    # first come, first served
+    assert order == sorted(order)
+    assert admission.stats()['admitted'] == expected_admitted_1
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_admission_timeout():
+    """Test for overture_chatbot.admission.AdmissionController with a deadline"""
+    admission = AdmissionController(1, 5, timeout=0.05)
+
+    async def hold():
+        async with admission.aslot():
+            await asyncio.sleep(0.3)
+
+    async def wait():
+        await asyncio.sleep(0.01)
+        async with admission.aslot():
+            pass
+
+    async def run():
+        return await asyncio.gather(hold(), wait(), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert results[0] is None
+    assert isinstance(results[1], LLMOverloadedError)
+    assert admission.stats()['timed_out'] == 1
+    assert admission.stats()['queued'] == 0
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_admission_cancelled():
+    """Test for overture_chatbot.admission.AdmissionController with a cancelled waiter"""
+    admission = AdmissionController(1, 5, timeout=5)
+
+    async def run():
+        async def hold():
+            async with admission.aslot():
+                await asyncio.sleep(0.1)
+
+        async def wait():
+            async with admission.aslot():
+                pass
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        queued = admission.stats()['queued']
+        waiter.cancel()
+        await holder
+        return queued
+
+    queued = asyncio.run(run())
+
+    assert queued == 1
+    assert admission.stats()['queued'] == 0
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_admission_threads():
+    """Test for overture_chatbot.admission.AdmissionController.slot with concurrent threads"""
+    admission = AdmissionController(2, 10, timeout=5)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def generate():
+        with admission.slot():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        for future in [executor.submit(generate) for _ in range(6)]:
+            future.result()
+
+    assert peak[0] == 2
+    assert admission.stats()['admitted'] == 6
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_admitted_llm():
+    """Test for overture_chatbot.admission.AdmittedLLM streaming and rejection"""
+    admission = AdmissionController(1, 0, timeout=5)
+    llm = AdmittedLLM(llm=SlowStreamingLLM(answer='There are 100 males'), admission=admission)
+
+    async def stream():
+        return [chunk async for chunk in llm.astream('question')]
+
+    async def concurrent():
+        return await asyncio.gather(stream(), llm.ainvoke('question'), return_exceptions=True)
+
+    actual_result = asyncio.run(stream())
+    actual_result_invoke = llm.invoke('question')
+    actual_result_concurrent = asyncio.run(concurrent())
+
+    assert actual_result == ['There ', 'are ', '100 ', 'males ']
+    assert actual_result_invoke == 'There are 100 males'
+    assert actual_result_concurrent[0] == actual_result
+    assert isinstance(actual_result_concurrent[1], LLMOverloadedError)
+    assert admission.stats()['rejected'] == 1
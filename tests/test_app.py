@@ -0,0 +1,45 @@
+"""Tests for overture_chatbot.app"""
+
+import asyncio
+import types
+import httpx
+import overture_chatbot.app
+import overture_chatbot.arranger
+
+
+class MockMessage:
+    """Mock of chainlit.Message recording the messages sent"""
+    sent = []
+
+    def __init__(self, content):
+        self.content = content
+
+    async def stream_token(self, token):
+        self.content += token
+
+    async def send(self):
+        MockMessage.sent.append(self.content)
+
+
+def test_on_message_arranger_not_json(monkeypatch):
+    """Test for overture_chatbot.app.on_message when a proxy answers for Arranger with an HTML error page"""
+    app = overture_chatbot.app
+    transport = httpx.MockTransport(
+        lambda request: httpx.Response(502, content=b'<html>502 Bad Gateway</html>')
+    )
+
+    async def mock_astream_query_total_summary(question):
+        await overture_chatbot.arranger.arun_graphql('{file{hits{total}}}')
+        yield app.ANSWER_STEP, 'There are 100 males'
+    monkeypatch.setattr(
+        overture_chatbot.arranger, 'get_async_client', lambda url: httpx.AsyncClient(transport=transport)
+    )
+    monkeypatch.setattr(app, 'cl', types.SimpleNamespace(Message=MockMessage))
+    monkeypatch.setattr(app, 'warm_up_future', None)
+    monkeypatch.setattr(app, 'astream_query_total_summary', mock_astream_query_total_summary)
+    MockMessage.sent = []
+
+    asyncio.run(app.on_message(MockMessage('Find the number of males')))
+
+    assert len(MockMessage.sent) == 1
+    assert 'the data portal could not answer' in MockMessage.sent[0]
@@ -0,0 +1,107 @@
+"""Tests for overture_chatbot.arranger"""
+
+import asyncio
+import httpx
+import pytest
+import overture_chatbot.arranger
+
+
+def test_get_session():
+    """Test for overture_chatbot.arranger.get_session"""
+    session_1 = overture_chatbot.arranger.get_session('http://endpoint-1/graphql')
+    session_2 = overture_chatbot.arranger.get_session('http://endpoint-1/graphql')
+    session_3 = overture_chatbot.arranger.get_session('http://endpoint-2/graphql')
+
+    assert session_1 is session_2
+    assert session_1 is not session_3
+    assert session_1.get_adapter('https://endpoint-1')._pool_maxsize == (
+        overture_chatbot.arranger.settings.ARRANGER_POOL_MAXSIZE
+    )
+
+    overture_chatbot.arranger.close_sessions()
+    assert overture_chatbot.arranger.get_session('http://endpoint-1/graphql') is not session_1
+
+
+param_run_graphql = [
+    (
+        {'data': {'file': {'hits': {'total': 100}}}},
+        {'file': {'hits': {'total': 100}}}
+    )
+]
+
+@pytest.mark.parametrize(
+    'json_response_1, expected_result_1',
+    param_run_graphql
+)
+
+def test_run_graphql(json_response_1, expected_result_1, monkeypatch):
+    """Test for overture_chatbot.arranger.run_graphql"""
+    def mock_post_graphql(json_query, url):
+        return json_response_1
+    monkeypatch.setattr(overture_chatbot.arranger, 'post_graphql', mock_post_graphql)
+
+    actual_result = overture_chatbot.arranger.run_graphql('{file{hits{total}}}')
+
+    assert actual_result == expected_result_1
+
+
+def test_run_graphql_errors(monkeypatch):
+    """Test for overture_chatbot.arranger.run_graphql with GraphQL errors"""
+    def mock_post_graphql(json_query, url):
+        return {'errors': [{'message': 'Cannot query field'}]}
+    monkeypatch.setattr(overture_chatbot.arranger, 'post_graphql', mock_post_graphql)
+
+    with pytest.raises(overture_chatbot.arranger.ArrangerQueryError):
+        overture_chatbot.arranger.run_graphql('{file{hits{total}}}')
+
+
+def test_arun_graphql(monkeypatch):
+    """Test for overture_chatbot.arranger.arun_graphql"""
+    async def mock_apost_graphql(json_query, url):
+        return {'data': {'file': {'hits': {'total': 100}}}}
+    monkeypatch.setattr(overture_chatbot.arranger, 'apost_graphql', mock_apost_graphql)
+
+    actual_result = asyncio.run(overture_chatbot.arranger.arun_graphql('{file{hits{total}}}'))
+
+    assert actual_result == {'file': {'hits': {'total': 100}}}
+
+
+def test_get_async_client():
+    """Test for overture_chatbot.arranger.get_async_client"""
+    async def get_clients():
+        client_1 = overture_chatbot.arranger.get_async_client('http://endpoint-1/graphql')
+        client_2 = overture_chatbot.arranger.get_async_client('http://endpoint-1/graphql')
+        await overture_chatbot.arranger.aclose_clients()
+        return client_1, client_2
+
+    client_1, client_2 = asyncio.run(get_clients())
+
+    assert client_1 is client_2
+    assert client_1.is_closed
+
+
+param_decode_response = [
+    # GraphQL errors come with a JSON body
+    (400, b'{"errors": [{"message": "Syntax Error"}]}', None),
+    (502, b'<html>502 Bad Gateway</html>', httpx.HTTPStatusError),
+    (200, b'<html>Maintenance</html>', overture_chatbot.arranger.ArrangerQueryError)
+]
+
+@pytest.mark.parametrize(
+    'status_code_2, content_2, expected_error_2',
+    param_decode_response
+)
+
+def test_decode_response(status_code_2, content_2, expected_error_2):
+    """Test for overture_chatbot.arranger.decode_response"""
+    response = httpx.Response(
+        status_code_2, content=content_2, request=httpx.Request('POST', 'http://arranger/graphql')
+    )
+
+    if expected_error_2 is None:
+        assert overture_chatbot.arranger.decode_response(response) == {
+            'errors': [{'message': 'Syntax Error'}]
+        }
+    else:
+        with pytest.raises(expected_error_2):
+            overture_chatbot.arranger.decode_response(response)
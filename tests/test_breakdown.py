@@ -0,0 +1,106 @@
+"""Tests for overture_chatbot.breakdown"""
+
+import json
+import pytest
+import overture_chatbot.breakdown
+
+param_breakdown_keywords = [
+    ('How many samples per province', ['province']),
+    ('How many samples does each province have', ['province']),
+    ('How many samples in each province', ['province']),
+    ('Show the distribution of lineages among men', ['lineages']),
+    ('How many males vs females', ['males', 'females']),
+    ('Samples in Nova Scotia versus Alberta', ['Nova Scotia', 'Alberta']),
+    # 'by' alone filters on a value
+    ('Find the number of samples collected by Nova Scotia Health Authority', []),
+    # 'across' and bare 'each' introduce filters
+    ('How many samples were collected across Canada', []),
+    ('How many samples were collected across Nova Scotia', []),
+    ('Find the number of samples where each host is male', []),
+    ('Find the number of males', [])
+]
+
+@pytest.mark.parametrize(
+    'question_1, expected_keywords_1',
+    param_breakdown_keywords
+)
+
+def test_breakdown_keywords(question_1, expected_keywords_1):
+    """Test for overture_chatbot.breakdown.breakdown_keywords"""
+    actual_result = overture_chatbot.breakdown.breakdown_keywords(question_1)
+
+    assert actual_result == expected_keywords_1
+    assert overture_chatbot.breakdown.is_breakdown_question(question_1) == bool(expected_keywords_1)
+
+
+SQONS = [
+    json.dumps({'properties': {
+        'fieldName': {'const': 'analysis.first_published_at', 'description': 'analysis first published at'},
+        'value': {'type': 'integer'}
+    }}),
+    json.dumps({'properties': {
+        'fieldName': {'const': 'analysis.host.host_gender', 'description': 'analysis host host gender'},
+        'value': {'type': 'array', 'items': {'enum': ['Female', 'Male', 'Not Provided']}}
+    }}),
+    json.dumps({'properties': {
+        'fieldName': {
+            'const': 'analysis.sample_collection.geo_loc_province',
+            'description': 'analysis sample collection geo loc province'
+        },
+        'value': {'type': 'array', 'items': {'enum': ['Alberta', 'Nova Scotia']}}
+    }})
+]
+
+param_select_breakdown_field = [
+    (['province'], 'analysis.sample_collection.geo_loc_province'),
+    (['males', 'females'], 'analysis.host.host_gender'),
+    (['Nova Scotia', 'Alberta'], 'analysis.sample_collection.geo_loc_province')
+]
+
+@pytest.mark.parametrize(
+    'keywords_2, expected_field_2',
+    param_select_breakdown_field
+)
+
+def test_select_breakdown_field(keywords_2, expected_field_2):
+    """Test for overture_chatbot.breakdown.select_breakdown_field"""
+    actual_result = overture_chatbot.breakdown.select_breakdown_field(keywords_2, SQONS)
+
+    assert actual_result == expected_field_2
+
+
+def test_select_breakdown_field_missing():
+    """Test for overture_chatbot.breakdown.select_breakdown_field without a matching field"""
+    with pytest.raises(overture_chatbot.breakdown.BreakdownError):
+        overture_chatbot.breakdown.select_breakdown_field(['lineage'], SQONS)
+    # a value following a group-by word is a filter, not a field
+    with pytest.raises(overture_chatbot.breakdown.BreakdownError):
+        overture_chatbot.breakdown.select_breakdown_field(['Nova Scotia'], SQONS, match_values=False)
+
+
+def test_aggregation_graphql():
+    """Test for overture_chatbot.breakdown.aggregation_graphql"""
+    actual_result = overture_chatbot.breakdown.aggregation_graphql(
+        'analysis.host.host_gender', '{content: [], op: "and"}'
+    )
+    actual_result_unfiltered = overture_chatbot.breakdown.aggregation_graphql(
+        'analysis.host.host_gender'
+    )
+
+    assert actual_result == (
+        'query{file{aggregations(filters:{content: [], op: "and"}, aggregations_filter_themselves:true, '
+        'include_missing:true){analysis__host__host_gender{buckets{key doc_count}}}}}'
+    )
+    assert actual_result_unfiltered == (
+        'query{file{aggregations(aggregations_filter_themselves:true, include_missing:true)'
+        '{analysis__host__host_gender{buckets{key doc_count}}}}}'
+    )
+
+
+def test_format_breakdown():
+    """Test for overture_chatbot.breakdown.format_breakdown"""
+    actual_result = overture_chatbot.breakdown.format_breakdown(
+        {'Female': 90, '__missing__': 5, 'Male': 100}
+    )
+
+    assert actual_result == 'Male: 100\nFemale: 90\nNo value: 5'
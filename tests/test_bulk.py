@@ -0,0 +1,107 @@
+"""Tests for overture_chatbot.bulk"""
+
+import pytest
+import requests
+from langchain_core.runnables import RunnableLambda
+import overture_chatbot.bulk
+import overture_chatbot.caching
+
+param_read_questions = [
+    (
+        ['{"id": "males", "question": "Find the number of males"}', '', '{"query": "Count females"}'],
+        [
+            {'id': 'males', 'question': 'Find the number of males'},
+            {'id': 3, 'question': 'Count females'}
+        ]
+    ),
+    ([], [])
+]
+
+@pytest.mark.parametrize(
+    'lines_1, expected_questions_1',
+    param_read_questions
+)
+
+def test_read_questions(lines_1, expected_questions_1):
+    """Test for overture_chatbot.bulk.read_questions"""
+    actual_result = list(overture_chatbot.bulk.read_questions(lines_1))
+
+    assert actual_result == expected_questions_1
+
+
+def test_read_questions_invalid():
+    """Test for overture_chatbot.bulk.read_questions with lines without a question"""
+    with pytest.raises(ValueError, match='Line 2'):
+        list(overture_chatbot.bulk.read_questions(['{"question": "males"}', '["males"]']))
+    with pytest.raises(ValueError, match='Line 1'):
+        list(overture_chatbot.bulk.read_questions(['{"id": 1}']))
+
+
+def test_answer_questions(monkeypatch):
+    """Test for overture_chatbot.bulk.answer_questions"""
+    query_graphql = overture_chatbot.bulk.query_graphql
+    sqons = {
+        'Find the number of males': "{'op': 'and', 'content': [{'op': 'in', 'content': "
+        "{'fieldName': 'analysis.host.host_gender', 'value': ['Male']}}]}",
+        'Find the number of females': "{'op': 'and', 'content': [{'op': 'in', 'content': "
+        "{'fieldName': 'analysis.host.host_gender', 'value': ['Female']}}]}"
+    }
+    graphql_queries = []
+
+    def generate(query):
+        if query['query'] not in sqons:
+            raise ValueError('no SQON')
+        return sqons[query['query']]
+
+    def mock_post_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        return {'data': {
+            f'q{i}': {'hits': {'total': 100 + i}} for i in range(graphql_query.count('file{'))
+        }}
+    monkeypatch.setattr(query_graphql, 'create_cached_sqon_schema', lambda: RunnableLambda(generate))
+    monkeypatch.setattr(query_graphql, 'post_graphql', mock_post_graphql)
+    monkeypatch.setattr(query_graphql, 'result_cache', overture_chatbot.caching.TTLCache(16, 1024**2, 60))
+    questions = [
+        {'id': 1, 'question': 'Find the number of males'},
+        {'id': 2, 'question': 'Find the number of unicorns'},
+        {'id': 3, 'question': 'Find the number of females'},
+        {'id': 4, 'question': 'Find the number of males'}
+    ]
+
+    actual_result = list(overture_chatbot.bulk.answer_questions(questions, batch_size=3))
+
+    assert [result['id'] for result in actual_result] == [1, 2, 3, 4]
+    assert [result['total'] for result in actual_result] == [100, None, 101, 100]
+    assert actual_result[1]['error'] == 'ValueError: no SQON'
+    assert 'arranger' in actual_result[0]['seconds']
+    # one request for the first batch, none for the cached filters of the second
+    assert len(graphql_queries) == 1
+
+
+def test_answer_questions_request_error(monkeypatch):
+    """Test for overture_chatbot.bulk.answer_questions when an Arranger request fails"""
+    query_graphql = overture_chatbot.bulk.query_graphql
+    sqon = (
+        "{'op': 'and', 'content': [{'op': 'in', 'content': "
+        "{'fieldName': 'analysis.host.host_gender', 'value': ['%s']}}]}"
+    )
+    graphql_queries = []
+
+    def mock_post_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        if len(graphql_queries) == 1:
+            raise requests.Timeout('read timed out')
+        return {'data': {'q0': {'hits': {'total': 100}}}}
+    monkeypatch.setattr(
+        query_graphql, 'create_cached_sqon_schema',
+        lambda: RunnableLambda(lambda query: sqon % query['query'])
+    )
+    monkeypatch.setattr(query_graphql, 'post_graphql', mock_post_graphql)
+    monkeypatch.setattr(query_graphql, 'result_cache', overture_chatbot.caching.TTLCache(16, 1024**2, 60))
+    questions = [{'id': 1, 'question': 'Male'}, {'id': 2, 'question': 'Female'}]
+
+    actual_result = list(overture_chatbot.bulk.answer_questions(questions, batch_size=1))
+
+    assert [result['total'] for result in actual_result] == [None, 100]
+    assert actual_result[0]['error'] == 'Timeout: read timed out'
+    assert actual_result[1]['error'] is None
@@ -0,0 +1,189 @@
+"""Tests for overture_chatbot.caching"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import overture_chatbot.caching
+
+
+def test_ttl_cache():
+    """Test for overture_chatbot.caching.TTLCache"""
+    cache = overture_chatbot.caching.TTLCache(max_entries=2, max_bytes=1000, ttl=60)
+
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    # 'b' is the least recently used entry
+    cache.set('c', '3')
+
+    assert cache.get('b') is overture_chatbot.caching.MISSING
+    assert cache.get('c', None) == '3'
+    assert cache.stats() == {
+        'entries': 2, 'bytes': 4, 'hits': 2, 'misses': 1, 'evictions': 1, 'expirations': 0
+    }
+
+
+def test_ttl_cache_max_bytes():
+    """Test for overture_chatbot.caching.TTLCache byte bound"""
+    cache = overture_chatbot.caching.TTLCache(max_entries=10, max_bytes=10, ttl=60)
+
+    cache.set('a', '1234')
+    cache.set('b', '1234')
+    # larger than the cache
+    cache.set('c', '12345678901')
+    # evicts 'a' to make room
+    cache.set('d', '12')
+
+    assert len(cache) == 2
+    assert cache.bytes == 8
+    assert cache.get('a') is overture_chatbot.caching.MISSING
+    assert cache.get('c') is overture_chatbot.caching.MISSING
+
+
+def test_ttl_cache_expiry(monkeypatch):
+    """Test for overture_chatbot.caching.TTLCache expiry"""
+    now = [0.0]
+    monkeypatch.setattr(overture_chatbot.caching.time, 'monotonic', lambda: now[0])
+    cache = overture_chatbot.caching.TTLCache(max_entries=10, max_bytes=1000, ttl=5)
+
+    cache.set('a', '1')
+    now[0] = 10.0
+
+    assert cache.get('a') is overture_chatbot.caching.MISSING
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+
+def test_ttl_cache_disabled():
+    """Test for overture_chatbot.caching.TTLCache with no entries allowed"""
+    cache = overture_chatbot.caching.TTLCache(max_entries=0, max_bytes=1000, ttl=60)
+
+    cache.set('a', '1')
+
+    assert cache.get('a') is overture_chatbot.caching.MISSING
+
+
+def test_semantic_cache():
+    """Test for overture_chatbot.caching.SemanticCache"""
+    cache = overture_chatbot.caching.SemanticCache(max_entries=2, threshold=0.9, ttl=60)
+
+    cache.add('how many males', [1.0, 0.0, 0.0], 'sqon_male', latency=2.0)
+    cache.add('how many females', [0.0, 1.0, 0.0], 'sqon_female', latency=3.0)
+
+    assert cache.lookup([0.99, 0.05, 0.0]) == 'sqon_male'
+    assert cache.lookup([0.5, 0.5, 0.0]) is None
+    # 'how many females' is the least recently used entry
+    cache.add('how many in Ontario', [0.0, 0.0, 1.0], 'sqon_ontario', latency=1.0)
+    assert cache.lookup([0.0, 1.0, 0.0]) is None
+    assert cache.lookup([0.0, 0.0, 2.0]) == 'sqon_ontario'
+
+    stats = cache.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 1
+    assert stats['latency_saved'] == 3.0
+
+
+def test_semantic_cache_expired():
+    """Test for overture_chatbot.caching.SemanticCache with an expired best match"""
+    cache = overture_chatbot.caching.SemanticCache(max_entries=2, threshold=0.9, ttl=-1)
+    cache.add('how many males', [1.0, 0.0], 'sqon_expired', latency=2.0)
+    cache.ttl = 60
+    cache.add('how many male hosts', [0.95, 0.3], 'sqon_live', latency=3.0)
+
+    actual_result = cache.lookup([1.0, 0.0])
+
+    assert actual_result == 'sqon_live'
+    assert len(cache) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_semantic_cache_literals():
+    """Test for overture_chatbot.caching.SemanticCache with the literals of the questions"""
+    cache = overture_chatbot.caching.SemanticCache(max_entries=2, threshold=0.9, ttl=60)
+
+    cache.add('published after 2020', [1.0, 0.0], 'sqon_2020', latency=2.0, literals=('2020',))
+
+    assert cache.lookup([1.0, 0.0], literals=('2021',)) is None
+    assert cache.lookup([1.0, 0.0], literals=('2020',)) == 'sqon_2020'
+
+
+def test_semantic_cache_version():
+    """Test for overture_chatbot.caching.SemanticCache invalidation"""
+    cache = overture_chatbot.caching.SemanticCache(max_entries=2, threshold=0.9, ttl=60)
+
+    cache.add('how many males', [1.0, 0.0], 'sqon_male', latency=2.0, version='1')
+
+    assert cache.lookup([1.0, 0.0], version='1') == 'sqon_male'
+    assert cache.lookup([1.0, 0.0], version='2') is None
+    assert len(cache) == 0
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_single_flight():
+    """Test for overture_chatbot.caching.SingleFlight.do with concurrent threads"""
+    flight = overture_chatbot.caching.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flight.do, 'a', compute, 1)
+        started.wait(5)
+        followers = [executor.submit(flight.do, 'a', compute, 1) for _ in range(3)]
+        # the followers are waiting for the leader
+        while flight.stats()['coalesced'] < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in [leader, *followers]]
+
+    assert results == [2, 2, 2, 2]
+    assert calls == [1]
+    assert flight.stats() == {'calls': 4, 'coalesced': 3, 'in_flight': 0}
+    # completed calls are not reused
+    assert flight.do('a', compute, 2) == 4
+
+
+param_single_flight_async = [
+    (True, 1, 4),
+    (False, 5, 0)
+]
+
+@pytest.mark.parametrize(
+    'enabled_1, expected_calls_1, expected_coalesced_1',
+    param_single_flight_async
+)
+
+def test_single_flight_async(enabled_1, expected_calls_1, expected_coalesced_1):
+    """Test for overture_chatbot.caching.SingleFlight.ado with concurrent coroutines"""
+    flight = overture_chatbot.caching.SingleFlight(enabled=enabled_1)
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        await asyncio.sleep(0.05)
+        if value < 0:
+            raise ValueError(value)
+        return value * 2
+
+    async def run():
+        results = await asyncio.gather(*[flight.ado('a', compute, 1) for _ in range(5)])
+        errors = await asyncio.gather(
+            *[flight.ado('b', compute, -1) for _ in range(2)], return_exceptions=True
+        )
+        return results, errors
+
+    results, errors = asyncio.run(run())
+
+    assert results == [2] * 5
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert calls.count(1) == expected_calls_1
+    assert flight.coalesced == expected_coalesced_1 + (1 if enabled_1 else 0)
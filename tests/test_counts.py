@@ -0,0 +1,150 @@
+"""Tests for overture_chatbot.counts"""
+
+import os
+import re
+import time
+import pytest
+import overture_chatbot.counts
+
+# 'host_gender' has one value per record, 'lineage' several
+BUCKETS = {
+    'analysis__host__host_gender': {'Female': 60, 'Male': 30, '__missing__': 10},
+    'analysis__lineage': {'A': 80, 'B': 50}
+}
+URL = 'http://arranger/graphql'
+
+
+def in_sqon(field, values):
+    return {'op': 'in', 'content': {'fieldName': field, 'value': values}}
+
+
+def local_counts(tmp_path, **kwargs):
+    """LocalCounts of BUCKETS written to tmp_path"""
+    path = str(tmp_path / 'counts.sqlite')
+    overture_chatbot.counts.write_counts(BUCKETS, 100, path, URL)
+    return overture_chatbot.counts.LocalCounts(path, **{'max_age': 60, 'url': URL, **kwargs})
+
+
+param_field_values = [
+    (in_sqon('a', ['X']), ('a', ['X'])),
+    ({'op': 'and', 'content': [in_sqon('a', ['X', 'Y'])]}, ('a', ['X', 'Y'])),
+    ({'op': 'or', 'content': [in_sqon('a', ['X']), in_sqon('a', ['Y'])]}, ('a', ['X', 'Y'])),
+    ({'op': 'and', 'content': [{'op': 'or', 'content': [in_sqon('a', ['X'])]}]}, ('a', ['X'])),
+    ({'op': 'or', 'content': [in_sqon('a', ['X']), in_sqon('b', ['Y'])]}, None),
+    ({'op': 'and', 'content': [in_sqon('a', ['X']), in_sqon('a', ['Y'])]}, None),
+    ({'op': 'not', 'content': [in_sqon('a', ['X'])]}, None),
+    ({'op': '>=', 'content': {'fieldName': 'a', 'value': 2020}}, None),
+    (in_sqon('a', [2020]), None),
+    ({'op': 'and', 'content': []}, None)
+]
+
+@pytest.mark.parametrize(
+    'sqon_1, expected_result_1',
+    param_field_values
+)
+
+def test_field_values(sqon_1, expected_result_1):
+    """Test for overture_chatbot.counts.field_values"""
+    actual_result = overture_chatbot.counts.field_values(sqon_1)
+
+    assert actual_result == expected_result_1
+
+
+param_local_counts_total = [
+    (in_sqon('analysis.host.host_gender', ['Male']), 30),
+    (in_sqon('analysis.host.host_gender', ['Female', 'Male']), 90),
+    (in_sqon('analysis.host.host_gender', ['__missing__']), 10),
+    ({'op': 'or', 'content': [
+        in_sqon('analysis.host.host_gender', ['Male']), in_sqon('analysis.host.host_gender', ['Male'])
+    ]}, 30),
+    # a value without records is not a bucket of the field
+    (in_sqon('analysis.host.host_gender', ['Unknown']), 0),
+    ({'op': 'and', 'content': []}, 100),
+    (in_sqon('analysis.lineage', ['A']), 80),
+    # records of several values are counted once by Arranger
+    (in_sqon('analysis.lineage', ['A', 'B']), None),
+    (in_sqon('analysis.lineage', ['C']), None),
+    (in_sqon('analysis.unknown', ['A']), None),
+    ({'op': 'and', 'content': [
+        in_sqon('analysis.host.host_gender', ['Male']), in_sqon('analysis.lineage', ['A'])
+    ]}, None)
+]
+
+@pytest.mark.parametrize(
+    'sqon_2, expected_total_2',
+    param_local_counts_total
+)
+
+def test_local_counts_total(tmp_path, sqon_2, expected_total_2):
+    """Test for overture_chatbot.counts.LocalCounts.total"""
+    counts = local_counts(tmp_path)
+
+    actual_result = counts.total(sqon_2)
+
+    assert actual_result == expected_total_2
+
+
+def test_local_counts_unusable(tmp_path):
+    """Test for overture_chatbot.counts.LocalCounts with disabled, stale, missing or foreign counts"""
+    sqon = in_sqon('analysis.host.host_gender', ['Male'])
+    counts = local_counts(tmp_path)
+
+    assert local_counts(tmp_path, enabled=False).total(sqon) is None
+    assert local_counts(tmp_path, url='http://other/graphql').total(sqon) is None
+    assert overture_chatbot.counts.LocalCounts(str(tmp_path / 'missing.sqlite')).total(sqon) is None
+
+    assert counts.total(sqon) == 30
+    counts.max_age = 1e-6
+    assert counts.total(sqon) is None
+    assert counts.total(sqon, check_age=False) == 30
+    assert counts.stats()['stale']
+
+
+def test_local_counts_reload(tmp_path):
+    """Test for overture_chatbot.counts.LocalCounts reloading refreshed counts"""
+    sqon = in_sqon('analysis.host.host_gender', ['Male'])
+    counts = local_counts(tmp_path)
+    total_1 = counts.total(sqon)
+
+    overture_chatbot.counts.write_counts(
+        {'analysis__host__host_gender': {'Female': 60, 'Male': 40}}, 100, counts.path, URL
+    )
+    # the modification time may not change within the resolution of the file system
+    os.utime(counts.path, ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+    total_2 = counts.total(sqon)
+
+    assert (total_1, total_2) == (30, 40)
+    assert counts.stats()['fields'] == 1
+    assert counts.stats()['hits'] == 2
+
+
+def test_check_counts(monkeypatch, tmp_path):
+    """Test for overture_chatbot.counts.check_counts"""
+    counts = local_counts(tmp_path, max_age=1e-6)
+    # Arranger has one more record of every lineage
+    live_buckets = {
+        'analysis.host.host_gender': BUCKETS['analysis__host__host_gender'],
+        'analysis.lineage': {'A': 81, 'B': 51}
+    }
+    graphql_queries = []
+
+    def mock_run_graphql(graphql_query, url):
+        graphql_queries.append(graphql_query)
+        data = {}
+        for alias, filters in re.findall(r'(c\d+): file\{hits(.*?)\{total\}\}', graphql_query):
+            field = re.search(r'fieldName: "(.*?)", value: \[(.*?)\]', filters)
+            total = sum(
+                live_buckets[field.group(1)][value] for value in re.findall(r'"(.*?)"', field.group(2))
+            ) if field else 100
+            data[alias] = {'hits': {'total': total}}
+        return data
+    monkeypatch.setattr(overture_chatbot.counts, 'run_graphql', mock_run_graphql)
+
+    report = overture_chatbot.counts.check_counts(counts, sample_size=2)
+
+    assert len(graphql_queries) == 1
+    assert report['checked'] == 3
+    assert len(report['mismatches']) == 1
+    mismatch = report['mismatches'][0]
+    assert 'analysis.lineage' in mismatch['sqon_filters']
+    assert mismatch['live'] == mismatch['local'] + 1
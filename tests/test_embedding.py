@@ -0,0 +1,115 @@
+"""Tests for overture_chatbot.embedding"""
+
+import numpy as np
+import pytest
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+import overture_chatbot.embedding
+
+VOCABULARY = {'<pad>': 0, '<s>': 1, '</s>': 2, '<unk>': 3, 'male': 4, 'female': 5, 'ontario': 6}
+
+
+class MockInput:
+    """Mock of an input of onnxruntime.InferenceSession"""
+    def __init__(self, name):
+        self.name = name
+
+
+class MockSession:
+    """Mock of onnxruntime.InferenceSession returning one-hot token embeddings"""
+    def get_inputs(self):
+        return [MockInput('input_ids'), MockInput('attention_mask')]
+
+    def run(self, output_names, inputs):
+        token_embeddings = np.eye(len(VOCABULARY), dtype=np.float32)[inputs['input_ids']]
+        # padding tokens are not masked by the transformer
+        token_embeddings[inputs['attention_mask'] == 0] = 100.0
+        return [token_embeddings]
+
+
+def create_tokenizer() -> Tokenizer:
+    tokenizer = Tokenizer(models.WordLevel(VOCABULARY, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single='<s> $A </s>', special_tokens=[('<s>', 1), ('</s>', 2)]
+    )
+    return tokenizer
+
+
+def create_embeddings(pooling_mode='mean', normalize=False, max_seq_length=8):
+    config = {
+        'pooling_mode': pooling_mode, 'normalize': normalize, 'max_seq_length': max_seq_length,
+        'pad_token': '<pad>', 'pad_token_id': 0
+    }
+    return overture_chatbot.embedding.OnnxEmbeddings(
+        MockSession(), create_tokenizer(), config, batch_size=2
+    )
+
+
+param_onnx_embeddings = [
+    ('mean', False, 8, 'male', [0, 1/3, 1/3, 0, 1/3, 0, 0]),
+    ('mean', True, 8, 'male', [0, 3**-0.5, 3**-0.5, 0, 3**-0.5, 0, 0]),
+    ('cls', False, 8, 'female', [0, 1, 0, 0, 0, 0, 0]),
+    # truncated to '<s> male </s>'
+    ('mean', False, 3, 'male\nfemale ontario', [0, 1/3, 1/3, 0, 1/3, 0, 0])
+]
+
+@pytest.mark.parametrize(
+    'pooling_mode_1, normalize_1, max_seq_length_1, text_1, expected_result_1',
+    param_onnx_embeddings
+)
+
+def test_onnx_embeddings(pooling_mode_1, normalize_1, max_seq_length_1, text_1, expected_result_1):
+    """Test for overture_chatbot.embedding.OnnxEmbeddings"""
+    embeddings = create_embeddings(pooling_mode_1, normalize_1, max_seq_length_1)
+
+    actual_result = embeddings.embed_query(text_1)
+    # padded to the longest text of the batch
+    actual_result_batch = embeddings.embed_documents(['female ontario male', text_1, 'male'])
+
+    assert np.allclose(actual_result, expected_result_1)
+    assert np.allclose(actual_result_batch[1], expected_result_1)
+    assert len(actual_result_batch) == 3
+
+
+class MockEmbeddings:
+    """Mock of an embedding model embedding texts by their first letters"""
+    def __init__(self, noise=0.0):
+        self.noise = noise
+
+    def embed_documents(self, texts):
+        rng = np.random.default_rng(0)
+        return [
+            [ord(text[0]) - ord('a'), ord(text[-1]) - ord('a')] + rng.normal(scale=self.noise, size=2)
+            for text in texts
+        ]
+
+
+param_retrieval_overlap = [
+    (0.0, 1.0),
+    (100.0, None)
+]
+
+@pytest.mark.parametrize(
+    'noise_1, expected_result_1',
+    param_retrieval_overlap
+)
+
+def test_retrieval_overlap(noise_1, expected_result_1):
+    """Test for overture_chatbot.embedding.retrieval_overlap"""
+    texts = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'theta']
+    queries = ['alpha', 'zeta', 'beta']
+
+    actual_result = overture_chatbot.embedding.retrieval_overlap(
+        MockEmbeddings(), MockEmbeddings(noise_1), texts, queries, k=3
+    )
+
+    if expected_result_1 is None:
+        assert actual_result < 1.0
+    else:
+        assert actual_result == expected_result_1
+
+
+def test_load_embeddings_unknown_backend():
+    """Test for overture_chatbot.embedding.load_embeddings with an unknown backend"""
+    with pytest.raises(ValueError):
+        overture_chatbot.embedding.load_embeddings('tensorflow')
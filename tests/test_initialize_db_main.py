@@ -1,6 +1,8 @@
 """Tests for initialize_db.main"""
 
+import ast
 import pytest
+from langchain_core.documents import Document
 import initialize_db.main
 
 param_create_value_object_schema = [
@@ -104,6 +106,24 @@ param_create_value_object_schema = [
             ]
         )
     ),
+    # quotes and non-ASCII characters in enums
+    (
+        'analysis__sample_collection__sample_collected_by',
+        'Aggregations',
+        None,
+        ['5" swab', 'Québec'],
+        (
+            (
+                '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+                '"analysis.sample_collection.sample_collected_by", "type": "string", '
+                '"description": "analysis sample collection sample collected by"}, "value": '
+                '{"type": "array", "items": {"enum": ["5\\" swab", "Québec"'
+                '], "type": "string"}, "minItems": 1}}}'
+            ),
+            'analysis sample collection sample collected by',
+            ['5" swab', 'Québec']
+        )
+    ),
     # test NumericalAggregations fieldtype
     (
         'analysis__host__host_gender',
@@ -143,3 +163,285 @@ def test_create_value_object_schema(
     )
 
     assert actual_result == expected_result_1
+
+
+def mock_call_graphql_api(json_queries):
+    """Mock of initialize_db.main.call_graphql_api failing on 'bad' fields"""
+    def call_graphql_api(json_query):
+        json_queries.append(json_query)
+        if json_query == 'query{file{hits{total}}}':
+            return {'data': {'file': {'hits': {'total': 5}}}}
+        fieldnames = json_query.split('{', 3)[3].replace('{buckets{key doc_count}}', '').rstrip('}').split()
+        if any(fieldname.startswith('bad') for fieldname in fieldnames):
+            return {'errors': [{'message': 'Cannot query field "buckets"'}], 'data': None}
+        return {'data': {'file': {'aggregations': {
+            fieldname: {'buckets': [{'key': 'Female', 'doc_count': 3}, {'key': 'Male', 'doc_count': 2}]}
+            for fieldname in fieldnames
+        }}}}
+    return call_graphql_api
+
+
+def test_get_batch_buckets(monkeypatch):
+    """Test for initialize_db.main.get_batch_buckets"""
+    json_queries = []
+    monkeypatch.setattr(initialize_db.main, 'call_graphql_api', mock_call_graphql_api(json_queries))
+
+    actual_result = initialize_db.main.get_batch_buckets(['a', 'bad', 'c', 'd'])
+
+    assert actual_result == {
+        'a': {'Female': 3, 'Male': 2}, 'c': {'Female': 3, 'Male': 2}, 'd': {'Female': 3, 'Male': 2}
+    }
+    # whole batch, then halves, then quarters of the failing half
+    assert len(json_queries) == 5
+
+
+def test_get_all_buckets(monkeypatch):
+    """Test for initialize_db.main.get_all_buckets"""
+    json_queries = []
+    monkeypatch.setattr(initialize_db.main, 'call_graphql_api', mock_call_graphql_api(json_queries))
+    fieldinfos = [
+        {'fieldname': f'field_{i}', 'fieldtype': 'Aggregations'} for i in range(5)
+    ] + [{'fieldname': 'bad_numerical', 'fieldtype': 'NumericalAggregations'}]
+
+    actual_result = initialize_db.main.get_all_buckets(fieldinfos, batch_size=2, max_workers=2)
+
+    assert sorted(actual_result) == [f'field_{i}' for i in range(5)]
+    assert len(json_queries) == 4
+
+
+def test_refresh_counts(monkeypatch, tmp_path):
+    """Test for initialize_db.main.refresh_counts"""
+    json_queries = []
+    monkeypatch.setattr(initialize_db.main, 'call_graphql_api', mock_call_graphql_api(json_queries))
+    path = str(tmp_path / 'counts.sqlite')
+    buckets = initialize_db.main.get_batch_buckets(['analysis__host__host_gender'])
+
+    actual_result = initialize_db.main.refresh_counts(buckets, path)
+
+    assert actual_result == {'fields': 1, 'complete_fields': 1, 'values': 2}
+    snapshot = initialize_db.main.counts.read_counts(path)
+    assert snapshot.counts == {'analysis.host.host_gender': {'Female': 3, 'Male': 2}}
+    assert snapshot.total == 5
+
+
+class StopSchedule(Exception):
+    """Raised by the mocked time.sleep to stop schedule_counts"""
+
+
+def test_schedule_counts(monkeypatch, tmp_path):
+    """Test for initialize_db.main.schedule_counts"""
+    path = tmp_path / 'counts.sqlite'
+    calls = []
+
+    def mock_sleep(seconds):
+        calls.append(('sleep', seconds))
+        if len(calls) >= 3:
+            raise StopSchedule
+    def mock_refresh_counts(path):
+        calls.append(('refresh', path))
+        raise ValueError('Arranger is down')
+    monkeypatch.setattr(initialize_db.main.time, 'sleep', mock_sleep)
+    monkeypatch.setattr(initialize_db.main, 'refresh_counts', mock_refresh_counts)
+
+    # missing counts are refreshed right away, failures wait for the next interval
+    with pytest.raises(StopSchedule):
+        initialize_db.main.schedule_counts(60, str(path))
+    calls_missing = list(calls)
+    # fresh counts (e.g. written at startup) are refreshed once they are an interval old
+    path.write_bytes(b'')
+    calls.clear()
+    with pytest.raises(StopSchedule):
+        initialize_db.main.schedule_counts(60, str(path))
+
+    assert calls_missing == [('refresh', str(path)), ('sleep', 60), ('refresh', str(path)), ('sleep', 60)]
+    assert calls[0][0] == 'sleep' and 59 < calls[0][1] <= 60
+    assert calls[1] == ('refresh', str(path))
+
+
+def test_main_counts_missing(monkeypatch, tmp_path):
+    """Test that main only writes the local counts when the collection exists without them"""
+    refreshed = []
+    pulled = []
+
+    class MockClient:
+        def __init__(self, host):
+            self.host = host
+
+        def pull(self, model):
+            pulled.append((self.host, model))
+    def mock_get_fieldinfos():
+        raise AssertionError('the vector database is initialized again')
+    monkeypatch.setattr(initialize_db.main, 'Client', MockClient)
+    monkeypatch.setattr(initialize_db.main.vector_index, 'collection_exists', lambda name: True)
+    monkeypatch.setattr(initialize_db.main.settings, 'LOCAL_COUNTS_PATH', str(tmp_path / 'counts.sqlite'))
+    monkeypatch.setattr(initialize_db.main, 'refresh_counts', lambda: refreshed.append(True))
+    monkeypatch.setattr(initialize_db.main, 'get_fieldinfos', mock_get_fieldinfos)
+    monkeypatch.setattr(initialize_db.main.settings, 'OLLAMA_URL', 'http://ollama:11434')
+    monkeypatch.setattr(initialize_db.main.settings, 'OLLAMA_MODEL', 'llama3.1')
+
+    initialize_db.main.main()
+
+    assert refreshed == [True]
+    # the model served by the chatbot is pulled
+    assert pulled == [('http://ollama:11434', 'llama3.1')]
+
+
+def test_create_documents():
+    """Test for initialize_db.main.create_documents"""
+    fieldinfos = [
+        {'fieldname': 'analysis__host__host_gender', 'fieldtype': 'Aggregations'},
+        {'fieldname': 'analysis__first_published_at', 'fieldtype': 'NumericalAggregations'}
+    ]
+    buckets = {'analysis__host__host_gender': ['Female', 'Male'], 'analysis__first_published_at': []}
+
+    documents_1 = initialize_db.main.create_documents(fieldinfos, buckets)
+    documents_2 = initialize_db.main.create_documents(fieldinfos, buckets)
+    buckets['analysis__host__host_gender'].append('Unknown')
+    documents_3 = initialize_db.main.create_documents(fieldinfos, buckets)
+
+    assert list(documents_1) == [
+        'analysis__host__host_gender:description',
+        'analysis__host__host_gender:enums:0',
+        'analysis__first_published_at:description'
+    ]
+    assert documents_1 == documents_2
+    assert documents_3['analysis__host__host_gender:enums:0'].metadata['fingerprint'] != (
+        documents_1['analysis__host__host_gender:enums:0'].metadata['fingerprint']
+    )
+    assert documents_3['analysis__first_published_at:description'] == (
+        documents_1['analysis__first_published_at:description']
+    )
+
+
+param_chunk_enums = [
+    (['Female', 'Male'], 1000, [['Female', 'Male']]),
+    (['Female', 'Male'], 18, [['Female', 'Male']]),
+    (['Female', 'Male'], 17, [['Female'], ['Male']]),
+    (['a' * 20, 'b'], 10, [['a' * 20], ['b']]),
+    ([], 1000, [])
+]
+
+@pytest.mark.parametrize(
+    'enums_list_1, chunk_chars_1, expected_result_1',
+    param_chunk_enums
+)
+
+def test_chunk_enums(enums_list_1, chunk_chars_1, expected_result_1):
+    """Test for initialize_db.main.chunk_enums"""
+    actual_result = initialize_db.main.chunk_enums(enums_list_1, chunk_chars_1)
+
+    assert actual_result == expected_result_1
+    for chunk in actual_result:
+        assert len(repr(chunk)) <= chunk_chars_1 or len(chunk) == 1
+
+
+def test_create_documents_chunks():
+    """Test for initialize_db.main.create_documents with long enumerations"""
+    fieldinfos = [{'fieldname': 'a', 'fieldtype': 'Aggregations'}]
+    enums_list = [f'value {i}' for i in range(100)]
+
+    documents = initialize_db.main.create_documents(fieldinfos, {'a': enums_list}, chunk_chars=100)
+
+    chunks = [document for doc_id, document in documents.items() if doc_id.startswith('a:enums:')]
+    assert len(chunks) > 1
+    assert all(len(document.page_content) <= 100 for document in chunks)
+    assert [enum for document in chunks for enum in ast.literal_eval(document.page_content)] == enums_list
+    assert len({document.metadata['schema'] for document in documents.values()}) == 1
+
+
+class MockVectorStore:
+    """Mock of a collection and embeddings of the vector database storing documents in a dictionary"""
+    def __init__(self, documents):
+        self.documents = dict(documents)
+        self.embedded = []
+        self.embedded_texts = []
+        self.metadata = {'version': '1'}
+
+    def get(self, include):
+        return {
+            'ids': list(self.documents),
+            'metadatas': [document.metadata for document in self.documents.values()]
+        }
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        self.embedded.extend(ids)
+        self.documents.update(
+            (doc_id, Document(page_content=page_content, metadata=metadata))
+            for doc_id, page_content, metadata in zip(ids, documents, metadatas)
+        )
+
+    def embed_documents(self, texts):
+        self.embedded_texts.extend(texts)
+        return [[0.0] for _ in texts]
+
+    def delete(self, ids):
+        for doc_id in ids:
+            del self.documents[doc_id]
+
+    def modify(self, metadata):
+        self.metadata = metadata
+
+
+def test_sync_documents():
+    """Test for initialize_db.main.sync_documents"""
+    fieldinfos = [
+        {'fieldname': 'a', 'fieldtype': 'Aggregations'},
+        {'fieldname': 'b', 'fieldtype': 'NumericalAggregations'}
+    ]
+    stored = initialize_db.main.create_documents(fieldinfos, {'a': ['X'], 'b': []})
+    vector_store = MockVectorStore(stored)
+    fieldinfos.append({'fieldname': 'c', 'fieldtype': 'NumericalAggregations'})
+    documents = initialize_db.main.create_documents(fieldinfos, {'a': ['X', 'Y'], 'c': []})
+
+    report = initialize_db.main.sync_documents(vector_store, vector_store, documents)
+
+    assert {key: report[key] for key in ('added', 'updated', 'deleted', 'unchanged')} == {
+        'added': 1, 'updated': 2, 'deleted': 1, 'unchanged': 0
+    }
+    assert vector_store.documents == documents
+    assert vector_store.metadata['version'] != '1'
+
+
+def test_sync_documents_unchanged():
+    """Test for initialize_db.main.sync_documents without changes"""
+    fieldinfos = [{'fieldname': 'a', 'fieldtype': 'Aggregations'}]
+    documents = initialize_db.main.create_documents(fieldinfos, {'a': ['X']})
+    vector_store = MockVectorStore(documents)
+
+    report = initialize_db.main.sync_documents(vector_store, vector_store, documents)
+
+    assert report['unchanged'] == 2
+    assert report['embedding_seconds_saved'] == 0.0
+    assert vector_store.embedded == []
+    assert vector_store.embedded_texts == []
+    assert vector_store.metadata == {'version': '1'}
+
+
+def test_ingest_documents():
+    """Test for initialize_db.main.ingest_documents"""
+    fieldinfos = [{'fieldname': f'field_{i}', 'fieldtype': 'Aggregations'} for i in range(5)]
+    documents = initialize_db.main.create_documents(
+        fieldinfos, {f'field_{i}': ['X'] for i in range(5)}
+    )
+    vector_store = MockVectorStore({})
+
+    report = initialize_db.main.ingest_documents(vector_store, vector_store, documents, batch_size=3, processes=1)
+
+    assert report['documents'] == 10
+    assert report['peak_rss_mb'] > 0
+    assert vector_store.embedded == list(documents)
+    assert vector_store.documents == documents
+
+
+def test_ingest_documents_custom_embeddings():
+    """Test that initialize_db.main.ingest_documents without a backend embeds with the given model"""
+    fieldinfos = [{'fieldname': f'field_{i}', 'fieldtype': 'Aggregations'} for i in range(5)]
+    documents = initialize_db.main.create_documents(
+        fieldinfos, {f'field_{i}': ['X'] for i in range(5)}
+    )
+    vector_store = MockVectorStore({})
+
+    initialize_db.main.ingest_documents(vector_store, vector_store, documents, batch_size=3, processes=4)
+
+    assert vector_store.embedded_texts == [document.page_content for document in documents.values()]
+    assert vector_store.documents == documents
@@ -0,0 +1,114 @@
+"""Tests for overture_chatbot.instrumentation"""
+
+import asyncio
+import pytest
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk, LLMResult
+from langchain_core.runnables import RunnableLambda
+import overture_chatbot.instrumentation
+import overture_chatbot.query_graphql
+
+STAGES = ('keywords', 'total', 'summarize_answer')
+
+
+class CountingLLM(LLM):
+    """Fake LLM reporting its token counts like Ollama"""
+    answer: str
+
+    @property
+    def _llm_type(self) -> str:
+        return 'counting'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return self.answer
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        # like OllamaLLM, the generation aggregates the streamed chunks
+        chunks = list(self._stream(prompts[0]))
+        return LLMResult(generations=[[sum(chunks[1:], chunks[0])]])
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        tokens = self.answer.split(' ')
+        for i, token in enumerate(tokens):
+            chunk = GenerationChunk(
+                text=token + ' ',
+                generation_info={
+                    'prompt_eval_count': len(prompt.split(' ')), 'eval_count': len(tokens)
+                } if i == len(tokens) - 1 else None
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def retrieve(query):
+    overture_chatbot.instrumentation.record_retrieval(3, 0.01)
+    return 'males'
+
+
+def count(keywords):
+    overture_chatbot.instrumentation.record_arranger(0.5)
+    overture_chatbot.instrumentation.record_arranger(0.0, cached=True)
+    return '100'
+
+
+def create_chain():
+    return (
+        RunnableLambda(retrieve).with_config(run_name='keywords')
+        | RunnableLambda(count).with_config(run_name='total')
+        | CountingLLM(answer='There are 100 males').with_config(run_name='summarize_answer')
+    )
+
+
+param_trace_query = [
+    (True, 'invoke'),
+    (True, 'astream'),
+    (False, 'invoke')
+]
+
+@pytest.mark.parametrize(
+    'enabled_1, method_1',
+    param_trace_query
+)
+
+def test_trace_query(enabled_1, method_1):
+    """Test for overture_chatbot.instrumentation.trace_query"""
+    chain = create_chain()
+
+    with overture_chatbot.instrumentation.trace_query('males', STAGES, enabled_1) as query_trace:
+        config = {'callbacks': [query_trace.callback]} if query_trace else None
+        if method_1 == 'invoke':
+            chain.invoke('males', config)
+        else:
+            async def collect():
+                return [chunk async for chunk in chain.astream('males', config)]
+            asyncio.run(collect())
+
+    if not enabled_1:
+        assert query_trace is None
+        return
+    assert set(query_trace.seconds) == set(STAGES)
+    assert query_trace.tokens['summarize_answer'] == {'in': 1, 'out': 4}
+    assert 'keywords' not in query_trace.tokens
+    assert query_trace.retrieved_documents == 3
+    assert query_trace.arranger_seconds == 0.5
+    assert query_trace.arranger_cached == 1
+    assert '| summarize_answer |' in query_trace.summary()
+
+
+def test_astream_query_total_summary_timings(monkeypatch):
+    """Test for overture_chatbot.query_graphql.astream_query_total_summary with settings.SHOW_TIMINGS"""
+    query_graphql = overture_chatbot.query_graphql
+    monkeypatch.setattr(query_graphql, 'get_query_total_summary_chain', create_chain)
+    monkeypatch.setattr(overture_chatbot.instrumentation.settings, 'INSTRUMENTATION', True)
+    monkeypatch.setattr(query_graphql.settings, 'SHOW_TIMINGS', True)
+
+    async def collect():
+        return [output async for output in query_graphql.astream_query_total_summary('males')]
+
+    actual_result = asyncio.run(collect())
+
+    assert actual_result[0] == (query_graphql.KEYWORDS_STEP, 'males')
+    assert actual_result[-1][0] == query_graphql.TIMINGS_STEP
+    assert '| keywords |' in actual_result[-1][1]
+    assert sum(step == query_graphql.ANSWER_STEP for step, _ in actual_result) == 4
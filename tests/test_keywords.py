@@ -0,0 +1,94 @@
+"""Tests for overture_chatbot.keywords"""
+
+import pytest
+import overture_chatbot.keywords
+
+SCHEMAS = [
+    '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+    '"analysis.host.host_gender", "type": "string", "description": '
+    '"analysis host host gender"}, "value": {"type": "array", "items": {"enum": '
+    '["Female", "Male", "Not Provided"], "type": "string"}, "minItems": 1}}}',
+    '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+    '"analysis.sample_collection.sample_collected_by", "type": "string", "description": '
+    '"analysis sample collection sample collected by"}, "value": {"type": "array", '
+    '"items": {"enum": ["Nova Scotia Health Authority", '
+    '"Newfoundland and Labrador - Eastern Health"], "type": "string"}, "minItems": 1}}}',
+    '{"type": "object", "required": ["value"], "properties": {"fieldName": {"const": '
+    '"analysis.first_published_at", "type": "string", "description": '
+    '"analysis first published at"}, "value": {"type": "integer"}}}'
+]
+
+param_match = [
+    ('Find the number of males in Nova Scotia', ['males', 'Nova Scotia']),
+    ('Find the number of samples in Labrador not collected from men', ['Labrador', 'men']),
+    ('Count the samples collected by Nova Scotia Health Authority', ['Nova Scotia Health Authority']),
+    ('Get all samples published after 1640926800000', ['published']),
+    # misspelled
+    ('How many samples in Labrdor', ['labrador']),
+    ('How many records are there in total', [])
+]
+
+@pytest.mark.parametrize(
+    'question_1, expected_keywords_1',
+    param_match
+)
+
+def test_keyword_index_match(question_1, expected_keywords_1):
+    """Test for overture_chatbot.keywords.KeywordIndex.match"""
+    index = overture_chatbot.keywords.KeywordIndex.from_schemas(SCHEMAS)
+
+    actual_result = index.match(question_1)
+
+    assert actual_result == expected_keywords_1
+
+
+param_normalize_word = [
+    ('Males', 'male'),
+    ('men', 'male'),
+    ('Labrador', 'labrador'),
+    ('sex', 'sex'),
+    ('class', 'class')
+]
+
+@pytest.mark.parametrize(
+    'word_2, expected_word_2',
+    param_normalize_word
+)
+
+def test_normalize_word(word_2, expected_word_2):
+    """Test for overture_chatbot.keywords.normalize_word"""
+    actual_result = overture_chatbot.keywords.normalize_word(word_2)
+
+    assert actual_result == expected_word_2
+
+
+ENUMS = [
+    'Alberta Precision Laboratories', 'BC Centre for Disease Control', 'Eastern Health',
+    'Newfoundland and Labrador - Eastern Health', 'Nova Scotia Health Authority',
+    'Nova Scotia', 'Ontario Health', 'Public Health Ontario', 'Saskatchewan Health Authority'
+]
+
+param_enum_index_select = [
+    (['Nova Scotia'], 2, ['Nova Scotia Health Authority', 'Nova Scotia']),
+    # exact matches are kept beyond the cap
+    (['Nova Scotia', 'Eastern Health'], 1, ['Eastern Health', 'Nova Scotia']),
+    (['Ontario'], 5, ['Ontario Health', 'Public Health Ontario']),
+    # misspelled
+    (['Saskatchewn'], 1, ['Saskatchewan Health Authority']),
+    # nothing matches: the first enumerations are kept
+    (['males'], 2, ['Alberta Precision Laboratories', 'BC Centre for Disease Control']),
+    (['Ontario'], 20, ENUMS)
+]
+
+@pytest.mark.parametrize(
+    'keywords_3, max_enums_3, expected_enums_3',
+    param_enum_index_select
+)
+
+def test_enum_index_select(keywords_3, max_enums_3, expected_enums_3):
+    """Test for overture_chatbot.keywords.EnumIndex.select"""
+    index = overture_chatbot.keywords.EnumIndex(ENUMS)
+
+    actual_result = index.select(keywords_3, max_enums_3)
+
+    assert actual_result == expected_enums_3
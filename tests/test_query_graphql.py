@@ -1,6 +1,19 @@
 """Tests for overture_chatbot.query_graphql"""
 
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
 import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.runnables import RunnableLambda
+import overture_chatbot.caching
+import overture_chatbot.counts
+import overture_chatbot.keywords
 import overture_chatbot.query_graphql
 
 param_query_total_chain = [
@@ -36,7 +49,10 @@ def test_create_sqon_schema():
     chain = overture_chatbot.query_graphql.create_sqon_schema()
     actual_result = chain.invoke({'query': query})
 
-    assert actual_result == expected_create_sqon_schema
+    # quotes depend on settings.SQON_OUTPUT_FORMAT
+    assert overture_chatbot.query_graphql.parse_sqon(actual_result) == (
+        overture_chatbot.query_graphql.parse_sqon(expected_create_sqon_schema)
+    )
 
 
 def test_get_keyword_chain():
@@ -54,53 +70,28 @@ param_format_sqon_schema = [
     (
         [],
         (
-            '{{"type": "object", "required": ["content", "op"], "properties": {{"content": '
-            '{{"type": "array", "items": {{"oneOf": [{{"$ref": "#/$defs/FieldOperations"}}, '
-            '{{"$ref": "#"}}]}}, "minItems": 1}}, "op": {{"default": "and", '
-            '"enum": ["and", "or", "not"], "type": "string"}}}}, "$defs": '
-            '{{"FieldOperations": {{"type": "object", "required": ["content", "op"], '
-            '"properties": {{"content": {{"type": "array", "items": {{"oneOf": ['
-            ''
-            ']}}, "maxItems": 1, "minItems": 1}}, "op": {{"default": "in", '
-            '"enum": ["in", "<=", ">="], "type": "string"}}}}}}, '
-            ''
-            '}}}}}'
+            '{"type": "object", "required": ["content", "op"], "properties": {"content": '
+            '{"type": "array", "items": {"oneOf": [{"$ref": "#/$defs/FieldOperations"}, '
+            '{"$ref": "#"}]}, "minItems": 1}, "op": {"default": "and", '
+            '"enum": ["and", "or", "not"], "type": "string"}}, "$defs": '
+            '{"FieldOperations": {"type": "object", "required": ["content", "op"], '
+            '"properties": {"content": {"oneOf": []}, "op": {"default": "in", '
+            '"enum": ["in", "<=", ">="], "type": "string"}}}}}'
         )
     ),
+    # SQONs are sorted and deduplicated
     (
-        ['A'],
+        ['{"b": "Nova Scotia"}', '{"a": 1}', '{"b": "Nova Scotia"}'],
         (
-            '{{"type": "object", "required": ["content", "op"], "properties": {{"content": '
-            '{{"type": "array", "items": {{"oneOf": [{{"$ref": "#/$defs/FieldOperations"}}, '
-            '{{"$ref": "#"}}]}}, "minItems": 1}}, "op": {{"default": "and", '
-            '"enum": ["and", "or", "not"], "type": "string"}}}}, "$defs": '
-            '{{"FieldOperations": {{"type": "object", "required": ["content", "op"], '
-            '"properties": {{"content": {{"type": "array", "items": {{"oneOf": ['
-            """{{"$ref": "#/$defs/Value""" + str(0) + """"}}"""
-            ']}}, "maxItems": 1, "minItems": 1}}, "op": {{"default": "in", '
-            '"enum": ["in", "<=", ">="], "type": "string"}}}}}}, '
-            """"Value""" + str(0) + '": ' + 'A'
-            '}}}}}'
-        )
-    ),
-    (
-        ['A', 'B', 'C'],
-        (
-            '{{"type": "object", "required": ["content", "op"], "properties": {{"content": '
-            '{{"type": "array", "items": {{"oneOf": [{{"$ref": "#/$defs/FieldOperations"}}, '
-            '{{"$ref": "#"}}]}}, "minItems": 1}}, "op": {{"default": "and", '
-            '"enum": ["and", "or", "not"], "type": "string"}}}}, "$defs": '
-            '{{"FieldOperations": {{"type": "object", "required": ["content", "op"], '
-            '"properties": {{"content": {{"type": "array", "items": {{"oneOf": ['
-            """{{"$ref": "#/$defs/Value""" + str(0) + """"}}""" + ', '
-            """{{"$ref": "#/$defs/Value""" + str(1) + """"}}""" + ', '
-            """{{"$ref": "#/$defs/Value""" + str(2) + """"}}"""
-            ']}}, "maxItems": 1, "minItems": 1}}, "op": {{"default": "in", '
-            '"enum": ["in", "<=", ">="], "type": "string"}}}}}}, '
-            """"Value""" + str(0) + '": ' + 'A' + ', '
-            """"Value""" + str(1) + '": ' + 'B' + ', '
-            """"Value""" + str(2) + '": ' + 'C'
-            '}}}}}'
+            '{"type": "object", "required": ["content", "op"], "properties": {"content": '
+            '{"type": "array", "items": {"oneOf": [{"$ref": "#/$defs/FieldOperations"}, '
+            '{"$ref": "#"}]}, "minItems": 1}, "op": {"default": "and", '
+            '"enum": ["and", "or", "not"], "type": "string"}}, "$defs": '
+            '{"FieldOperations": {"type": "object", "required": ["content", "op"], '
+            '"properties": {"content": {"oneOf": [{"$ref": "#/$defs/Value0"}, '
+            '{"$ref": "#/$defs/Value1"}]}, "op": {"default": "in", '
+            '"enum": ["in", "<=", ">="], "type": "string"}}}, '
+            '"Value0": {"a": 1}, "Value1": {"b": "Nova Scotia"}}}'
         )
     ),
 ]
@@ -117,6 +108,17 @@ def test_format_sqons_schema(
     actual_result = overture_chatbot.query_graphql.format_sqons_schema(sqons_2)
 
     assert actual_result == expected_sqons_schema_2
+    assert json.loads(actual_result)
+
+
+def test_format_sqons_schema_memoized():
+    """Test that overture_chatbot.query_graphql.format_sqons_schema reuses schemas"""
+    sqons = ['{"a": 1}', '{"b": 2}']
+
+    schema_1 = overture_chatbot.query_graphql.format_sqons_schema(sqons)
+    schema_2 = overture_chatbot.query_graphql.format_sqons_schema(sqons[::-1])
+
+    assert schema_1 is schema_2
 
 
 param_format_sqon_filters = [
@@ -126,7 +128,11 @@ param_format_sqon_filters = [
     ("te'st", 'te"st'),
     ('"fieldName"', 'fieldName'),
     (' "fieldName" ', ' fieldName '),
-    ('"fieldName", "value"', 'fieldName, value')
+    ('"fieldName", "value"', 'fieldName, value'),
+    (
+        " {'op': 'in', 'content': {'fieldName': 'a', 'value': ['Children\\'s']}}",
+        '{op: "in", content: {fieldName: "a", value: ["Children\'s"]}}'
+    )
 ]
 
 @pytest.mark.parametrize(
@@ -143,6 +149,85 @@ def test_format_sqon_filters(
     assert actual_result == expected_format_sqon_filters_3
 
 
+def test_sqon_json_schema():
+    """Test for overture_chatbot.query_graphql.sqon_json_schema"""
+    sqons = ['{"type": "object", "properties": {"fieldName": {"const": "a"}}}', '{"type": "object"}']
+
+    actual_result = overture_chatbot.query_graphql.sqon_json_schema(sqons)
+
+    assert actual_result['$defs']['Value0'] == {
+        'type': 'object', 'properties': {'fieldName': {'const': 'a'}}
+    }
+    assert actual_result['$defs']['FieldOperations']['properties']['content'] == {
+        'oneOf': [{'$ref': '#/$defs/Value0'}, {'$ref': '#/$defs/Value1'}]
+    }
+
+
+def test_validate_generated_sqon():
+    """Test for overture_chatbot.query_graphql.validate_generated_sqon"""
+    sqons = [
+        '{"type": "object", "properties": {"fieldName": {"const": "a"}, '
+        '"value": {"type": "array", "items": {"enum": ["X"]}}}}'
+    ]
+
+    overture_chatbot.query_graphql.validate_generated_sqon(
+        " {'op': 'and', 'content': [{'op': 'in', 'content': {'fieldName': 'a', 'value': ['X']}}]}",
+        sqons
+    )
+    with pytest.raises(overture_chatbot.query_graphql.SQONValidationError):
+        overture_chatbot.query_graphql.validate_generated_sqon("{'op': 'and'", sqons)
+
+
+def test_query_total_chain_invalid_sqon(monkeypatch):
+    """Test that query_total_chain returns SQON validation errors as a message"""
+    query_graphql = overture_chatbot.query_graphql
+
+    def generate_sqon(query):
+        raise query_graphql.SQONValidationError("$.content[0].fieldName 'host.sex' is not a known field")
+    monkeypatch.setattr(query_graphql, 'create_cached_sqon_schema', lambda: RunnableLambda(generate_sqon))
+    chain = query_graphql.query_total_chain()
+
+    actual_result = chain.invoke('Find the number of males')
+    actual_result_async = asyncio.run(chain.ainvoke('Find the number of males'))
+
+    assert actual_result.startswith('Generating SQON filters for the question raised the following error')
+    assert "'host.sex' is not a known field" in actual_result
+    assert actual_result_async == actual_result
+
+
+class ToolRecorder(BaseCallbackHandler):
+    """Callback handler recording the tools started"""
+
+    def __init__(self):
+        self.tools = []
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tools.append(kwargs.get('name') or serialized['name'])
+
+
+def test_query_total_chain_async_tool(monkeypatch):
+    """Test that query_total_chain.ainvoke calls the tool asynchronously with the callbacks"""
+    query_graphql = overture_chatbot.query_graphql
+    sqon = "{'op': 'and', 'content': [{'op': 'in', 'content': {'fieldName': 'a', 'value': ['X']}}]}"
+
+    def mock_query_graphql(sqon_filters):
+        raise AssertionError('the sync query runs in a thread')
+    async def mock_aquery_graphql(sqon_filters):
+        return '{"file": {"hits": {"total": 100}}}'
+    monkeypatch.setattr(query_graphql, 'create_cached_sqon_schema', lambda: RunnableLambda(lambda query: sqon))
+    monkeypatch.setattr(query_graphql, 'query_graphql', mock_query_graphql)
+    monkeypatch.setattr(query_graphql, 'aquery_graphql', mock_aquery_graphql)
+    recorder = ToolRecorder()
+    chain = query_graphql.query_total_chain()
+
+    actual_result = asyncio.run(
+        chain.ainvoke('Find the number of males', config={'callbacks': [recorder]})
+    )
+
+    assert actual_result == '100'
+    assert recorder.tools == ['get_total_graphql']
+
+
 def test_get_total_graphql(monkeypatch):
     """Test for overture_chatbot.query_graphql.get_total_graphql"""
     sqon_filters = ''
@@ -169,3 +254,524 @@ def test_query_graphql():
     actual_result = overture_chatbot.query_graphql.query_graphql(sqon_filter)
 
     assert actual_result == expected_query_graphql
+
+
+def test_query_graphql_cache(monkeypatch):
+    """Test for overture_chatbot.query_graphql.query_graphql result cache"""
+    graphql_queries = []
+
+    def mock_run_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        return {'file': {'hits': {'total': 100}}}
+    monkeypatch.setattr(overture_chatbot.query_graphql, 'run_graphql', mock_run_graphql)
+    overture_chatbot.query_graphql.result_cache.clear()
+
+    result_1 = overture_chatbot.query_graphql.query_graphql(
+        '{op: "and", content: [{op: "in", content: {fieldName: "a", value: ["X", "Y"]}}]}'
+    )
+    result_2 = overture_chatbot.query_graphql.query_graphql(
+        '{ op: "and", content: [{op: "in", content: {fieldName: "a", value: ["Y", "X"]}}]}'
+    )
+    # filters that can not be parsed are not cached
+    for _ in range(2):
+        overture_chatbot.query_graphql.query_graphql('{op: invalid')
+
+    assert result_1 == result_2
+    assert len(graphql_queries) == 3
+    assert graphql_queries[1:] == ['{file{hits(filters:{op: invalid){total}}}'] * 2
+
+
+def test_aquery_graphql_single_flight(monkeypatch):
+    """Test for overture_chatbot.query_graphql.aquery_graphql with concurrent identical SQONs"""
+    query_graphql = overture_chatbot.query_graphql
+    graphql_queries = []
+
+    async def mock_arun_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        await asyncio.sleep(0.05)
+        return {'file': {'hits': {'total': 100}}}
+    monkeypatch.setattr(query_graphql, 'arun_graphql', mock_arun_graphql)
+    monkeypatch.setattr(query_graphql, 'sqon_flight', overture_chatbot.caching.SingleFlight())
+    query_graphql.result_cache.clear()
+    sqons = [
+        '{op: "and", content: [{op: "in", content: {fieldName: "a", value: ["X", "Y"]}}]}',
+        '{ op: "and", content: [{op: "in", content: {fieldName: "a", value: ["Y", "X"]}}]}'
+    ] * 5
+
+    async def run():
+        return await asyncio.gather(*[query_graphql.aget_total_graphql(sqon) for sqon in sqons])
+
+    actual_result = asyncio.run(run())
+
+    assert actual_result == ['100'] * 10
+    assert len(graphql_queries) == 1
+    assert query_graphql.sqon_flight.stats() == {'calls': 10, 'coalesced': 9, 'in_flight': 0}
+
+
+def test_query_graphql_batch(monkeypatch):
+    """Test for overture_chatbot.query_graphql.query_graphql_batch"""
+    query_graphql = overture_chatbot.query_graphql
+    graphql_queries = []
+
+    def mock_post_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        if 'invalid' in graphql_query:
+            return {'errors': [{'message': 'Syntax Error'}]}
+        aliases = re.findall(r'(q\d+): file\{hits\(filters:(.*?)\)\{total\}\}', graphql_query)
+        return {
+            'errors': [
+                {'message': 'Unknown field', 'path': [alias]}
+                for alias, filters in aliases if 'unknown' in filters
+            ],
+            'data': {
+                alias: None if 'unknown' in filters else {'hits': {'total': 100}}
+                for alias, filters in aliases
+            }
+        }
+    monkeypatch.setattr(query_graphql, 'post_graphql', mock_post_graphql)
+    query_graphql.result_cache.clear()
+    sqons = [
+        '{op: "and", content: [{op: "in", content: {fieldName: "a", value: ["X", "Y"]}}]}',
+        '{op: "and", content: [{op: "in", content: {fieldName: "unknown", value: ["X"]}}]}',
+        '{ op: "and", content: [{op: "in", content: {fieldName: "a", value: ["Y", "X"]}}]}',
+        '{op: invalid'
+    ]
+
+    actual_result = query_graphql.query_graphql_batch(sqons)
+    actual_result_cached = query_graphql.query_graphql_batch(sqons[:1])
+    # filters that can not be parsed are not cached
+    query_graphql.query_graphql_batch(sqons[3:])
+
+    assert json.loads(actual_result[0]) == {'file': {'hits': {'total': 100}}}
+    assert actual_result[2] == actual_result[0]
+    assert isinstance(actual_result[1], query_graphql.ArrangerQueryError)
+    assert isinstance(actual_result[3], query_graphql.ArrangerQueryError)
+    assert actual_result_cached == actual_result[:1]
+    # identical filters are queried once; failed requests are split in two until
+    # the invalid filters are alone
+    assert graphql_queries[0].count('file{') == 3
+    assert len(graphql_queries) == 6
+    assert '{op: invalid' in graphql_queries[5]
+
+
+def test_query_graphql_local_counts(monkeypatch, tmp_path):
+    """Test for overture_chatbot.query_graphql.query_graphql with local counts"""
+    query_graphql = overture_chatbot.query_graphql
+    graphql_queries = []
+
+    def mock_run_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        return {'file': {'hits': {'total': 7}}}
+    monkeypatch.setattr(query_graphql, 'run_graphql', mock_run_graphql)
+    path = str(tmp_path / 'counts.sqlite')
+    overture_chatbot.counts.write_counts(
+        {'analysis__host__host_gender': {'Female': 60, 'Male': 40}}, 100, path, 'http://arranger'
+    )
+    monkeypatch.setattr(query_graphql, 'local_counts', overture_chatbot.counts.LocalCounts(
+        path, max_age=60, url='http://arranger'
+    ))
+    query_graphql.result_cache.clear()
+
+    result_1 = query_graphql.get_total_graphql.invoke(
+        '{op: "and", content: [{op: "in", content: '
+        '{fieldName: "analysis.host.host_gender", value: ["Male", "Female"]}}]}'
+    )
+    result_2 = query_graphql.get_total_graphql.invoke(
+        '{op: "and", content: [{op: "in", content: {fieldName: "analysis.host.host_gender", '
+        'value: ["Male"]}}, {op: "in", content: {fieldName: "a", value: ["X"]}}]}'
+    )
+
+    assert (result_1, result_2) == ('100', '7')
+    assert len(graphql_queries) == 1
+
+
+def test_query_chain_breakdown(monkeypatch):
+    """Test for overture_chatbot.query_graphql.query_chain with total and breakdown questions"""
+    query_graphql = overture_chatbot.query_graphql
+    graphql_queries = []
+    sqons = [
+        '{"properties": {"fieldName": {"const": "analysis.sample_collection.geo_loc_province", '
+        '"description": "analysis sample collection geo loc province"}, '
+        '"value": {"type": "array", "items": {"enum": ["Alberta", "Nova Scotia"]}}}}'
+    ]
+    sqon = (
+        "{'op': 'and', 'content': [{'op': 'in', 'content': {'fieldName': 'analysis.host.host_gender', "
+        "'value': ['Male']}}, {'op': 'in', 'content': {'fieldName': "
+        "'analysis.sample_collection.geo_loc_province', 'value': ['Alberta']}}]}"
+    )
+
+    def mock_run_graphql(graphql_query):
+        graphql_queries.append(graphql_query)
+        if 'aggregations' in graphql_query:
+            return {'file': {'aggregations': {'analysis__sample_collection__geo_loc_province': {
+                'buckets': [{'key': 'Alberta', 'doc_count': 10}, {'key': 'Nova Scotia', 'doc_count': 20}]
+            }}}}
+        return {'file': {'hits': {'total': 30}}}
+    monkeypatch.setattr(query_graphql, 'run_graphql', mock_run_graphql)
+    async def mock_aget_sqon_keyword(keyword_str):
+        return sqons
+    monkeypatch.setattr(query_graphql, 'get_sqon_keyword', lambda keyword_str: sqons)
+    monkeypatch.setattr(query_graphql, 'aget_sqon_keyword', mock_aget_sqon_keyword)
+    monkeypatch.setattr(query_graphql, 'create_cached_sqon_schema', lambda: RunnableLambda(lambda query: sqon))
+    monkeypatch.setattr(query_graphql, 'result_cache', overture_chatbot.caching.TTLCache(16, 1024**2, 60))
+    chain = query_graphql.query_chain()
+
+    actual_result = chain.invoke('How many samples per province were collected from men')
+    actual_result_total = chain.invoke({'query': 'Find the number of males in Alberta'})
+    actual_result_async = asyncio.run(
+        chain.ainvoke('How many samples for each province were collected from men?')
+    )
+    # no field matches 'lineage', the total is answered
+    actual_result_fallback = chain.invoke('How many samples per lineage were collected from men')
+
+    assert actual_result == 'Nova Scotia: 20\nAlberta: 10'
+    # same field and filters, answered from result_cache
+    assert actual_result_async == actual_result
+    assert actual_result_total == '30'
+    assert actual_result_fallback == '30'
+    # one aggregation query, filtered on the other fields only
+    assert 'analysis__sample_collection__geo_loc_province{buckets{key doc_count}}' in graphql_queries[0]
+    assert 'host_gender' in graphql_queries[0]
+    assert 'Alberta' not in graphql_queries[0]
+    assert len(graphql_queries) == 2
+
+
+def test_create_cached_sqon_schema_single_flight(monkeypatch):
+    """Test for overture_chatbot.query_graphql.create_cached_sqon_schema with concurrent identical questions"""
+    query_graphql = overture_chatbot.query_graphql
+    generated = []
+
+    async def generate(query):
+        generated.append(query)
+        await asyncio.sleep(0.05)
+        return '{"op": "and", "content": []}'
+    monkeypatch.setattr(
+        query_graphql, 'create_sqon_schema', lambda: RunnableLambda(lambda query: None, afunc=generate)
+    )
+    monkeypatch.setattr(query_graphql.semantic_cache, 'max_entries', 0)
+    monkeypatch.setattr(query_graphql, 'question_flight', overture_chatbot.caching.SingleFlight())
+    chain = query_graphql.create_cached_sqon_schema()
+    questions = ['Find the number of males', ' find the  number of MALES?', 'Find the number of females']
+
+    async def run():
+        return await asyncio.gather(*[chain.ainvoke({'query': question}) for question in questions * 4])
+
+    actual_result = asyncio.run(run())
+
+    assert len(actual_result) == 12
+    assert len(generated) == 2
+    assert query_graphql.question_flight.coalesced == 10
+
+
+def test_create_cached_sqon_schema_literals(monkeypatch):
+    """Test that near-identical questions with different numbers or values do not share a SQON"""
+    query_graphql = overture_chatbot.query_graphql
+    generated = []
+
+    def generate(query):
+        generated.append(query['query'])
+        return json.dumps({'question': query['query']})
+    class MockEmbeddings:
+        def embed_query(self, text):
+            # every question is as similar as can be
+            return [1.0, 0.0]
+    monkeypatch.setattr(query_graphql, 'create_sqon_schema', lambda: RunnableLambda(generate))
+    monkeypatch.setattr(query_graphql, 'get_embeddings', lambda: MockEmbeddings())
+    monkeypatch.setattr(query_graphql, 'get_collection_version', lambda: '1')
+    monkeypatch.setattr(
+        query_graphql, 'get_keyword_index',
+        lambda: overture_chatbot.keywords.KeywordIndex(['Male', 'Female', 'Alberta', 'Manitoba'])
+    )
+    monkeypatch.setattr(
+        query_graphql, 'semantic_cache', overture_chatbot.caching.SemanticCache(16, 0.97, 60)
+    )
+    chain = query_graphql.create_cached_sqon_schema()
+    questions = [
+        'Find the number of samples published after 2020',
+        'Find the number of samples published after 2021',
+        'Find the number of males in Alberta',
+        'Find the number of males in Manitoba',
+        # same literals, the SQON is reused
+        'Find the number of men in Alberta'
+    ]
+
+    actual_result = [chain.invoke({'query': question}) for question in questions]
+
+    assert generated == questions[:4]
+    assert len(set(actual_result[:4])) == 4
+    assert actual_result[4] == actual_result[2]
+
+
+class PromptRecordingLLM(LLM):
+    """Fake LLM recording its prompts"""
+    answer: str
+    prompts: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return 'prompt-recording'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        self.prompts.append(prompt)
+        return self.answer
+
+
+def test_create_sqon_schema_prompt_prefix(monkeypatch):
+    """Test that the SQON prompts of different questions share the instructions and examples"""
+    query_graphql = overture_chatbot.query_graphql
+    sqons = {
+        'Find the number of males': [
+            '{"type": "object", "properties": {"fieldName": {"const": "analysis.host.host_gender"}, '
+            '"value": {"type": "array", "items": {"enum": ["Female", "Male"]}}}}'
+        ],
+        'Find the number of samples published after 1640926800000': [
+            '{"type": "object", "properties": {"fieldName": {"const": "analysis.first_published_at"}, '
+            '"value": {"type": "integer"}}}'
+        ]
+    }
+    llm = PromptRecordingLLM(answer='{}')
+    monkeypatch.setattr(query_graphql, 'get_llm', lambda: llm)
+    monkeypatch.setattr(
+        query_graphql, 'get_keyword_chain', lambda: RunnableLambda(query_graphql.get_question)
+    )
+    monkeypatch.setattr(query_graphql, 'get_sqon_keyword', lambda question: sqons[question])
+    monkeypatch.setattr(query_graphql, 'validate_generated_sqon', lambda sqon_filters, sqons: None)
+    chain = query_graphql.create_sqon_schema()
+
+    for question in sqons:
+        chain.invoke({'query': question})
+
+    prefix = os.path.commonprefix(llm.prompts)
+    assert len(llm.prompts) == 2
+    assert 'Here are some examples' in prefix
+    # the composed schemas of the SQONs come after the instructions and examples
+    assert 'JSON schema:' in prefix
+    assert all(prompt.index(question) > prompt.index(sqon[0]) for prompt, (question, sqon) in zip(
+        llm.prompts, sqons.items()
+    ))
+
+
+def test_create_sqon_schema_pruned_enums(monkeypatch):
+    """Test that create_sqon_schema prunes the prompt, not the enumerations the SQON is validated against"""
+    query_graphql = overture_chatbot.query_graphql
+    enums = [f'Lineage B.1.{i}' for i in range(100)]
+    sqons = [json.dumps({'type': 'object', 'properties': {
+        'fieldName': {'const': 'analysis.lineage'},
+        'value': {'type': 'array', 'items': {'enum': enums, 'type': 'string'}}
+    }})]
+    sqon = json.dumps({'op': 'and', 'content': [
+        {'op': 'in', 'content': {'fieldName': 'analysis.lineage', 'value': ['Lineage B.1.99']}}
+    ]})
+    llm = PromptRecordingLLM(answer=sqon, prompts=[])
+    monkeypatch.setattr(query_graphql.settings, 'SQON_MAX_ENUMS', 5)
+    monkeypatch.setattr(query_graphql, 'get_llm', lambda: llm)
+    monkeypatch.setattr(
+        query_graphql, 'get_keyword_chain', lambda: RunnableLambda(lambda query: 'B.1.7')
+    )
+    monkeypatch.setattr(query_graphql, 'get_sqon_keyword', lambda keyword_str: sqons)
+    chain = query_graphql.create_sqon_schema()
+
+    actual_result = chain.invoke({'query': 'Find the number of samples of lineage B.1.99'})
+
+    assert actual_result == sqon
+    assert 'Lineage B.1.7"' in llm.prompts[0]
+    assert 'Lineage B.1.99' not in llm.prompts[0]
+
+param_get_ollama_options = [
+    ('1h', 4096, {'keep_alive': '1h', 'num_ctx': 4096}),
+    ('-1', 0, {'keep_alive': -1}),
+    ('300', 2048, {'keep_alive': 300, 'num_ctx': 2048})
+]
+
+@pytest.mark.parametrize(
+    'keep_alive_7, num_ctx_7, expected_options_7',
+    param_get_ollama_options
+)
+
+def test_get_ollama_options(monkeypatch, keep_alive_7, num_ctx_7, expected_options_7):
+    """Test for overture_chatbot.query_graphql.get_ollama_options"""
+    monkeypatch.setattr(overture_chatbot.query_graphql.settings, 'OLLAMA_KEEP_ALIVE', keep_alive_7)
+    monkeypatch.setattr(overture_chatbot.query_graphql.settings, 'OLLAMA_NUM_CTX', num_ctx_7)
+
+    actual_result = overture_chatbot.query_graphql.get_ollama_options()
+
+    assert actual_result == expected_options_7
+
+param_normalize_question = [
+    ('Find the number of males', 'find the number of males'),
+    ('  Find the  number of\nMales?! ', 'find the number of males')
+]
+
+@pytest.mark.parametrize(
+    'question_6, expected_question_6',
+    param_normalize_question
+)
+
+def test_normalize_question(question_6, expected_question_6):
+    """Test for overture_chatbot.query_graphql.normalize_question"""
+    actual_result = overture_chatbot.query_graphql.normalize_question(question_6)
+
+    assert actual_result == expected_question_6
+
+param_split_keywords = [
+    ('males, Nova Scotia', ['males', 'Nova Scotia']),
+    (' males ,, ', ['males']),
+    ('', [])
+]
+
+@pytest.mark.parametrize(
+    'keyword_str_5, expected_keywords_5',
+    param_split_keywords
+)
+
+def test_split_keywords(keyword_str_5, expected_keywords_5):
+    """Test for overture_chatbot.query_graphql.split_keywords"""
+    actual_result = overture_chatbot.query_graphql.split_keywords(keyword_str_5)
+
+    assert actual_result == expected_keywords_5
+
+
+def test_get_unique_sqons():
+    """Test for overture_chatbot.query_graphql.get_unique_sqons"""
+    results = {'metadatas': [
+        [{'schema': 'B'}, {'schema': 'A'}],
+        [{'schema': 'A'}, {'schema': 'C'}]
+    ]}
+
+    actual_result = overture_chatbot.query_graphql.get_unique_sqons(results)
+
+    assert actual_result == ['B', 'A', 'C']
+
+
+class WordStreamingLLM(LLM):
+    """Fake LLM streaming its answer one word at a time"""
+    answer: str
+
+    @property
+    def _llm_type(self) -> str:
+        return 'word-streaming'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return self.answer
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for token in self.answer.split(' '):
+            chunk = GenerationChunk(text=token + ' ')
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def test_astream_query_total_summary(monkeypatch):
+    """Test for overture_chatbot.query_graphql.astream_query_total_summary"""
+    query_graphql = overture_chatbot.query_graphql
+    chain = (
+        RunnableLambda(lambda query: 'males').with_config(run_name=query_graphql.KEYWORDS_STEP)
+        | RunnableLambda(lambda keywords: '100').with_config(run_name=query_graphql.TOTAL_STEP)
+        | WordStreamingLLM(answer='100 males').with_config(
+            run_name=query_graphql.ANSWER_STEP
+        )
+    )
+    monkeypatch.setattr(query_graphql, 'get_query_total_summary_chain', lambda: chain)
+
+    async def collect():
+        return [
+            output async for output in query_graphql.astream_query_total_summary('males')
+        ]
+
+    actual_result = asyncio.run(collect())
+
+    assert actual_result[:2] == [
+        (query_graphql.KEYWORDS_STEP, 'males'), (query_graphql.TOTAL_STEP, '100')
+    ]
+    assert all(step == query_graphql.ANSWER_STEP for step, _ in actual_result[2:])
+    assert [token for _, token in actual_result[2:]] == ['100 ', 'males ']
+
+
+def test_prune_sqon_enums():
+    """Test for overture_chatbot.query_graphql.prune_sqon_enums"""
+    enums = [f'Lineage B.1.{i}' for i in range(100)] + ['Nova Scotia Health Authority']
+    sqons = [
+        json.dumps({'properties': {
+            'fieldName': {'const': 'analysis.lineage'},
+            'value': {'type': 'array', 'items': {'enum': enums, 'type': 'string'}, 'minItems': 1}
+        }}),
+        '{"properties": {"fieldName": {"const": "analysis.first_published_at"}, '
+        '"value": {"type": "integer"}}}'
+    ]
+
+    actual_result = overture_chatbot.query_graphql.prune_sqon_enums(
+        sqons, ['Nova Scotia Health Authority', 'B.1.7'], max_enums=5
+    )
+    actual_result_all = overture_chatbot.query_graphql.prune_sqon_enums(
+        sqons, ['B.1.7'], max_enums=0
+    )
+
+    pruned_enums = json.loads(actual_result[0])['properties']['value']['items']['enum']
+    assert len(pruned_enums) == 5
+    assert 'Nova Scotia Health Authority' in pruned_enums
+    assert 'Lineage B.1.7' in pruned_enums
+    assert json.loads(actual_result[0])['properties']['value']['minItems'] == 1
+    assert actual_result[1] == sqons[1]
+    assert actual_result_all == sqons
+
+param_get_question = [
+    ('Find the number of males', 'Find the number of males'),
+    ({'query': 'Find the number of males'}, 'Find the number of males')
+]
+
+@pytest.mark.parametrize(
+    'query_4, expected_question_4',
+    param_get_question
+)
+
+def test_get_question(query_4, expected_question_4):
+    """Test for overture_chatbot.query_graphql.get_question"""
+    actual_result = overture_chatbot.query_graphql.get_question(query_4)
+
+    assert actual_result == expected_question_4
+
+
+def test_get_query_total_chain(monkeypatch):
+    """Test that get_query_total_chain creates the chain once for all messages
+
+    Creating the chain for every message was the previous behaviour of app.py.
+    """
+    query_graphql = overture_chatbot.query_graphql
+    created = []
+
+    def mock_query_total_chain():
+        created.append(RunnableLambda(lambda query: '100'))
+        return created[-1]
+    monkeypatch.setattr(query_graphql, 'query_total_chain', mock_query_total_chain)
+    query_graphql.get_query_total_chain.cache_clear()
+
+    chains = [query_graphql.get_query_total_chain() for _ in range(20)]
+    # the shared chain must not be the mock in other tests
+    query_graphql.get_query_total_chain.cache_clear()
+
+    assert len(created) == 1
+    assert all(chain is created[0] for chain in chains)
+
+
+def test_import_time():
+    """Test for the modules imported by overture_chatbot.query_graphql (python -X importtime)
+
+    The import must not load models or connect to services, which are 
+    unreachable here, nor import their client libraries.
+    """
+    env = dict(os.environ, CHROMA_HOST='unreachable.invalid', OLLAMA_URL='http://unreachable.invalid')
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import overture_chatbot.query_graphql'],
+        capture_output=True, text=True, env=env, check=True
+    )
+
+    # lines of -X importtime: 'import time: self [us] | cumulative | imported package'
+    imports = {line.split('|')[-1].strip() for line in process.stderr.splitlines()[1:]}
+
+    assert 'overture_chatbot.query_graphql' in imports
+    for module in (
+        'chromadb', 'langchain_ollama', 'langchain_huggingface', 'langchain_chroma',
+        'sentence_transformers', 'torch'
+    ):
+        assert module not in imports
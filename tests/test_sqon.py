@@ -0,0 +1,179 @@
+"""Tests for overture_chatbot.sqon"""
+
+import pytest
+import overture_chatbot.sqon
+
+param_parse_sqon = [
+    # output of the LLM (Python-style quotes)
+    (
+        "{'op': 'and', 'content': [{'op': 'in', 'content': "
+        "{'fieldName': 'analysis.host.host_gender', 'value': ['Male']}}]}",
+        {'op': 'and', 'content': [{'op': 'in', 'content': {
+            'fieldName': 'analysis.host.host_gender', 'value': ['Male']
+        }}]}
+    ),
+    # output of format_sqon_filters
+    (
+        '{op: "and", content: [{op: ">=", content: '
+        '{fieldName: "analysis.first_published_at", value: 1640926800000}}]}',
+        {'op': 'and', 'content': [{'op': '>=', 'content': {
+            'fieldName': 'analysis.first_published_at', 'value': 1640926800000
+        }}]}
+    ),
+    # escaped quotes
+    (
+        """{'value': ['Children\\'s Hospital', "5\\" swab"]}""",
+        {'value': ["Children's Hospital", '5" swab']}
+    )
+]
+
+@pytest.mark.parametrize(
+    'sqon_filters_1, expected_result_1',
+    param_parse_sqon
+)
+
+def test_parse_sqon(sqon_filters_1, expected_result_1):
+    """Test for overture_chatbot.sqon.parse_sqon"""
+    actual_result = overture_chatbot.sqon.parse_sqon(sqon_filters_1)
+
+    assert actual_result == expected_result_1
+
+
+@pytest.mark.parametrize(
+    'sqon_filters_2',
+    ['', '{op: "and"', '{op: "and"}}', '["Male"]', '{op: "and" content: @}']
+)
+
+def test_parse_sqon_invalid(sqon_filters_2):
+    """Test for overture_chatbot.sqon.parse_sqon with invalid filters"""
+    with pytest.raises(ValueError):
+        overture_chatbot.sqon.parse_sqon(sqon_filters_2)
+
+
+param_canonical_sqon_filters = [
+    (
+        '{op: "and", content: [{op: "in", content: {fieldName: "b", value: ["Male"]}}, '
+        '{op: "in", content: {fieldName: "a", value: ["Y", "X", "Y"]}}]}',
+        "{'content': [{'content': {'value': ['X', 'Y'], 'fieldName': 'a'}, 'op': 'in'}, "
+        "{'op': 'in', 'content': {'fieldName': 'b', 'value': ['Male']}}], 'op': 'and'}"
+    ),
+    (
+        '{op: "and", content: [{op: "in", content: {fieldName: "a", value: ["X"]}}, '
+        '{op: "in", content: {fieldName: "a", value: ["X"]}}]}',
+        '{  "op" : "and",  "content" : [{"op": "in", "content": {"fieldName": "a", "value": ["X"]}}]}'
+    )
+]
+
+@pytest.mark.parametrize(
+    'sqon_filters_3, equivalent_sqon_filters_3',
+    param_canonical_sqon_filters
+)
+
+def test_canonical_sqon_filters(sqon_filters_3, equivalent_sqon_filters_3):
+    """Test for overture_chatbot.sqon.canonical_sqon_filters"""
+    actual_result = overture_chatbot.sqon.canonical_sqon_filters(sqon_filters_3)
+    equivalent_result = overture_chatbot.sqon.canonical_sqon_filters(equivalent_sqon_filters_3)
+
+    assert actual_result == equivalent_result
+
+
+def test_canonical_sqon_filters_order():
+    """Test that overture_chatbot.sqon.canonical_sqon_filters keeps the order of 'not'"""
+    sqon_filters = '{op: "not", content: [{op: "in", content: {fieldName: "b"}}, {op: "in"}]}'
+
+    actual_result = overture_chatbot.sqon.canonical_sqon_filters(sqon_filters)
+
+    assert actual_result == '{content: [{content: {fieldName: "b"}, op: "in"}, {op: "in"}], op: "not"}'
+
+
+VALUE_OBJECTS = [
+    {'type': 'object', 'required': ['value'], 'properties': {
+        'fieldName': {'const': 'analysis.host.host_gender', 'type': 'string'},
+        'value': {'type': 'array', 'items': {'enum': ['Female', 'Male'], 'type': 'string'}}
+    }},
+    {'type': 'object', 'required': ['value'], 'properties': {
+        'fieldName': {'const': 'analysis.first_published_at', 'type': 'string'},
+        'value': {'type': 'integer'}
+    }}
+]
+
+def test_validate_sqon():
+    """Test for overture_chatbot.sqon.validate_sqon with valid filters"""
+    sqon = {'op': 'and', 'content': [
+        {'op': 'in', 'content': {'fieldName': 'analysis.host.host_gender', 'value': ['Male']}},
+        {'op': 'not', 'content': [{'op': '>=', 'content': {
+            'fieldName': 'analysis.first_published_at', 'value': 1640926800000
+        }}]}
+    ]}
+
+    overture_chatbot.sqon.validate_sqon(sqon, VALUE_OBJECTS)
+
+
+param_validate_sqon_invalid = [
+    # unknown operator
+    {'op': 'xor', 'content': []},
+    # empty content
+    {'op': 'and', 'content': []},
+    # content of a field operation as an array
+    {'op': 'and', 'content': [{'op': 'in', 'content': [
+        {'fieldName': 'analysis.host.host_gender', 'value': ['Male']}
+    ]}]},
+    # unknown field
+    {'op': 'and', 'content': [{'op': 'in', 'content': {'fieldName': 'host.sex', 'value': ['Male']}}]},
+    # value not in the enumeration
+    {'op': 'and', 'content': [{'op': 'in', 'content': {
+        'fieldName': 'analysis.host.host_gender', 'value': ['Men']
+    }}]},
+    # non-numerical value of a numerical field
+    {'op': 'and', 'content': [{'op': '>=', 'content': {
+        'fieldName': 'analysis.first_published_at', 'value': '2022'
+    }}]},
+    # boolean value of a numerical field
+    {'op': 'and', 'content': [{'op': '>=', 'content': {
+        'fieldName': 'analysis.first_published_at', 'value': True
+    }}]}
+]
+
+@pytest.mark.parametrize(
+    'sqon_4',
+    param_validate_sqon_invalid
+)
+
+def test_validate_sqon_invalid(sqon_4):
+    """Test for overture_chatbot.sqon.validate_sqon with invalid filters"""
+    with pytest.raises(overture_chatbot.sqon.SQONValidationError):
+        overture_chatbot.sqon.validate_sqon(sqon_4, VALUE_OBJECTS)
+
+
+param_remove_field = [
+    (
+        {'op': 'and', 'content': [
+            {'op': 'in', 'content': {'fieldName': 'analysis.host.host_gender', 'value': ['Male']}},
+            {'op': 'not', 'content': [{'op': 'in', 'content': {
+                'fieldName': 'analysis.sample_collection.geo_loc_province', 'value': ['Alberta']
+            }}]}
+        ]},
+        {'op': 'and', 'content': [
+            {'op': 'in', 'content': {'fieldName': 'analysis.host.host_gender', 'value': ['Male']}}
+        ]}
+    ),
+    (
+        {'op': 'and', 'content': [{'op': 'in', 'content': {
+            'fieldName': 'analysis.sample_collection.geo_loc_province', 'value': ['Alberta']
+        }}]},
+        None
+    )
+]
+
+@pytest.mark.parametrize(
+    'sqon_5, expected_sqon_5',
+    param_remove_field
+)
+
+def test_remove_field(sqon_5, expected_sqon_5):
+    """Test for overture_chatbot.sqon.remove_field"""
+    actual_result = overture_chatbot.sqon.remove_field(
+        sqon_5, 'analysis.sample_collection.geo_loc_province'
+    )
+
+    assert actual_result == expected_sqon_5
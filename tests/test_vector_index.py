@@ -0,0 +1,101 @@
+"""Tests for overture_chatbot.vector_index"""
+
+import asyncio
+import chromadb
+import numpy as np
+import pytest
+import overture_chatbot.vector_index
+
+
+def random_collection(collection, count=50, dimensions=8):
+    """Fill a collection with random normalized embeddings"""
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(count, dimensions))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    collection.upsert(
+        ids=[f'doc_{i}' for i in range(count)],
+        embeddings=embeddings.tolist(),
+        documents=[f'document {i}' for i in range(count)],
+        metadatas=[{'schema': f'schema {i % 10}'} for i in range(count)]
+    )
+    return rng.normal(size=(3, dimensions)).tolist()
+
+
+param_numpy_collection_query = [1, 3, 100]
+
+@pytest.mark.parametrize(
+    'n_results_1',
+    param_numpy_collection_query
+)
+
+def test_numpy_collection_query(n_results_1, tmp_path):
+    """Test for overture_chatbot.vector_index.NumpyCollection.query against Chroma"""
+    # a search list longer than the collection makes the HNSW search of Chroma exact
+    chroma_collection = chromadb.EphemeralClient().get_or_create_collection(
+        f'test_{n_results_1}', metadata={'hnsw:search_ef': 100}
+    )
+    numpy_collection = overture_chatbot.vector_index.NumpyCollection(str(tmp_path / 'test'))
+    query_embeddings = random_collection(chroma_collection)
+    random_collection(numpy_collection)
+
+    expected_result = chroma_collection.query(
+        query_embeddings=query_embeddings, n_results=n_results_1, include=['metadatas', 'distances']
+    )
+    actual_result = numpy_collection.query(
+        query_embeddings=query_embeddings, n_results=n_results_1, include=['metadatas', 'distances']
+    )
+
+    assert actual_result['ids'] == expected_result['ids']
+    assert actual_result['metadatas'] == expected_result['metadatas']
+    assert np.allclose(actual_result['distances'], expected_result['distances'], atol=1e-4)
+
+
+def test_numpy_collection_save(tmp_path):
+    """Test for overture_chatbot.vector_index.NumpyCollection.save and load"""
+    collection = overture_chatbot.vector_index.NumpyCollection(str(tmp_path / 'test'))
+    query_embeddings = random_collection(collection)
+    collection.upsert(ids=['doc_0'], embeddings=[[1.0] * 8], documents=['updated'], metadatas=[{}])
+    collection.delete(ids=['doc_1', 'missing'])
+    collection.modify(metadata={'version': '2'})
+    collection.save()
+
+    loaded = overture_chatbot.vector_index.NumpyCollection.load(str(tmp_path / 'test'))
+
+    assert loaded.id == collection.id
+    assert loaded.metadata == {'version': '2'}
+    assert loaded.count() == 49
+    assert loaded.get(ids=['doc_0'], include=['documents'])['documents'] == ['updated']
+    assert loaded.get(include=['metadatas']) == collection.get(include=['metadatas'])
+    assert loaded.query(query_embeddings=query_embeddings, n_results=3) == (
+        collection.query(query_embeddings=query_embeddings, n_results=3)
+    )
+
+
+def test_get_collection_numpy(tmp_path, monkeypatch):
+    """Test for overture_chatbot.vector_index.get_collection with the 'numpy' backend"""
+    monkeypatch.setattr(overture_chatbot.vector_index.settings, 'VECTOR_PATH', str(tmp_path))
+
+    assert not overture_chatbot.vector_index.collection_exists('overture', backend='numpy')
+    with pytest.raises(ValueError):
+        overture_chatbot.vector_index.get_collection('overture', backend='numpy')
+
+    collection = overture_chatbot.vector_index.get_collection('overture', backend='numpy', create=True)
+    random_collection(collection)
+    overture_chatbot.vector_index.persist_collection(collection)
+    collection_1 = overture_chatbot.vector_index.get_collection('overture', backend='numpy')
+    collection_2 = overture_chatbot.vector_index.get_collection('overture', backend='numpy')
+
+    assert overture_chatbot.vector_index.collection_exists('overture', backend='numpy')
+    assert collection_1 is collection_2
+    assert collection_1.count() == 50
+
+
+def test_async_collection(tmp_path):
+    """Test for overture_chatbot.vector_index.AsyncCollection"""
+    collection = overture_chatbot.vector_index.NumpyCollection(str(tmp_path / 'test'))
+    query_embeddings = random_collection(collection)
+    async_collection = overture_chatbot.vector_index.AsyncCollection(collection)
+
+    actual_result = asyncio.run(async_collection.query(query_embeddings=query_embeddings, n_results=3))
+
+    assert actual_result == collection.query(query_embeddings=query_embeddings, n_results=3)